@@ -4,6 +4,7 @@
 
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conf.settings')
@@ -13,3 +14,12 @@ app = Celery('conf')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+
+@worker_process_shutdown.connect
+def close_email_connections(**kwargs):
+    """
+    Закрывает соединения пула почтовых соединений при остановке процесса воркера
+    """
+    from services.general.messages.connections import email_connection_pool
+    email_connection_pool.close_all()
@@ -13,6 +13,7 @@ from pathlib import Path
 
 from django.urls import reverse, reverse_lazy
 from dotenv import load_dotenv
+from kombu import Queue
 import os
 
 
@@ -152,7 +153,8 @@ LOGOUT_REDIRECT_URL = 'index'
 LOGIN_URL = 'users:login'
 LOGOUT_URL = 'users:logout'
 
-CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# DatabaseScheduler, который отправляет рассылки по полю next_run_at (см. services.mailshots.scheduler)
+CELERY_BEAT_SCHEDULER = 'services.mailshots.scheduler:MailshotScheduler'
 
 EMAIL_HOST = os.getenv('EMAIL_HOST')
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
@@ -160,12 +162,112 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = os.getenv('EMAIL_PORT')
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS')
 
+# пул SMTP-соединений, общий для рассылок и писем подтверждения
+EMAIL_POOL_MAX_PER_HOST = int(os.getenv('EMAIL_POOL_MAX_PER_HOST', 4))
+EMAIL_POOL_IDLE_TIMEOUT = int(os.getenv('EMAIL_POOL_IDLE_TIMEOUT', 30))
+EMAIL_POOL_HEALTH_CHECK_INTERVAL = int(os.getenv('EMAIL_POOL_HEALTH_CHECK_INTERVAL', 5))
+EMAIL_POOL_ACQUIRE_TIMEOUT = int(os.getenv('EMAIL_POOL_ACQUIRE_TIMEOUT', 60))
+
+# общий для всех воркеров лимит скорости отправки (получателей в секунду и запас)
+EMAIL_RATE_LIMIT_ENABLED = os.getenv('EMAIL_RATE_LIMIT_ENABLED', 'True') == 'True'
+EMAIL_RATE_LIMIT_HOST_RATE = float(os.getenv('EMAIL_RATE_LIMIT_HOST_RATE', 100))
+EMAIL_RATE_LIMIT_HOST_CAPACITY = int(os.getenv('EMAIL_RATE_LIMIT_HOST_CAPACITY', 500))
+EMAIL_RATE_LIMIT_USER_RATE = float(os.getenv('EMAIL_RATE_LIMIT_USER_RATE', 50))
+EMAIL_RATE_LIMIT_USER_CAPACITY = int(os.getenv('EMAIL_RATE_LIMIT_USER_CAPACITY', 500))
+# сколько секунд ждать лимита перед началом отправки, прежде чем перенести задачу
+EMAIL_RATE_LIMIT_MAX_WAIT = float(os.getenv('EMAIL_RATE_LIMIT_MAX_WAIT', 30))
+
+# circuit breaker SMTP-хоста: после THRESHOLD временных ошибок за WINDOW секунд
+# хост считается недоступным RECOVERY_TIMEOUT секунд, затем пропускается пробная отправка
+EMAIL_CIRCUIT_BREAKER_ENABLED = os.getenv('EMAIL_CIRCUIT_BREAKER_ENABLED', 'True') == 'True'
+EMAIL_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('EMAIL_CIRCUIT_FAILURE_THRESHOLD', 5))
+EMAIL_CIRCUIT_FAILURE_WINDOW = int(os.getenv('EMAIL_CIRCUIT_FAILURE_WINDOW', 60))
+EMAIL_CIRCUIT_RECOVERY_TIMEOUT = int(os.getenv('EMAIL_CIRCUIT_RECOVERY_TIMEOUT', 60))
+EMAIL_CIRCUIT_PROBE_TIMEOUT = int(os.getenv('EMAIL_CIRCUIT_PROBE_TIMEOUT', 30))
+
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/1'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/2')
+
+# Письма подтверждения регистрации и сброса пароля идут в отдельную очередь
+# transactional, рассылки - в очередь bulk, поэтому большая рассылка не задерживает
+# письма пользователям. Воркеры подписываются на очереди по отдельности
+# с разным concurrency (см. README) либо на обе сразу: тогда стратегия priority
+# транспорта redis всегда сначала забирает задачи из первой очереди в -Q
+TRANSACTIONAL_QUEUE = os.getenv('TRANSACTIONAL_QUEUE', 'transactional')
+BULK_QUEUE = os.getenv('BULK_QUEUE', 'bulk')
+CELERY_TASK_QUEUES = (
+    Queue(TRANSACTIONAL_QUEUE),
+    Queue(BULK_QUEUE),
+)
+CELERY_TASK_DEFAULT_QUEUE = BULK_QUEUE
+CELERY_TASK_ROUTES = {
+    "users.tasks.*": {"queue": TRANSACTIONAL_QUEUE},
+    "mailshots.tasks.*": {"queue": BULK_QUEUE},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {"queue_order_strategy": os.getenv('CELERY_QUEUE_ORDER_STRATEGY', 'priority')}
+# воркер не набирает впрок задачи рассылок, которые заняли бы его перед письмом подтверждения
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', 1))
 
 
 MAILSHOT_TASK_NAME = "mailshots.tasks.send_mailshot"
+# размер пачки клиентов при параллельной отправке рассылки, 0 - отправлять одной задачей
+MAILSHOT_FANOUT_BATCH_SIZE = int(os.getenv('MAILSHOT_FANOUT_BATCH_SIZE', 1000))
+# сколько получателей читается из базы и отправляется одним письмом
+MAILSHOT_RECIPIENTS_BATCH_SIZE = int(os.getenv('MAILSHOT_RECIPIENTS_BATCH_SIZE', 100))
+# envelope - одно письмо на пачку получателей, per_recipient - отдельное письмо каждому
+MAILSHOT_DELIVERY_MODE = os.getenv('MAILSHOT_DELIVERY_MODE', 'envelope')
+# сколько событий доставки накапливается перед записью в базу одним bulk_create
+MAILSHOT_EVENTS_BUFFER_SIZE = int(os.getenv('MAILSHOT_EVENTS_BUFFER_SIZE', 1000))
+# sync - отправка через пул соединений, async - одновременные SMTP-сессии на asyncio
+MAILSHOT_DELIVERY_ENGINE = os.getenv('MAILSHOT_DELIVERY_ENGINE', 'sync')
+MAILSHOT_ASYNC_CONCURRENCY = int(os.getenv('MAILSHOT_ASYNC_CONCURRENCY', 20))
+MAILSHOT_ASYNC_TIMEOUT = int(os.getenv('MAILSHOT_ASYNC_TIMEOUT', 30))
+# повторы отправки после временных ошибок: экспоненциальная задержка со случайным разбросом
+MAILSHOT_MAX_RETRIES = int(os.getenv('MAILSHOT_MAX_RETRIES', 5))
+MAILSHOT_RETRY_BACKOFF = int(os.getenv('MAILSHOT_RETRY_BACKOFF', 30))
+MAILSHOT_RETRY_BACKOFF_MAX = int(os.getenv('MAILSHOT_RETRY_BACKOFF_MAX', 1800))
+# время жизни блокировки запуска рассылки, продлевается по ходу отправки
+# и перед повтором задачи - на время задержки повтора
+MAILSHOT_RUN_LEASE = int(os.getenv('MAILSHOT_RUN_LEASE', 600))
+# допуск на расхождение часов при определении слота расписания запуска
+MAILSHOT_RUN_SLOT_GRACE = int(os.getenv('MAILSHOT_RUN_SLOT_GRACE', 60))
+# время хранения в кеше собранного MIME-представления сообщения рассылки
+MAILSHOT_PAYLOAD_CACHE_LIFETIME = int(os.getenv('MAILSHOT_PAYLOAD_CACHE_LIFETIME', 60 * 60 * 24))
+# как часто истёкшие рассылки переводятся в статус "завершена", с
+MAILSHOT_EXPIRY_SWEEP_INTERVAL = int(os.getenv('MAILSHOT_EXPIRY_SWEEP_INTERVAL', 300))
+# как часто счётчики статистики главной страницы сверяются с таблицами, с
+MAILSHOT_COUNTERS_RECONCILE_INTERVAL = int(os.getenv('MAILSHOT_COUNTERS_RECONCILE_INTERVAL', 60 * 60))
+# тег clients_amount показывает оценку HyperLogLog из Redis вместо точного счётчика
+CLIENTS_AMOUNT_ESTIMATE = os.getenv('CLIENTS_AMOUNT_ESTIMATE', 'False') == 'True'
+# как часто оценка пересобирается по таблице клиентов (удалённые клиенты из неё не вычитаются), с
+CLIENTS_ESTIMATE_REBUILD_INTERVAL = int(os.getenv('CLIENTS_ESTIMATE_REBUILD_INTERVAL', 60 * 60 * 24))
+# сколько может длиться пересборка, пока новые email пишутся и в пересобираемый ключ, с
+CLIENTS_ESTIMATE_REBUILD_TIMEOUT = int(os.getenv('CLIENTS_ESTIMATE_REBUILD_TIMEOUT', 60 * 60))
+# окно, на которое beat заранее выбирает рассылки к отправке, с
+MAILSHOT_SCHEDULER_WINDOW = int(os.getenv('MAILSHOT_SCHEDULER_WINDOW', 30))
+# сколько рассылок выбирается и публикуется одной транзакцией
+MAILSHOT_SCHEDULER_BATCH_SIZE = int(os.getenv('MAILSHOT_SCHEDULER_BATCH_SIZE', 500))
+
+# DatabaseScheduler записывает эти задачи в таблицы django_celery_beat при запуске beat
+CELERY_BEAT_SCHEDULE = {
+    "expire_mailshots": {
+        "task": "mailshots.tasks.expire_mailshots",
+        "schedule": MAILSHOT_EXPIRY_SWEEP_INTERVAL,
+    },
+    "reconcile_counters": {
+        "task": "mailshots.tasks.reconcile_counters",
+        "schedule": MAILSHOT_COUNTERS_RECONCILE_INTERVAL,
+    },
+    "rebuild_clients_estimate": {
+        "task": "mailshots.tasks.rebuild_clients_estimate",
+        "schedule": CLIENTS_ESTIMATE_REBUILD_INTERVAL,
+    },
+}
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379')
+REDIS_KEY_PREFIX = 'mailshots'
 
 CACHE_ENABLED = True
 
@@ -173,6 +275,6 @@ if CACHE_ENABLED:
     CACHES = {
         "default": {
             "BACKEND": "django.core.cache.backends.redis.RedisCache",
-            "LOCATION": "redis://127.0.0.1:6379",
+            "LOCATION": REDIS_URL,
         }
     }
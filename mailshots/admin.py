@@ -1,5 +1,6 @@
 from django.contrib import admin
-from mailshots.models import Client, Message, Log, MailshotPeriodicTask
+from mailshots.models import Client, Message, Log, MailshotPeriodicTask, DeliveryEvent, OutboxMessage, \
+    StatisticsCounter, MailshotDeliveryRollup, UserDeliveryRollup
 
 
 # Register your models here.
@@ -18,6 +19,7 @@ class MailshotPeriodicTaskAdmin(admin.ModelAdmin):
     fields = ("defined_name",
               "frequency",
               "is_new",
+              "status",
               "clients",
               "message",
               "user",
@@ -27,9 +29,39 @@ class MailshotPeriodicTaskAdmin(admin.ModelAdmin):
               "crontab",
               "enabled",
               )
-    readonly_fields = ("created_at",)
+    # расписание вычисляется по времени начала и частоте и может быть общим для нескольких рассылок
+    # статус вычисляется при сохранении по флагам enabled и is_new
+    readonly_fields = ("created_at", "crontab", "status")
 
 
 @admin.register(Log)
 class LogAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(DeliveryEvent)
+class DeliveryEventAdmin(admin.ModelAdmin):
+    list_display = ("mailshot", "client", "status_code", "created_at")
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("pk", "task", "kwargs", "created_at")
+
+
+@admin.register(StatisticsCounter)
+class StatisticsCounterAdmin(admin.ModelAdmin):
+    list_display = ("name", "value", "updated_at")
+    readonly_fields = ("name", "value", "updated_at")
+
+
+@admin.register(MailshotDeliveryRollup)
+class MailshotDeliveryRollupAdmin(admin.ModelAdmin):
+    list_display = ("mailshot", "period", "period_start", "runs", "delivered", "failed", "success_rate")
+    list_filter = ("period",)
+
+
+@admin.register(UserDeliveryRollup)
+class UserDeliveryRollupAdmin(admin.ModelAdmin):
+    list_display = ("user", "period", "period_start", "runs", "delivered", "failed", "success_rate")
+    list_filter = ("period",)
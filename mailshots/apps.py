@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class MailshotsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mailshots'
+
+    def ready(self):
+        from services.mailshots.counters import connect_counters
+        from services.mailshots.estimates import connect_estimates
+        from services.mailshots.periodic import connect_signals
+        connect_signals()
+        connect_counters()
+        connect_estimates()
@@ -1,5 +1,6 @@
 
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.forms import ModelForm, ModelMultipleChoiceField, Form, HiddenInput, Select, ModelChoiceField, CharField
 
@@ -8,6 +9,8 @@ from django_celery_beat.models import CrontabSchedule
 
 from mailshots.models import Message, Client, MailshotPeriodicTask
 from services.general.form_mixins import FormControlMixin
+from services.general.messages.merge import MERGE_FIELDS, MergeTemplate
+from services.general.messages.mime import invalidate_payload
 
 
 class MessageForm(FormControlMixin, ModelForm):
@@ -18,6 +21,33 @@ class MessageForm(FormControlMixin, ModelForm):
         model = Message
         exclude = ["user"]
 
+    def save(self, commit=True):
+        """
+        При изменении сообщения закешированное MIME-представление
+        его прежней версии больше не нужно
+        """
+        if self.instance.pk and {"subject", "body"} & set(self.changed_data):
+            invalidate_payload(
+                self.initial.get("subject"), self.initial.get("body"), settings.EMAIL_HOST_USER
+            )
+        return super().save(commit)
+
+    @staticmethod
+    def validate_merge_fields(text):
+        unknown_fields = MergeTemplate(text).unknown_fields
+        if unknown_fields:
+            raise ValidationError(
+                "Неизвестные поля подстановки: %s. Доступные поля: %s"
+                % (", ".join(unknown_fields), ", ".join(MERGE_FIELDS))
+            )
+        return text
+
+    def clean_subject(self):
+        return self.validate_merge_fields(self.cleaned_data.get("subject"))
+
+    def clean_body(self):
+        return self.validate_merge_fields(self.cleaned_data.get("body"))
+
 
 class ClientsChoseForm(FormControlMixin, Form):
     """
@@ -46,7 +76,7 @@ class MailshotPeriodicTaskForm(FormControlMixin, ModelForm):
 
     class Meta:
         model = MailshotPeriodicTask
-        fields = ["defined_name", "start_time", "expires", "frequency"]
+        fields = ["defined_name", "start_time", "expires", "frequency", "delivery_window"]
 
     def clean_expires(self):
         expires = self.cleaned_data.get("expires")
@@ -0,0 +1,93 @@
+import statistics
+import time
+import uuid
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from mailshots.models import Client, StatisticsCounter
+from services.general.redis import get_redis, make_key
+from services.mailshots.estimates import get_estimate, rebuild
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ("Сравнение подсчёта уникальных email клиентов: DISTINCT по таблице клиентов, "
+            "счётчик StatisticsCounter и оценка HyperLogLog в Redis")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=100_000,
+                            help="сколько временных клиентов добавить к существующим")
+        parser.add_argument("--users", type=int, default=100,
+                            help="между сколькими пользователями распределить временных клиентов")
+        parser.add_argument("--duplicates", type=float, default=0.3,
+                            help="доля временных клиентов с email, уже добавленным другим пользователем")
+        parser.add_argument("--repeat", type=int, default=20, help="сколько раз повторять каждый подсчёт")
+
+    @staticmethod
+    def measure(func, repeat: int) -> tuple[object, float]:
+        """
+        Результат func и медиана времени вызова, мс
+        """
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return result, statistics.median(timings) * 1000
+
+    @staticmethod
+    def count_distinct() -> int:
+        # DISTINCT ON поддерживается только postgresql
+        if connection.features.can_distinct_on_fields:
+            return Client.objects.all().order_by("email").distinct("email").count()
+        return Client.objects.values("email").distinct().count()
+
+    def create_clients(self, options):
+        """
+        Временные клиенты; часть email повторяется у разных пользователей
+        """
+        marker = uuid.uuid4().hex[:12]
+        users = User.objects.bulk_create(
+            [User(email=f"benchmark-{marker}-{i}@example.invalid", is_active=False) for i in range(options["users"])]
+        )
+        unique = max(int(options["clients"] * (1 - options["duplicates"])), 1)
+        Client.objects.bulk_create(
+            [Client(email=f"client{i % unique}-{marker}@example.invalid", user=users[i // unique % len(users)])
+             for i in range(options["clients"])],
+            batch_size=5000,
+        )
+
+    def handle(self, *args, **options):
+        key = make_key("benchmark", "clients", uuid.uuid4().hex)
+        redis_client = get_redis()
+
+        # временные клиенты не фиксируются: транзакция откатывается после замера
+        with transaction.atomic():
+            self.create_clients(options)
+
+            exact, exact_ms = self.measure(self.count_distinct, options["repeat"])
+            _, counter_ms = self.measure(
+                lambda: StatisticsCounter.get_value(StatisticsCounter.Name.CLIENT_EMAILS), options["repeat"]
+            )
+
+            try:
+                start = time.perf_counter()
+                rebuild(key=key)
+                rebuild_s = time.perf_counter() - start
+                estimate, estimate_ms = self.measure(lambda: get_estimate(key), options["repeat"])
+                # HyperLogLog хранится строкой Redis
+                size = redis_client.strlen(key)
+            finally:
+                redis_client.delete(key)
+
+            total = Client.objects.count()
+            transaction.set_rollback(True)
+
+        error = (estimate - exact) / exact * 100 if exact else 0
+        self.stdout.write(f"Клиентов: {total}, уникальных email: {exact}")
+        self.stdout.write(f"DISTINCT по таблице клиентов   {exact_ms:10.3f} мс")
+        self.stdout.write(f"StatisticsCounter              {counter_ms:10.3f} мс")
+        self.stdout.write(f"HyperLogLog (PFCOUNT)          {estimate_ms:10.3f} мс, оценка {estimate}, "
+                          f"ошибка {error:+.2f}%, {size} байт в Redis")
+        self.stdout.write(f"Пересборка HyperLogLog         {rebuild_s:10.3f} с")
@@ -0,0 +1,74 @@
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.template import loader
+from django.test.utils import override_settings
+
+from services.general.messages.merge import MERGE_FIELDS, MergeTemplate
+
+
+DEFAULT_BODY = (
+    "Здравствуйте, {{ surname }} {{ name }} {{ patronymic }}!\n\n"
+    "Напоминаем, что рассылка приходит на адрес {{ email }}.\n"
+    "Чтобы отписаться, ответьте на это письмо."
+)
+
+
+class Command(BaseCommand):
+    help = ("Сравнение скорости подстановки полей в текст сообщения: "
+            "скомпилированный MergeTemplate против loader.render_to_string")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=100_000, help="количество получателей")
+        parser.add_argument("--batch-size", type=int, default=settings.MAILSHOT_RECIPIENTS_BATCH_SIZE,
+                            help="размер пачки получателей для MergeTemplate.render_many")
+        parser.add_argument("--body", default=DEFAULT_BODY, help="текст сообщения с полями подстановки")
+
+    @staticmethod
+    def get_rows(count: int) -> list[tuple]:
+        return [(f"client{i}@example.com", f"Имя{i}", f"Фамилия{i}", None if i % 3 else f"Отчество{i}")
+                for i in range(count)]
+
+    def bench_merge_template(self, body: str, rows: list[tuple], batch_size: int) -> tuple[float, list[str]]:
+        start = time.perf_counter()
+        template = MergeTemplate(body)
+        rendered = []
+        for i in range(0, len(rows), batch_size):
+            rendered.extend(template.render_many(rows[i:i + batch_size]))
+        return time.perf_counter() - start, rendered
+
+    def bench_render_to_string(self, body: str, rows: list[tuple]) -> tuple[float, list[str]]:
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, "merge_benchmark.txt").write_text(body, encoding="utf-8")
+            templates = [{
+                "BACKEND": "django.template.backends.django.DjangoTemplates",
+                "DIRS": [directory],
+                "OPTIONS": {"autoescape": False},
+            }]
+
+            with override_settings(TEMPLATES=templates):
+                start = time.perf_counter()
+                rendered = [loader.render_to_string("merge_benchmark.txt", dict(zip(MERGE_FIELDS, row)))
+                            for row in rows]
+                return time.perf_counter() - start, rendered
+
+    def handle(self, *args, **options):
+        rows = self.get_rows(options["recipients"])
+        body = options["body"]
+
+        merge_time, merged = self.bench_merge_template(body, rows, options["batch_size"])
+        django_time, rendered = self.bench_render_to_string(body, rows)
+
+        # render_to_string выводит None как "None", MergeTemplate - как пустую строку
+        mismatches = sum(a != b.replace("None", "") for a, b in zip(merged, rendered))
+
+        self.stdout.write(f"Получателей: {len(rows)}")
+        for name, elapsed in (("MergeTemplate", merge_time), ("loader.render_to_string", django_time)):
+            self.stdout.write(f"{name:<24} {elapsed:8.3f} с  {elapsed / len(rows) * 1e6:8.2f} мкс/получатель")
+        self.stdout.write(f"Ускорение: x{django_time / merge_time:.1f}")
+
+        if mismatches:
+            self.stdout.write(self.style.WARNING(f"Результаты различаются для {mismatches} получателей"))
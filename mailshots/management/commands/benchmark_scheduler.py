@@ -0,0 +1,110 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django_celery_beat.schedulers import DatabaseScheduler
+
+from conf.celery import app
+from services.mailshots.benchmark import QueryTimer, synthetic_schedule, utc_midnight
+from services.mailshots.scheduler import MailshotScheduler, claim_due_mailshots
+
+
+class Command(BaseCommand):
+    help = ("Сравнение планировщиков beat на временных рассылках: DatabaseScheduler, "
+            "загружающий все задачи, против выборки рассылок по next_run_at (MailshotScheduler)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, nargs="+", default=[10_000, 100_000],
+                            help="количество рассылок, для каждого замер выполняется отдельно")
+        parser.add_argument("--window", type=int, default=settings.MAILSHOT_SCHEDULER_WINDOW,
+                            help="окно выборки рассылок MailshotScheduler, с")
+
+    @staticmethod
+    def measure(func):
+        """
+        Результат, время и количество запросов при вызове func
+        """
+        with QueryTimer().timing() as queries:
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        return result, elapsed, queries.queries
+
+    @staticmethod
+    def measure_memory(func) -> float:
+        """
+        Пик памяти (МБ), выделенной при вызове func. Замеряется отдельным
+        вызовом: tracemalloc в разы замедляет выполнение
+        """
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    def bench_database_scheduler(self) -> dict:
+        scheduler = DatabaseScheduler(app=app, lazy=True)
+        schedule, load_time, load_queries = self.measure(scheduler.all_as_schedule)
+        memory = self.measure_memory(scheduler.all_as_schedule)
+
+        # после каждой перезагрузки расписания beat заново проверяет все задачи (Scheduler.populate_heap)
+        start = time.perf_counter()
+        for entry in schedule.values():
+            entry.is_due()
+        check_time = time.perf_counter() - start
+
+        return dict(entries=len(schedule), load_time=load_time, load_queries=load_queries,
+                    memory=memory, check_time=check_time)
+
+    def bench_mailshot_scheduler(self, moment, window: int) -> dict:
+        scheduler = MailshotScheduler(app=app, lazy=True)
+        schedule, load_time, load_queries = self.measure(scheduler.all_as_schedule)
+        memory = self.measure_memory(scheduler.all_as_schedule)
+
+        # выборка и сдвиг next_run_at откатываются, чтобы замер не менял данные
+        with transaction.atomic():
+            claimed, claim_time, claim_queries = self.measure(
+                lambda: claim_due_mailshots(moment + timedelta(seconds=window), moment)
+            )
+            transaction.set_rollback(True)
+
+        return dict(entries=len(schedule), load_time=load_time, load_queries=load_queries,
+                    memory=memory, claimed=len(claimed), claim_time=claim_time, claim_queries=claim_queries)
+
+    @staticmethod
+    def get_schedules(count: int, day) -> list[tuple]:
+        """
+        Рассылки, время начала которых равномерно распределено по суткам day
+        """
+        frequencies = ["DAILY", "WEEKLY", "MONTHLY"]
+        return [(day + timedelta(minutes=i * 24 * 60 // count), frequencies[i % len(frequencies)],
+                 day + timedelta(days=365), 0)
+                for i in range(count)]
+
+    def handle(self, *args, **options):
+        # следующие сутки: запущенный beat не успеет отправить временные рассылки
+        day = utc_midnight(timezone.now() + timedelta(days=1))
+
+        for count in options["tasks"]:
+            self.stdout.write(f"Рассылок: {count}, создание временных данных...")
+            with synthetic_schedule(self.get_schedules(count, day)):
+                stock = self.bench_database_scheduler()
+                # тик в начале суток временных рассылок: в окно попадают рассылки первых минут
+                due_only = self.bench_mailshot_scheduler(day, options["window"])
+
+            self.stdout.write(
+                f"  DatabaseScheduler  загрузка: {stock['load_time']:8.3f} с, {stock['load_queries']} запросов, "
+                f"{stock['memory']:.1f} МБ, задач в памяти: {stock['entries']}; "
+                f"проверка всех задач: {stock['check_time']:.3f} с"
+            )
+            self.stdout.write(
+                f"  MailshotScheduler  загрузка: {due_only['load_time']:8.3f} с, {due_only['load_queries']} запросов, "
+                f"{due_only['memory']:.1f} МБ, задач в памяти: {due_only['entries']}; "
+                f"выборка окна {options['window']} с: {due_only['claim_time']:.3f} с, "
+                f"{due_only['claim_queries']} запросов, рассылок: {due_only['claimed']}"
+            )
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+
+from services.mailshots.crontabs import collect_orphan_crontabs
+
+
+class Command(BaseCommand):
+    help = "Удаление расписаний crontab, которые не использует ни одна периодическая задача"
+
+    def handle(self, *args, **options):
+        deleted = collect_orphan_crontabs()
+        self.stdout.write(f"Удалено расписаний: {deleted}")
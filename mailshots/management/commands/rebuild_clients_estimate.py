@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from services.mailshots.estimates import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересборка оценки количества уникальных email клиентов (HyperLogLog в Redis) по таблице клиентов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10_000,
+                            help="сколько email читается из базы и добавляется в оценку за раз")
+
+    def handle(self, *args, **options):
+        estimate = rebuild(batch_size=options["batch_size"])
+        self.stdout.write(f"Оценка количества уникальных email: {estimate}")
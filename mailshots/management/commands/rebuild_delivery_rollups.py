@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from services.mailshots.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересборка итогов отправок рассылок по часам и суткам из логов отправок"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int,
+                            help="пересобрать итоги только за последние days суток (по умолчанию - за всю историю)")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="сколько строк итогов записывается за раз")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options["days"] - 1) if options["days"] else None
+        written = rebuild(since=since, batch_size=options["batch_size"])
+        for model_name, count in written.items():
+            self.stdout.write(f"{model_name}: {count}")
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management import BaseCommand
+from kombu.exceptions import OperationalError
+
+from services.mailshots.outbox import relay_batch
+
+
+class Command(BaseCommand):
+    help = "Публикация задач из таблицы outbox в брокер celery"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="сколько задач публиковать за одну транзакцию")
+        parser.add_argument("--interval", type=float, default=1,
+                            help="пауза между проверками пустой таблицы, с")
+        parser.add_argument("--once", action="store_true",
+                            help="опубликовать накопившиеся задачи и завершиться")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                published = relay_batch(options["batch_size"])
+            except OperationalError as e:
+                # брокер недоступен: транзакция откатилась, задачи остались в таблице
+                self.stderr.write(f"Брокер недоступен: {e}")
+                published = 0
+                if options["once"]:
+                    raise
+
+            if published:
+                self.stdout.write(f"Опубликовано задач: {published}")
+                if published == options["batch_size"]:
+                    continue
+
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -1,19 +1,252 @@
-from django.core.management import BaseCommand
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from mailshots.models import Log, MailshotPeriodicTask
+from services.general.messages.resilience import CircuitOpen
+from services.mailshots.runs import MailshotRunGuard
+from services.mailshots.selection import get_due_mailshots, get_failed_mailshots
 from services.mailshots.senders import MailshotSender
 
 
+EMAIL_BACKENDS = {
+    "locmem": "django.core.mail.backends.locmem.EmailBackend",
+    "file": "django.core.mail.backends.filebased.EmailBackend",
+    "smtp": "django.core.mail.backends.smtp.EmailBackend",
+}
+
+
 class Command(BaseCommand):
     help = "Запуск рассылки вручную"
 
     def add_arguments(self, parser):
         parser.add_argument(
-            nargs="+",
+            nargs="*",
             type=int,
             dest='args'
         )
+        parser.add_argument("--user", help="рассылки пользователя (pk или email)")
+        parser.add_argument("--due", action="store_true",
+                            help="рассылки, последняя отправка которых по расписанию ещё не выполнена")
+        parser.add_argument("--failed-since", type=self.parse_moment,
+                            help="рассылки, последняя отправка которых начиная с даты (YYYY-MM-DD "
+                                 "или YYYY-MM-DDTHH:MM) завершилась неудачно")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="сколько рассылок отправлять одновременно "
+                                 "(не больше EMAIL_POOL_MAX_PER_HOST)")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="только показать выбранные рассылки")
+
+        benchmark = parser.add_argument_group(
+            "замер производительности",
+            "рассылка отправляется без записи лога, результат выводится в json"
+        )
+        benchmark.add_argument("--benchmark", action="store_true",
+                               help="замерить скорость отправки рассылки")
+        benchmark.add_argument("--recipients", type=int,
+                               help="отправить временную рассылку на указанное количество "
+                                    "сгенерированных клиентов вместо существующей")
+        benchmark.add_argument("--backend", choices=EMAIL_BACKENDS, default="locmem",
+                               help="почтовый бэкенд, через который идёт отправка")
+        benchmark.add_argument("--smtp-host", default="127.0.0.1",
+                               help="хост SMTP-сервера для --backend smtp (например, smtp_sink)")
+        benchmark.add_argument("--smtp-port", type=int, default=8025)
+        benchmark.add_argument("--engine", choices=["sync", "async"],
+                               help="способ отправки, по умолчанию MAILSHOT_DELIVERY_ENGINE")
+        benchmark.add_argument("--mode", choices=["envelope", "per_recipient"],
+                               help="письмо на пачку или на получателя, по умолчанию MAILSHOT_DELIVERY_MODE")
+        benchmark.add_argument("--batch-size", type=int,
+                               help="размер пачки получателей, по умолчанию MAILSHOT_RECIPIENTS_BATCH_SIZE")
+        benchmark.add_argument("--concurrency", type=int,
+                               help="количество SMTP-сессий асинхронного способа отправки")
+        benchmark.add_argument("--rate-limit", action="store_true",
+                               help="соблюдать общий лимит скорости отправки")
+        benchmark.add_argument("--output", help="дописать результат в файл (json lines)")
 
     def handle(self, *args, **options):
-        pk = args[0]
-        response = MailshotSender(pk=pk)()
+        if options["benchmark"]:
+            return self.benchmark(*args, **options)
+
+        pks = self.get_mailshot_pks(args, options)
+        if not pks:
+            self.stdout.write("Нет рассылок для отправки")
+            return
+
+        if options["dry_run"]:
+            for pk, name in MailshotPeriodicTask.objects.filter(pk__in=pks).values_list("pk", "defined_name"):
+                self.stdout.write(f"{pk}\t{name}")
+            return
+
+        with ThreadPoolExecutor(max_workers=self.get_workers(options)) as executor:
+            rows = list(executor.map(self.send_one, pks))
+
+        self.write_summary(rows)
+
+    def get_workers(self, options) -> int:
+        """
+        Количество потоков отправки. Каждый поток занимает соединение пула на всю
+        отправку рассылки, поэтому потоки сверх EMAIL_POOL_MAX_PER_HOST только ждали бы
+        соединения и завершались ошибкой по EMAIL_POOL_ACQUIRE_TIMEOUT
+        """
+        workers = max(options["workers"], 1)
+        if workers > settings.EMAIL_POOL_MAX_PER_HOST:
+            self.stderr.write(self.style.WARNING(
+                f"--workers {workers} уменьшено до EMAIL_POOL_MAX_PER_HOST={settings.EMAIL_POOL_MAX_PER_HOST}"
+            ))
+            workers = settings.EMAIL_POOL_MAX_PER_HOST
+        return workers
+
+    @staticmethod
+    def parse_moment(value: str):
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            moment = parse_datetime(f"{day.isoformat()}T00:00")
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def get_mailshot_pks(self, args, options) -> list[int]:
+        """
+        pk рассылок для отправки: переданные явно и/или выбранные фильтрами.
+        Несколько условий сужают выборку
+        """
+        filtered = args or options["user"] or options["due"] or options["failed_since"]
+        if not filtered:
+            raise CommandError("Укажите pk рассылок или фильтр: --user, --due, --failed-since")
+
+        queryset = MailshotPeriodicTask.objects.all()
+        if args:
+            queryset = queryset.filter(pk__in=args)
+        if options["user"]:
+            user = options["user"]
+            queryset = queryset.filter(user__email=user) if "@" in user else queryset.filter(user_id=user)
+
+        pks = list(queryset.order_by("pk").values_list("pk", flat=True))
+        missing = set(args) - set(pks)
+        if missing:
+            self.stderr.write(f"Рассылки не найдены: {', '.join(map(str, sorted(missing)))}")
+
+        if options["due"]:
+            due = set(get_due_mailshots(queryset))
+            pks = [pk for pk in pks if pk in due]
+        if options["failed_since"]:
+            failed = set(get_failed_mailshots(options["failed_since"], queryset))
+            pks = [pk for pk in pks if pk in failed]
+        return pks
+
+    def send_one(self, pk: int) -> dict:
+        """
+        Отправка одной рассылки в потоке пула. У каждого потока своё
+        соединение с базой, которое закрывается по окончании отправки.
+        Рассылка, отправка которой уже идёт, и рассылка при разомкнутом
+        circuit breaker SMTP-хоста пропускаются
+        """
+        start = time.monotonic()
+        row = dict(pk=pk, name="", status="", delivered=0, failed=0, response="")
+        try:
+            sender = MailshotSender(pk=pk)
+            row["name"] = sender.mailshot.defined_name
+
+            guard = MailshotRunGuard(sender.mailshot, token=uuid4().hex)
+            if not guard.acquire_lease():
+                row |= dict(status="skipped", response=MailshotRunGuard.OVERLAP)
+                return row
+
+            sender.run_guard = guard
+            try:
+                result = sender.deliver_and_log()
+            except CircuitOpen as e:
+                row |= dict(status="skipped", response=str(e))
+                return row
+            finally:
+                guard.release()
+            row |= result
+        except Exception as e:
+            row |= dict(status="error", response=repr(e))
+        finally:
+            row["elapsed"] = time.monotonic() - start
+            connection.close()
+        return row
+
+    def write_summary(self, rows: list[dict]):
+        name_width = max([len("Рассылка"), *(len(row["name"]) for row in rows)])
+        header = f"{'pk':>6}  {'Рассылка':<{name_width}}  {'Статус':<8}  {'Дост.':>7}  {'Недост.':>7}  {'Время':>8}  Ответ"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+
+        for row in rows:
+            line = (f"{row['pk']:>6}  {row['name']:<{name_width}}  {row['status']:<8}  "
+                    f"{row['delivered']:>7}  {row['failed']:>7}  {row['elapsed']:>7.1f}s  {row['response']}")
+            style = self.style.SUCCESS if row["status"] == Log.Status.OK else self.style.ERROR
+            self.stdout.write(style(line))
+
+        ok = sum(row["status"] == Log.Status.OK for row in rows)
+        self.stdout.write(
+            f"Всего: {len(rows)}, успешно: {ok}, неуспешно: {len(rows) - ok}, "
+            f"доставлено писем: {sum(row['delivered'] for row in rows)}, "
+            f"не доставлено: {sum(row['failed'] for row in rows)}"
+        )
+
+    def get_sender_attrs(self, options) -> dict:
+        attrs = {
+            "delivery_engine": options["engine"],
+            "delivery_mode": options["mode"],
+            "recipients_batch_size": options["batch_size"],
+            "async_concurrency": options["concurrency"],
+        }
+        return {name: value for name, value in attrs.items() if value is not None}
+
+    def get_email_settings(self, options, directory: str) -> dict:
+        email_settings = {
+            "EMAIL_BACKEND": EMAIL_BACKENDS[options["backend"]],
+            "EMAIL_FILE_PATH": directory,
+            # circuit breaker хранит состояние в redis и не должен влиять на замер
+            "EMAIL_CIRCUIT_BREAKER_ENABLED": False,
+        }
+        if options["backend"] == "smtp":
+            email_settings |= {
+                "EMAIL_HOST": options["smtp_host"],
+                "EMAIL_PORT": options["smtp_port"],
+                "EMAIL_HOST_USER": "",
+                "EMAIL_HOST_PASSWORD": "",
+                "EMAIL_USE_TLS": False,
+            }
+        return email_settings
+
+    def benchmark(self, *args, **options):
+        from services.mailshots.benchmark import run_benchmark, synthetic_mailshot
+
+        if options["engine"] == "async" and options["backend"] != "smtp":
+            raise CommandError("Асинхронный способ отправки работает только с --backend smtp")
+        if options["recipients"] is None and not args:
+            raise CommandError("Укажите pk рассылки или --recipients")
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(**self.get_email_settings(options, directory)):
+            if options["recipients"] is not None:
+                with synthetic_mailshot(options["recipients"]) as mailshot:
+                    result = run_benchmark(mailshot.pk, options["rate_limit"], **self.get_sender_attrs(options))
+                result["synthetic"] = True
+            else:
+                result = run_benchmark(args[0], options["rate_limit"], **self.get_sender_attrs(options))
+                result["synthetic"] = False
+
+        result["backend"] = options["backend"]
+        output = json.dumps(result, ensure_ascii=False)
 
-        self.stdout.write(str(response))
+        if options["output"]:
+            with open(options["output"], "a", encoding="utf-8") as file:
+                file.write(output + "\n")
+        self.stdout.write(output)
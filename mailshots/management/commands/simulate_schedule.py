@@ -0,0 +1,80 @@
+import json
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from services.mailshots.benchmark import synthetic_schedule, utc_midnight
+from services.mailshots.simulation import (SimulationSettings, build_report, generate_durations,
+                                           generate_schedules, run_simulation)
+
+
+class Command(BaseCommand):
+    help = ("Моделирование отправки синтетических рассылок планировщиком MailshotScheduler "
+            "на виртуальных часах: отправки в минуту, одновременные отправки, затраты на тик")
+
+    def add_arguments(self, parser):
+        defaults = SimulationSettings()
+        parser.add_argument("--mailshots", type=int, default=defaults.mailshots, help="количество рассылок")
+        parser.add_argument("--days", type=int, default=defaults.days, help="моделируемый период, сутки")
+        parser.add_argument("--tick", type=int, default=settings.MAILSHOT_SCHEDULER_WINDOW,
+                            help="шаг виртуальных часов и окно выборки планировщика, с")
+        parser.add_argument("--window-share", type=float, default=defaults.window_share,
+                            help="доля рассылок с окном отправки")
+        parser.add_argument("--delivery-window", type=int, default=defaults.delivery_window,
+                            help="окно отправки этих рассылок, мин")
+        parser.add_argument("--recipients", type=int, default=defaults.recipients,
+                            help="медиана количества получателей рассылки")
+        parser.add_argument("--send-rate", type=float, default=defaults.send_rate,
+                            help="скорость отправки одной рассылки, писем в секунду")
+        parser.add_argument("--new-share", type=float, default=defaults.new_share,
+                            help="доля рассылок, начинающихся в течение периода")
+        parser.add_argument("--expiring-share", type=float, default=defaults.expiring_share,
+                            help="доля рассылок, заканчивающихся в течение периода")
+        parser.add_argument("--seed", type=int, help="начальное значение генератора случайных чисел")
+        parser.add_argument("--output", help="дописать результат в файл (json lines)")
+
+    def handle(self, *args, **options):
+        simulation = SimulationSettings(**{name: options[name] for name in SimulationSettings.__dataclass_fields__})
+        rng = random.Random(simulation.seed)
+
+        # период через год: запущенный beat не отправит временные рассылки
+        start = utc_midnight(timezone.now() + timedelta(days=366))
+        schedules = generate_schedules(simulation, start, rng)
+
+        self.stdout.write(f"Рассылок: {simulation.mailshots}, создание временных данных...")
+        # изменения расписания откатываются, даже если временные данные не удалось удалить
+        with transaction.atomic():
+            with synthetic_schedule(schedules, moment=start - timedelta(microseconds=1)) as mailshots:
+                durations = generate_durations(list(mailshots.values_list("pk", flat=True)), simulation, rng)
+                self.stdout.write(f"Моделирование {simulation.days} суток с шагом {simulation.tick} с...")
+                fired, stats = run_simulation(start, simulation, mailshots)
+            transaction.set_rollback(True)
+
+        report = build_report(fired, stats, durations, simulation)
+        self.write_report(report)
+
+        if options["output"]:
+            with open(options["output"], "a", encoding="utf-8") as file:
+                file.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    def write_report(self, report: dict):
+        per_minute = report["fires_per_minute"]
+        cpu = report["tick_cpu"]
+        queries = report["tick_queries"]
+
+        self.stdout.write(f"Тиков: {report['ticks']}, отправок: {report['fires']}")
+        self.stdout.write(f"Отправок в минуту: среднее {per_minute['mean']}, p50 {per_minute['p50']}, "
+                          f"p99 {per_minute['p99']}, максимум {per_minute['max']}")
+        for minute, count in per_minute["busiest"]:
+            self.stdout.write(f"  {minute}  {count}")
+        self.stdout.write(f"Одновременных отправок: максимум {report['peak_concurrency']} "
+                          f"({report['peak_concurrency_at']})")
+        if cpu:
+            self.stdout.write(f"Процессорное время тика: p50 {cpu['p50_ms']} мс, p95 {cpu['p95_ms']} мс, "
+                              f"p99 {cpu['p99_ms']} мс, максимум {cpu['max_ms']} мс, всего {cpu['total_s']} с")
+        self.stdout.write(f"Запросов к базе за тик: среднее {queries['mean']}, максимум {queries['max']}, "
+                          f"всего {queries['total']}")
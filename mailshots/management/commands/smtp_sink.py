@@ -0,0 +1,71 @@
+import asyncio
+import json
+import signal
+
+from django.core.management import BaseCommand
+
+from services.general.messages.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = ("Локальный SMTP-сервер для нагрузочного тестирования отправки: "
+            "принимает письма, добавляет задержки и ошибки, собирает статистику")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8025)
+        parser.add_argument("--latency", type=float, default=0, help="задержка каждого ответа, мс")
+        parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+        parser.add_argument("--temp-failure-rate", type=float, default=0,
+                            help="доля ответов 4xx на RCPT и DATA, от 0 до 1")
+        parser.add_argument("--perm-failure-rate", type=float, default=0,
+                            help="доля ответов 5xx на RCPT и DATA, от 0 до 1")
+        parser.add_argument("--drop-rate", type=float, default=0,
+                            help="вероятность оборвать соединение вместо ответа на команду")
+        parser.add_argument("--connection-rate", type=float, default=0,
+                            help="максимум писем в секунду на соединение, 0 - без ограничения")
+        parser.add_argument("--max-messages-per-connection", type=int, default=0,
+                            help="после стольких писем соединение закрывается с кодом 421")
+        parser.add_argument("--stats-file", help="файл для статистики по каждому письму (json lines)")
+        parser.add_argument("--stats-interval", type=float, default=10,
+                            help="как часто выводить сводную статистику, с; 0 - только при остановке")
+        parser.add_argument("--seed", type=int, help="начальное значение генератора случайных ошибок")
+
+    def handle(self, *args, **options):
+        stats_file = open(options["stats_file"], "a", encoding="utf-8") if options["stats_file"] else None
+
+        sink = SMTPSink(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency"] / 1000,
+            jitter=options["jitter"] / 1000,
+            temp_failure_rate=options["temp_failure_rate"],
+            perm_failure_rate=options["perm_failure_rate"],
+            drop_rate=options["drop_rate"],
+            connection_rate=options["connection_rate"],
+            max_messages_per_connection=options["max_messages_per_connection"],
+            stats_file=stats_file,
+            seed=options["seed"],
+        )
+
+        self.stdout.write(f"SMTP sink слушает {options['host']}:{options['port']}")
+        try:
+            asyncio.run(self.serve(sink, options["stats_interval"]))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        finally:
+            if stats_file is not None:
+                stats_file.close()
+            self.stdout.write(json.dumps(sink.stats.summary(), ensure_ascii=False))
+
+    async def serve(self, sink: SMTPSink, stats_interval: float):
+        await sink.start()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        if stats_interval:
+            asyncio.create_task(self.report(sink, stats_interval))
+        await sink.serve_forever()
+
+    async def report(self, sink: SMTPSink, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.stdout.write(json.dumps(sink.stats.summary(), ensure_ascii=False))
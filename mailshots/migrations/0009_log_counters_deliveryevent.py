@@ -0,0 +1,41 @@
+# Generated by Django 5.0.4 on 2026-10-18 16:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailshots', '0008_log_user_alter_mailshotperiodictask_frequency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='delivered',
+            field=models.PositiveIntegerField(default=0, verbose_name='Доставлено писем'),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='failed',
+            field=models.PositiveIntegerField(default=0, verbose_name='Не доставлено писем'),
+        ),
+        migrations.CreateModel(
+            name='DeliveryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Код ответа сервера')),
+                ('response', models.CharField(blank=True, max_length=64, verbose_name='Ответ сервера')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время отправки')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mailshots.client', verbose_name='Клиент')),
+                ('mailshot', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='mailshots.mailshotperiodictask', verbose_name='Рассылка')),
+            ],
+            options={
+                'verbose_name': 'Событие доставки',
+                'verbose_name_plural': 'События доставки',
+                'indexes': [models.Index(fields=['mailshot', 'created_at'], name='delivery_event_mailshot_idx')],
+            },
+        ),
+    ]
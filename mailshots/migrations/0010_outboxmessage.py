@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-18 16:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailshots', '0009_log_counters_deliveryevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200, verbose_name='Задача')),
+                ('kwargs', models.JSONField(default=dict, verbose_name='Аргументы задачи')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Создана')),
+            ],
+            options={
+                'verbose_name': 'Задача к публикации',
+                'verbose_name_plural': 'Задачи к публикации',
+                'ordering': ['pk'],
+            },
+        ),
+    ]
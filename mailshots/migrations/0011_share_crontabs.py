@@ -0,0 +1,71 @@
+from datetime import timezone as dt_timezone
+
+from django.db import migrations
+from django.utils import timezone
+
+
+CRONTAB_TIMEZONE = "UTC"
+
+
+def crontab_fields(start_time, frequency):
+    """
+    Поля crontab рассылки в UTC (копия services.mailshots.crontabs.crontab_fields
+    на момент миграции)
+    """
+    start_time = start_time.astimezone(dt_timezone.utc)
+    fields = dict(
+        minute=str(start_time.minute),
+        hour=str(start_time.hour),
+        day_of_month="*",
+        month_of_year="*",
+        day_of_week="*",
+    )
+    if frequency == "WEEKLY":
+        fields["day_of_week"] = str(start_time.isoweekday() % 7)
+    elif frequency == "MONTHLY":
+        if start_time.day <= 28:
+            fields["day_of_month"] = str(start_time.day)
+        else:
+            fields["day_of_month"] = ",".join(str(day) for day in range(28, start_time.day + 1))
+    return fields
+
+
+def share_crontabs(apps, schema_editor):
+    """
+    Переводит рассылки на общие строки CrontabSchedule (заодно пересчитывая
+    расписание по времени начала) и удаляет освободившиеся строки
+    """
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTasks = apps.get_model("django_celery_beat", "PeriodicTasks")
+    MailshotPeriodicTask = apps.get_model("mailshots", "MailshotPeriodicTask")
+
+    shared = {}
+    previous = set()
+    mailshots = MailshotPeriodicTask.objects.values_list("pk", "start_time", "frequency", "crontab_id")
+
+    for pk, start_time, frequency, crontab_id in mailshots.iterator():
+        fields = crontab_fields(start_time, frequency)
+        key = tuple(sorted(fields.items()))
+        if key not in shared:
+            crontab = CrontabSchedule.objects.filter(**fields, timezone=CRONTAB_TIMEZONE).order_by("pk").first()
+            shared[key] = (crontab or CrontabSchedule.objects.create(**fields, timezone=CRONTAB_TIMEZONE)).pk
+
+        if crontab_id != shared[key]:
+            PeriodicTask.objects.filter(pk=pk).update(crontab_id=shared[key])
+            previous.add(crontab_id)
+
+    CrontabSchedule.objects.filter(pk__in=previous, periodictask__isnull=True).delete()
+    PeriodicTasks.objects.update_or_create(ident=1, defaults={"last_update": timezone.now()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailshots', '0010_outboxmessage'),
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+    ]
+
+    operations = [
+        migrations.RunPython(share_crontabs, migrations.RunPython.noop),
+    ]
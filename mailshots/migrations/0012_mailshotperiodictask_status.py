@@ -0,0 +1,40 @@
+# Generated by Django 5.0.4 on 2026-10-18 16:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_status(apps, schema_editor):
+    """
+    Заполняет статус по флагам enabled и is_new. Истёкшие активные рассылки
+    остаются активными: их завершит первый запуск expire_mailshots
+    """
+    MailshotPeriodicTask = apps.get_model("mailshots", "MailshotPeriodicTask")
+    MailshotPeriodicTask.objects.filter(enabled=True).update(status="enabled")
+    MailshotPeriodicTask.objects.filter(enabled=False, is_new=False).update(status="disabled")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+        ('mailshots', '0011_share_crontabs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailshotperiodictask',
+            name='status',
+            field=models.CharField(choices=[('created', 'создана'), ('enabled', 'активна'), ('disabled', 'принудительно остановлена'), ('finished', 'завершена')], default='created', max_length=8, verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='mailshotperiodictask',
+            index=models.Index(fields=['status'], name='mailshot_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailshotperiodictask',
+            index=models.Index(fields=['user', 'status'], name='mailshot_user_status_idx'),
+        ),
+        migrations.RunPython(fill_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.0.4 on 2026-10-18 16:47
+
+import calendar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+PERIOD_DAYS = {
+    "DAILY": 1,
+    "WEEKLY": 7,
+}
+
+
+def occurrence(start_time, frequency, index):
+    """
+    Момент index-й отправки (копия services.mailshots.schedule.occurrence на момент миграции)
+    """
+    if frequency != "MONTHLY":
+        return start_time + timedelta(days=PERIOD_DAYS[frequency] * index)
+    month_index = start_time.month - 1 + index
+    year, month = start_time.year + month_index // 12, month_index % 12 + 1
+    day = min(start_time.day, calendar.monthrange(year, month)[1])
+    return start_time.replace(year=year, month=month, day=day)
+
+
+def get_next_run_at(start_time, frequency, expires, moment):
+    """
+    Первая отправка строго после moment, None - если она после окончания рассылки
+    (копия services.mailshots.schedule.get_next_run_at на момент миграции)
+    """
+    if moment < start_time:
+        index = -1
+    elif frequency == "MONTHLY":
+        index = (moment.year - start_time.year) * 12 + moment.month - start_time.month
+        if occurrence(start_time, frequency, index) > moment:
+            index -= 1
+    else:
+        index = (moment - start_time) // timedelta(days=PERIOD_DAYS[frequency])
+
+    run_at = occurrence(start_time, frequency, index + 1)
+    if expires is not None and run_at > expires:
+        return None
+    return run_at
+
+
+def fill_next_run_at(apps, schema_editor):
+    """
+    Вычисляет момент очередной отправки включённых рассылок
+    """
+    MailshotPeriodicTask = apps.get_model("mailshots", "MailshotPeriodicTask")
+    now = timezone.now()
+
+    mailshots = []
+    for mailshot in MailshotPeriodicTask.objects.filter(enabled=True).only("start_time", "frequency", "expires"):
+        mailshot.next_run_at = get_next_run_at(mailshot.start_time, mailshot.frequency, mailshot.expires, now)
+        mailshots.append(mailshot)
+    MailshotPeriodicTask.objects.bulk_update(mailshots, ["next_run_at"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+        ('mailshots', '0012_mailshotperiodictask_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailshotperiodictask',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Следующая отправка'),
+        ),
+        migrations.AddIndex(
+            model_name='mailshotperiodictask',
+            index=models.Index(condition=models.Q(('next_run_at__isnull', False)), fields=['next_run_at'], name='mailshot_next_run_at_idx'),
+        ),
+        migrations.RunPython(fill_next_run_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailshots', '0013_mailshotperiodictask_next_run_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailshotperiodictask',
+            name='delivery_window',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'точно во время начала'), (5, 'в течение 5 минут'), (15, 'в течение 15 минут'), (30, 'в течение 30 минут'), (60, 'в течение часа')], default=0, verbose_name='Окно отправки'),
+        ),
+    ]
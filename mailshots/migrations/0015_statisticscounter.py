@@ -0,0 +1,42 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Начальные значения счётчиков статистики
+    """
+    StatisticsCounter = apps.get_model("mailshots", "StatisticsCounter")
+    MailshotPeriodicTask = apps.get_model("mailshots", "MailshotPeriodicTask")
+    Client = apps.get_model("mailshots", "Client")
+
+    StatisticsCounter.objects.bulk_create([
+        StatisticsCounter(name="mailshots", value=MailshotPeriodicTask.objects.count()),
+        StatisticsCounter(name="active_mailshots", value=MailshotPeriodicTask.objects.filter(status="enabled").count()),
+        StatisticsCounter(name="client_emails", value=Client.objects.values("email").distinct().count()),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailshots', '0014_mailshotperiodictask_delivery_window'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticsCounter',
+            fields=[
+                ('name', models.CharField(choices=[('mailshots', 'Рассылки'), ('active_mailshots', 'Активные рассылки'), ('client_emails', 'Уникальные email клиентов')], max_length=32, primary_key=True, serialize=False, verbose_name='Счётчик')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Обновлён')),
+            ],
+            options={
+                'verbose_name': 'Счётчик статистики',
+                'verbose_name_plural': 'Счётчики статистики',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailshots', '0015_statisticscounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDeliveryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'Сутки')], max_length=4, verbose_name='Период')),
+                ('period_start', models.DateTimeField(verbose_name='Начало периода')),
+                ('runs', models.PositiveIntegerField(default=0, verbose_name='Отправок')),
+                ('failed_runs', models.PositiveIntegerField(default=0, verbose_name='Неуспешных отправок')),
+                ('delivered', models.PositiveBigIntegerField(default=0, verbose_name='Доставлено писем')),
+                ('failed', models.PositiveBigIntegerField(default=0, verbose_name='Не доставлено писем')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итоги отправок пользователя',
+                'verbose_name_plural': 'Итоги отправок пользователей',
+                'ordering': ['-period_start'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MailshotDeliveryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'Сутки')], max_length=4, verbose_name='Период')),
+                ('period_start', models.DateTimeField(verbose_name='Начало периода')),
+                ('runs', models.PositiveIntegerField(default=0, verbose_name='Отправок')),
+                ('failed_runs', models.PositiveIntegerField(default=0, verbose_name='Неуспешных отправок')),
+                ('delivered', models.PositiveBigIntegerField(default=0, verbose_name='Доставлено писем')),
+                ('failed', models.PositiveBigIntegerField(default=0, verbose_name='Не доставлено писем')),
+                ('mailshot', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='mailshots.mailshotperiodictask', verbose_name='Рассылка')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Создана пользователем')),
+            ],
+            options={
+                'verbose_name': 'Итоги отправок рассылки',
+                'verbose_name_plural': 'Итоги отправок рассылок',
+                'ordering': ['-period_start'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['user', 'period', 'period_start'], name='mailshot_rollup_user_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mailshotdeliveryrollup',
+            constraint=models.UniqueConstraint(fields=('mailshot', 'period', 'period_start'), name='unique_mailshot_rollup'),
+        ),
+        migrations.AddIndex(
+            model_name='userdeliveryrollup',
+            index=models.Index(fields=['period', 'period_start'], name='user_rollup_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='userdeliveryrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'period_start'), name='unique_user_rollup'),
+        ),
+    ]
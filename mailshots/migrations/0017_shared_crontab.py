@@ -0,0 +1,61 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_shared_crontabs(apps, schema_editor):
+    """
+    Закрепляет за каждым расписанием строку CrontabSchedule, на которую уже
+    ссылаются рассылки; рассылки с дублями расписания переводятся на неё,
+    а освободившиеся дубли удаляются
+    """
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTasks = apps.get_model("django_celery_beat", "PeriodicTasks")
+    MailshotPeriodicTask = apps.get_model("mailshots", "MailshotPeriodicTask")
+    SharedCrontab = apps.get_model("mailshots", "SharedCrontab")
+
+    shared = {}
+    duplicates = {}
+    crontab_ids = MailshotPeriodicTask.objects.filter(crontab__isnull=False).values("crontab_id")
+    crontabs = CrontabSchedule.objects.filter(pk__in=crontab_ids).order_by("pk")
+    for crontab in crontabs.iterator():
+        key = " ".join((crontab.minute, crontab.hour, crontab.day_of_month,
+                        crontab.month_of_year, crontab.day_of_week, str(crontab.timezone)))
+        if key in shared:
+            duplicates[crontab.pk] = shared[key]
+        else:
+            shared[key] = crontab.pk
+
+    SharedCrontab.objects.bulk_create([SharedCrontab(key=key, crontab_id=pk) for key, pk in shared.items()])
+    for duplicate_id, crontab_id in duplicates.items():
+        PeriodicTask.objects.filter(crontab_id=duplicate_id).update(crontab_id=crontab_id)
+    if duplicates:
+        CrontabSchedule.objects.filter(pk__in=duplicates, periodictask__isnull=True).delete()
+        PeriodicTasks.objects.update_or_create(ident=1, defaults={"last_update": timezone.now()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+        ('mailshots', '0016_delivery_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SharedCrontab',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='Расписание')),
+                ('crontab', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='shared', to='django_celery_beat.crontabschedule', verbose_name='Crontab')),
+            ],
+            options={
+                'verbose_name': 'Общее расписание',
+                'verbose_name_plural': 'Общие расписания',
+            },
+        ),
+        migrations.RunPython(fill_shared_crontabs, migrations.RunPython.noop),
+    ]
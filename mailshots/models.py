@@ -1,13 +1,17 @@
 import json
 from datetime import timedelta
+from uuid import uuid4
 
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth import get_user_model
-from django.db.models import UniqueConstraint
+from django.db.models import F, Q, UniqueConstraint
 from django.utils import timezone
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
 from conf import settings
+from services.mailshots.crontabs import collect_orphan_crontabs, get_shared_crontab
+from services.mailshots.periodic import reserve_periodic_task_pk, schedule_changed
+from services.mailshots.schedule import dispatch_offset, get_next_run_at, occurrence_index
 
 User = get_user_model()
 
@@ -49,6 +53,14 @@ class Client(models.Model):
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # email до изменения, по нему пересчитывается счётчик уникальных email
+        if "email" in instance.__dict__:
+            instance._loaded_email = instance.email
+        return instance
+
 
 class Message(models.Model):
     """
@@ -72,21 +84,122 @@ FREQUENCY_CHOICES = [
     ("MONTHLY", "every_month"),
 ]
 
+DELIVERY_WINDOW_CHOICES = [
+    (0, "точно во время начала"),
+    (5, "в течение 5 минут"),
+    (15, "в течение 15 минут"),
+    (30, "в течение 30 минут"),
+    (60, "в течение часа"),
+]
+
+
+class MailshotPeriodicTaskQuerySet(models.QuerySet):
+    """
+    Массовые операции с рассылками. Изменения расписания, сделанные
+    одной операцией, вызывают одну перезагрузку расписания beat
+    """
+    def changes_periodic_task(self, fields) -> bool:
+        """
+        Меняются ли поля PeriodicTask: beat читает только их, поэтому изменение
+        одних полей рассылки (статус, next_run_at) не перезагружает его расписание
+        """
+        return any(self.model._meta.get_field(name).model is PeriodicTask for name in fields)
+
+    # внутри внешней транзакции точки сохранения не создаются: ошибка
+    # всё равно откатывает внешнюю транзакцию, а каждая точка - это лишние запросы
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = super().update(**kwargs)
+            if rows and self.changes_periodic_task(kwargs):
+                schedule_changed(self.db)
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = super().bulk_update(objs, fields, batch_size=batch_size)
+            if rows and self.changes_periodic_task(fields):
+                schedule_changed(self.db)
+        return rows
+
+    def delete(self):
+        crontab_ids = set(self.values_list("crontab_id", flat=True))
+        with transaction.atomic(using=self.db):
+            ret = super().delete()
+            collect_orphan_crontabs(crontab_ids)
+        return ret
+
+    def create_many(self, objs: list["MailshotPeriodicTask"]) -> list["MailshotPeriodicTask"]:
+        """
+        Замена bulk_create, который не поддерживается для наследуемых моделей:
+        рассылки записываются в одной транзакции, каждая одной записью
+        (см. MailshotPeriodicTask.save), с одним уведомлением beat
+        """
+        with transaction.atomic(using=self.db):
+            for obj in objs:
+                obj.save(using=self.db)
+        return objs
+
+    def enabled(self):
+        return self.filter(enabled=True)
+
+    def expired(self, moment=None):
+        """
+        Активные рассылки, срок действия которых истёк к моменту moment
+        """
+        return self.filter(status=MailshotPeriodicTask.Status.ENABLED, expires__lt=moment or timezone.now())
+
+    def finish_expired(self, moment=None) -> int:
+        """
+        Переводит истёкшие рассылки в статус "завершена" и отключает их задачи,
+        поэтому beat больше не загружает и не вычисляет их расписание.
+        Возвращает количество завершённых рассылок
+        """
+        rows = self.expired(moment).update(status=MailshotPeriodicTask.Status.FINISHED,
+                                           enabled=False,
+                                           next_run_at=None)
+        # массовое изменение статуса не вызывает сигналов, счётчик меняется здесь
+        StatisticsCounter.add(StatisticsCounter.Name.ACTIVE_MAILSHOTS, -rows, using=self.db)
+        return rows
+
+    def due(self, until):
+        """
+        Рассылки, очередная отправка которых наступает не позже until
+        """
+        return self.filter(next_run_at__lte=until)
+
 
 class MailshotPeriodicTask(PeriodicTask):
     """
     Модель рассылки
     """
+    class Status(models.TextChoices):
+        CREATED = "created", "создана"
+        ENABLED = "enabled", "активна"
+        DISABLED = "disabled", "принудительно остановлена"
+        FINISHED = "finished", "завершена"
+
     defined_name = models.CharField(max_length=100, verbose_name="Имя, установленное пользователем")
     frequency = models.CharField(max_length=8, choices=FREQUENCY_CHOICES, verbose_name="Частота рассылки",
                                  default="DAILY",
                                  blank=False)
+    # окно отправки в минутах: рассылки с одинаковым временем начала отправляются
+    # не в одну минуту, а в течение окна, каждая со своим постоянным сдвигом (см. dispatch_offset)
+    delivery_window = models.PositiveSmallIntegerField(choices=DELIVERY_WINDOW_CHOICES, default=0,
+                                                       verbose_name="Окно отправки")
     is_new = models.BooleanField(default=True,  verbose_name="Рассылка новая")
+    # хранится, чтобы списки рассылок фильтровались по индексу, а не по сроку действия;
+    # истёкшие рассылки переводит в FINISHED задача expire_mailshots
+    status = models.CharField(max_length=8, choices=Status, default=Status.CREATED, verbose_name="Статус")
+    # момент очередной отправки; None у выключенных и закончившихся рассылок.
+    # По нему MailshotScheduler выбирает рассылки к отправке (см. services.mailshots.scheduler)
+    next_run_at = models.DateTimeField(**NULL, verbose_name="Следующая отправка")
     clients = models.ManyToManyField(Client, verbose_name="Получатели")  # mtm
     message = models.OneToOneField(Message, **CASCADE,  verbose_name="Сообщение")
     user = models.ForeignKey(User, **CASCADE,  verbose_name="Создана пользователем")  # mto
     created_at = models.DateTimeField(auto_now=True)
 
+    objects = MailshotPeriodicTaskQuerySet.as_manager()
+
     class Meta:
         constraints = [
             UniqueConstraint(fields=["defined_name", "user"], name="unique_mailshot_name_for_user")
@@ -94,6 +207,12 @@ class MailshotPeriodicTask(PeriodicTask):
         verbose_name = "Рассылка"
         verbose_name_plural = "Рассылки"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status"], name="mailshot_status_idx"),
+            models.Index(fields=["user", "status"], name="mailshot_user_status_idx"),
+            models.Index(fields=["next_run_at"], condition=Q(next_run_at__isnull=False),
+                         name="mailshot_next_run_at_idx"),
+        ]
 
         permissions = [
             ("can_disable", "can disable mailshots"),
@@ -102,51 +221,140 @@ class MailshotPeriodicTask(PeriodicTask):
     def __str__(self):
         return self.defined_name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # статус до изменения, по нему пересчитывается счётчик активных рассылок
+        if "status" in instance.__dict__:
+            instance._loaded_status = instance.status
+        return instance
+
     def alter_crontab(self, start_at):
         """
         Метод для определения расписания crontab
-        по времени начала
+        по времени начала. Рассылки с одинаковым расписанием
+        используют одну общую строку CrontabSchedule
         """
-        if self.crontab:
-            crontab = self.crontab
-        else:
-            crontab = CrontabSchedule()
-
-        crontab.minute = start_at.minute
-        crontab.hour = start_at.hour
-        crontab.day_of_month = '*'
-        crontab.month_of_year = '*'
-        crontab.day_of_week = '*'
+        self.crontab = get_shared_crontab(start_at, self.frequency)
 
-        if self.frequency == "WEEKLY":
-            crontab.day_of_week = start_at.weekday()
-        elif self.frequency == "MONTHLY":
-            crontab.day_of_month = start_at.month
-        crontab.save()
+    def get_current_status(self) -> str:
+        """
+        Статус по флагам enabled и is_new. Завершённая рассылка остаётся
+        завершённой, пока её снова не активируют
+        """
+        if self.enabled:
+            return self.Status.ENABLED
+        if self.is_new:
+            return self.Status.CREATED
+        if self.status == self.Status.FINISHED:
+            return self.Status.FINISHED
+        return self.Status.DISABLED
+
+    def alter_next_run_at(self, moment=None):
+        """
+        Пересчёт момента очередной отправки. Ещё не отправленная отправка
+        сохраняется, если она совпадает с отправкой текущего расписания
+        """
+        if not self.enabled:
+            self.next_run_at = None
+            return
+        self.next_run_at = get_next_run_at(self.start_time, self.frequency, self.expires,
+                                           moment or timezone.now(),
+                                           pending=self.next_run_at,
+                                           offset=self.dispatch_offset)
 
-        self.crontab = crontab
+    @property
+    def dispatch_offset(self) -> timedelta:
+        return dispatch_offset(self.pk, timedelta(minutes=self.delivery_window))
 
     @property
     def send_now(self):
         return self.start_time < timezone.now()
 
+    def run_slot(self, moment=None) -> int:
+        """
+        Номер слота расписания, к которому относится запуск рассылки в момент moment.
+        К моменту прибавляется MAILSHOT_RUN_SLOT_GRACE секунд, чтобы запуск,
+        пришедший чуть раньше срока из-за расхождения часов, попал в свой слот
+        """
+        moment = (moment or timezone.now()) + timedelta(seconds=settings.MAILSHOT_RUN_SLOT_GRACE)
+        return occurrence_index(self.start_time, self.frequency, moment)
+
     def save(self, *args, **kwargs):
+        """
+        Строка задачи записывается один раз: pk новой задачи заранее берётся
+        из последовательности базы (см. reserve_periodic_task_pk), поэтому имя
+        и аргументы задачи известны до записи. Если база этого не умеет,
+        новая задача записывается дважды, как раньше.
+        beat узнаёт об изменении расписания один раз после фиксации транзакции
+        """
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        previous_crontab_id = self.crontab_id
         self.alter_crontab(self.start_time)
-        self.name = f"mailshot_-1"
-        self.kwargs = json.dumps({"pk": -1})
-        super().save(*args, **kwargs)
         self.task = settings.MAILSHOT_TASK_NAME
-        self.kwargs = json.dumps({"pk": self.pk})
-        self.name = f"mailshot_{self.pk}"
-        super().save(*args, **kwargs)
+        self.status = self.get_current_status()
+        self.no_changes = True
+
+        try:
+            with transaction.atomic(using=using):
+                if self.pk is None:
+                    pk = reserve_periodic_task_pk(using)
+                    if pk is None:
+                        self.name = f"mailshot_new_{uuid4().hex}"
+                        self.kwargs = json.dumps({})
+                        super().save(*args, **kwargs)
+                        kwargs["force_insert"] = False
+                    else:
+                        self.id = self.periodictask_ptr_id = pk
+                        kwargs["force_insert"] = (PeriodicTask,)
+
+                self.name = f"mailshot_{self.pk}"
+                self.kwargs = json.dumps({"pk": self.pk})
+                # сдвиг в окне отправки зависит от pk
+                self.alter_next_run_at()
+                super().save(*args, **kwargs)
+
+                if previous_crontab_id != self.crontab_id:
+                    collect_orphan_crontabs([previous_crontab_id])
+                schedule_changed(using)
+        finally:
+            self.no_changes = False
 
     def delete(self, using=None, keep_parents=False):
-        ret = super().delete(using=None, keep_parents=False)
-        self.crontab.delete()
-        self.message.delete()
+        using = using or router.db_for_write(type(self), instance=self)
+        crontab_id = self.crontab_id
+        self.no_changes = True
+
+        with transaction.atomic(using=using):
+            # статус в базе мог измениться после загрузки рассылки (expire_mailshots),
+            # а по нему при удалении уменьшается счётчик активных рассылок
+            self.status = (type(self).objects.using(using).filter(pk=self.pk)
+                           .values_list("status", flat=True).first() or self.status)
+            ret = super().delete(using=using, keep_parents=keep_parents)
+            # общее расписание удаляется, только если на него больше никто не ссылается
+            collect_orphan_crontabs([crontab_id])
+            self.message.delete()
+            schedule_changed(using)
         return ret
 
 
+class SharedCrontab(models.Model):
+    """
+    Общая строка CrontabSchedule расписания рассылок (см. services.mailshots.crontabs).
+    Уникальный ключ расписания не даёт одновременным сохранениям рассылок
+    создать для одного расписания две строки
+    """
+    key = models.CharField(max_length=255, unique=True, verbose_name="Расписание")
+    crontab = models.OneToOneField(CrontabSchedule, **CASCADE, related_name="shared", verbose_name="Crontab")
+
+    class Meta:
+        verbose_name = "Общее расписание"
+        verbose_name_plural = "Общие расписания"
+
+    def __str__(self):
+        return self.key
+
+
 class Log(models.Model):
     """
     Логи рассылки
@@ -166,4 +374,174 @@ class Log(models.Model):
     mailshot_datetime = models.DateTimeField(auto_now=True, verbose_name="Дата отправки")
     status = models.CharField(choices=Status, max_length=2, verbose_name="Статус отправки")
     response = models.CharField(max_length=16, verbose_name="Ответ сервиса отправки")
+    delivered = models.PositiveIntegerField(default=0, verbose_name="Доставлено писем")
+    failed = models.PositiveIntegerField(default=0, verbose_name="Не доставлено писем")
     user = models.ForeignKey(User, **CASCADE, verbose_name="Создана пользователем")  # mto
+
+
+class DeliveryEvent(models.Model):
+    """
+    Результат отправки рассылки одному клиенту.
+    Строки пишутся пачками через bulk_create, поэтому модель
+    сделана максимально компактной
+    """
+    mailshot = models.ForeignKey(MailshotPeriodicTask, **CASCADE, db_index=False, verbose_name="Рассылка")  # mto
+    client = models.ForeignKey(Client, **CASCADE, verbose_name="Клиент")  # mto
+    status_code = models.PositiveSmallIntegerField(verbose_name="Код ответа сервера")
+    response = models.CharField(max_length=64, blank=True, verbose_name="Ответ сервера")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Время отправки")
+
+    class Meta:
+        verbose_name = "Событие доставки"
+        verbose_name_plural = "События доставки"
+        indexes = [
+            models.Index(fields=["mailshot", "created_at"], name="delivery_event_mailshot_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.mailshot_id}_{self.client_id}_{self.status_code}"
+
+
+class OutboxMessage(models.Model):
+    """
+    Задача celery, которую нужно опубликовать в брокер.
+
+    Строка записывается в той же транзакции, что и изменение, ради которого
+    задача ставится, поэтому при откате транзакции задача не публикуется,
+    а веб-запрос не обращается к брокеру. Публикует задачи пачками
+    команда relay_outbox, опубликованные строки удаляются
+    """
+    task = models.CharField(max_length=200, verbose_name="Задача")
+    kwargs = models.JSONField(default=dict, verbose_name="Аргументы задачи")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Создана")
+
+    class Meta:
+        verbose_name = "Задача к публикации"
+        verbose_name_plural = "Задачи к публикации"
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f"{self.task}({self.kwargs})"
+
+    @classmethod
+    def enqueue(cls, task: str, **kwargs) -> "OutboxMessage":
+        """
+        Ставит задачу в очередь публикации; вызывается внутри транзакции изменения
+        """
+        return cls.objects.create(task=task, kwargs=kwargs)
+
+
+class StatisticsCounter(models.Model):
+    """
+    Счётчик статистики главной страницы. Значения меняются приращениями
+    при изменении клиентов и рассылок (см. services.mailshots.counters),
+    поэтому чтение счётчика - один запрос по первичному ключу.
+    Расхождения (массовые операции без сигналов, гонки) исправляет
+    периодическая сверка reconcile_counters
+    """
+    class Name(models.TextChoices):
+        MAILSHOTS = "mailshots", "Рассылки"
+        ACTIVE_MAILSHOTS = "active_mailshots", "Активные рассылки"
+        CLIENT_EMAILS = "client_emails", "Уникальные email клиентов"
+
+    name = models.CharField(max_length=32, choices=Name, primary_key=True, verbose_name="Счётчик")
+    value = models.BigIntegerField(default=0, verbose_name="Значение")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="Обновлён")
+
+    class Meta:
+        verbose_name = "Счётчик статистики"
+        verbose_name_plural = "Счётчики статистики"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def add(cls, name: str, delta: int, using: str | None = None):
+        """
+        Прибавляет delta к счётчику после фиксации транзакции изменения:
+        короткий UPDATE не держит блокировку строки счётчика всю транзакцию,
+        и при откате транзакции счётчик не меняется
+        """
+        if not delta:
+            return
+        transaction.on_commit(
+            lambda: cls.objects.using(using).filter(name=name).update(value=F("value") + delta,
+                                                                      updated_at=timezone.now()),
+            using=using,
+        )
+
+    @classmethod
+    def get_value(cls, name: str) -> int:
+        return cls.objects.filter(name=name).values_list("value", flat=True).first() or 0
+
+
+class DeliveryRollup(models.Model):
+    """
+    Итоги отправок рассылок за час или сутки. Строки обновляются приращениями
+    при записи лога каждой отправки (см. services.mailshots.rollups), поэтому
+    отчёты читают несколько строк за период, а не логи за всю историю.
+    Пересобираются из логов командой rebuild_delivery_rollups
+    """
+    class Period(models.TextChoices):
+        HOUR = "hour", "Час"
+        DAY = "day", "Сутки"
+
+    period = models.CharField(max_length=4, choices=Period, verbose_name="Период")
+    period_start = models.DateTimeField(verbose_name="Начало периода")
+    runs = models.PositiveIntegerField(default=0, verbose_name="Отправок")
+    failed_runs = models.PositiveIntegerField(default=0, verbose_name="Неуспешных отправок")
+    delivered = models.PositiveBigIntegerField(default=0, verbose_name="Доставлено писем")
+    failed = models.PositiveBigIntegerField(default=0, verbose_name="Не доставлено писем")
+
+    class Meta:
+        abstract = True
+        ordering = ["-period_start"]
+
+    @property
+    def success_rate(self) -> float | None:
+        """
+        Доля доставленных писем, %
+        """
+        total = self.delivered + self.failed
+        return round(self.delivered / total * 100, 1) if total else None
+
+
+class MailshotDeliveryRollup(DeliveryRollup):
+    """
+    Итоги отправок рассылки за период
+    """
+    mailshot = models.ForeignKey(MailshotPeriodicTask, **CASCADE, db_index=False, verbose_name="Рассылка")  # mto
+    user = models.ForeignKey(User, **CASCADE, db_index=False, verbose_name="Создана пользователем")  # mto
+
+    class Meta(DeliveryRollup.Meta):
+        verbose_name = "Итоги отправок рассылки"
+        verbose_name_plural = "Итоги отправок рассылок"
+        constraints = [
+            UniqueConstraint(fields=["mailshot", "period", "period_start"], name="unique_mailshot_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "period", "period_start"], name="mailshot_rollup_user_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.mailshot_id}_{self.period}_{self.period_start}"
+
+
+class UserDeliveryRollup(DeliveryRollup):
+    """
+    Итоги отправок всех рассылок пользователя за период
+    """
+    user = models.ForeignKey(User, **CASCADE, db_index=False, verbose_name="Пользователь")  # mto
+
+    class Meta(DeliveryRollup.Meta):
+        verbose_name = "Итоги отправок пользователя"
+        verbose_name_plural = "Итоги отправок пользователей"
+        constraints = [
+            UniqueConstraint(fields=["user", "period", "period_start"], name="unique_user_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["period", "period_start"], name="user_rollup_period_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}_{self.period}_{self.period_start}"
@@ -1,9 +1,163 @@
-from celery import shared_task
+from uuid import uuid4
+
+from celery import shared_task, chord
+from celery.exceptions import Retry
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+
+from mailshots.models import Log, MailshotPeriodicTask
+from services.general.messages.resilience import CircuitOpen, TransientDeliveryError
+from services.general.messages.throttling import RateLimitExceeded
+from services.mailshots import estimates
+from services.mailshots.counters import reconcile
+from services.mailshots.runs import MailshotRunGuard
 from services.mailshots.senders import MailshotSender
 
 
+def deliver_with_retries(task, sender: MailshotSender, **retry_kwargs) -> dict:
+    """
+    Отправка рассылки (или её пачки) внутри задачи celery.
+
+    Превышение лимита скорости и разомкнутый circuit breaker переносят задачу
+    без учёта попыток. Прочие временные ошибки повторяются не больше
+    MAILSHOT_MAX_RETRIES раз с экспоненциальной задержкой и случайным разбросом,
+    повтор продолжает отправку с места остановки. Попытки считаются аргументом
+    задачи attempt, а не счётчиком повторов celery, который увеличивают и переносы.
+    Когда попытки исчерпаны, возвращается неуспешный результат. Перед повтором lease-блокировка запуска
+    продлевается на время задержки, чтобы повтор не был отброшен как наложившийся.
+    retry_kwargs - дополнительные аргументы задачи при повторе
+    """
+    kwargs = task.request.kwargs | retry_kwargs
+
+    try:
+        return sender.deliver()
+    except (RateLimitExceeded, CircuitOpen) as e:
+        if sender.run_guard is not None:
+            sender.run_guard.extend(delay=e.retry_after)
+        raise task.retry(countdown=e.retry_after, kwargs=kwargs, max_retries=None)
+    except TransientDeliveryError as e:
+        attempt = kwargs.get("attempt", 0)
+        if attempt >= settings.MAILSHOT_MAX_RETRIES:
+            return sender.get_result(Log.Status.FAIL, "Error")
+
+        countdown = get_exponential_backoff_interval(
+            factor=settings.MAILSHOT_RETRY_BACKOFF,
+            retries=attempt,
+            maximum=settings.MAILSHOT_RETRY_BACKOFF_MAX,
+            full_jitter=True,
+        )
+        if sender.run_guard is not None:
+            sender.run_guard.extend(delay=countdown)
+        raise task.retry(exc=e,
+                         countdown=countdown,
+                         kwargs=kwargs | sender.get_progress() | {"attempt": attempt + 1},
+                         max_retries=None,
+                         )
+
+
+@shared_task(bind=True, max_retries=None)
+def send_mailshot(self, pk, slot=None, resume_after=None, delivered=0, failed=0, attempt=0):
+    """
+    Отправка рассылки. Если клиентов больше, чем MAILSHOT_FANOUT_BATCH_SIZE,
+    рассылка разбивается на пачки, которые отправляются параллельно
+    на разных воркерах, а итог записывается одним логом.
+
+    Повторный запуск того же слота расписания и запуск, наложившийся
+    на ещё идущую отправку рассылки, отбрасываются (см. MailshotRunGuard)
+    """
+    sender = MailshotSender(pk=pk, resume_after=resume_after, delivered=delivered, failed=failed)
+
+    guard = MailshotRunGuard(sender.mailshot, token=self.request.id or uuid4().hex, slot=slot)
+    rejected = guard.acquire()
+    if rejected:
+        return f"skipped | {rejected}: slot {guard.slot}"
+
+    batch_size = settings.MAILSHOT_FANOUT_BATCH_SIZE
+    client_ranges = sender.get_client_ranges(batch_size) if batch_size and resume_after is None else []
+
+    if len(client_ranges) > 1:
+        chord(
+            send_mailshot_batch.s(pk=pk, first_client_pk=first_pk, last_client_pk=last_pk,
+                                  slot=guard.slot, run_token=guard.token)
+            for first_pk, last_pk in client_ranges
+        )(collect_mailshot_batches.s(pk=pk, slot=guard.slot, run_token=guard.token))
+        return f"fan-out | batches: {len(client_ranges)}"
+
+    sender.run_guard = guard
+    retrying = False
+    try:
+        result = deliver_with_retries(self, sender, slot=guard.slot)
+        sender.write_log(**result)
+    except Retry:
+        # повтор продолжит этот запуск, lease продлена до его начала
+        retrying = True
+        raise
+    finally:
+        if not retrying:
+            guard.release()
+    return f"{result['status']} | response: {result['response']}"
+
+
+@shared_task(bind=True, max_retries=None)
+def send_mailshot_batch(self, pk, first_client_pk, last_client_pk, slot, run_token,
+                        resume_after=None, delivered=0, failed=0, attempt=0):
+    """
+    Отправка одной пачки рассылки. Пачки продлевают блокировку
+    запуска, захваченную задачей send_mailshot
+    """
+    sender = MailshotSender(pk=pk,
+                            client_range=(first_client_pk, last_client_pk),
+                            resume_after=resume_after,
+                            delivered=delivered,
+                            failed=failed,
+                            )
+    sender.run_guard = MailshotRunGuard(sender.mailshot, token=run_token, slot=slot)
+    return deliver_with_retries(self, sender)
+
+
+@shared_task
+def collect_mailshot_batches(results, pk, slot, run_token):
+    """
+    Запись общего лога по результатам всех пачек рассылки
+    и снятие блокировки запуска
+    """
+    delivered = sum(result["delivered"] for result in results)
+    failed = sum(result["failed"] for result in results)
+    status = Log.Status.OK if delivered or not failed else Log.Status.FAIL
+    response = f"{delivered}/{delivered + failed}"
+
+    sender = MailshotSender(pk=pk)
+    sender.write_log(status, response, delivered=delivered, failed=failed)
+    MailshotRunGuard(sender.mailshot, token=run_token, slot=slot).release()
+    return f"{status} | response: {response}"
+
+
+@shared_task
+def expire_mailshots():
+    """
+    Завершение рассылок, срок действия которых истёк. Запускается
+    по расписанию MAILSHOT_EXPIRY_SWEEP_INTERVAL (см. CELERY_BEAT_SCHEDULE)
+    """
+    finished = MailshotPeriodicTask.objects.finish_expired()
+    return f"finished: {finished}"
+
+
 @shared_task
-def send_mailshot(pk):
-    MailshotSender(pk=pk)()
+def reconcile_counters():
+    """
+    Сверка счётчиков статистики с таблицами. Запускается
+    по расписанию MAILSHOT_COUNTERS_RECONCILE_INTERVAL (см. CELERY_BEAT_SCHEDULE)
+    """
+    drift = reconcile()
+    return f"drift: {drift}"
 
 
+@shared_task
+def rebuild_clients_estimate():
+    """
+    Пересборка оценки количества уникальных email клиентов, если она используется.
+    Запускается по расписанию CLIENTS_ESTIMATE_REBUILD_INTERVAL (см. CELERY_BEAT_SCHEDULE)
+    """
+    if not settings.CLIENTS_AMOUNT_ESTIMATE:
+        return "skipped | CLIENTS_AMOUNT_ESTIMATE is off"
+    return f"estimate: {estimates.rebuild()}"
@@ -1,10 +1,13 @@
 """
-Теги статистики по рассылкам
+Теги статистики по рассылкам. Значения читаются из материализованных
+счётчиков (см. StatisticsCounter), а не подсчитываются по таблицам
 """
+import redis
 from django import template
-from django.utils import timezone
+from django.conf import settings
 
-from mailshots.models import MailshotPeriodicTask, Client
+from mailshots.models import StatisticsCounter
+from services.mailshots.estimates import get_estimate
 
 register = template.Library()
 
@@ -14,7 +17,7 @@ def mailshots_amount():
     """
     Количество рассылок
     """
-    return MailshotPeriodicTask.objects.all().count()
+    return StatisticsCounter.get_value(StatisticsCounter.Name.MAILSHOTS)
 
 
 @register.simple_tag
@@ -22,12 +25,20 @@ def active_mailshots_amount():
     """
     Количество активных рассылок
     """
-    return MailshotPeriodicTask.objects.filter(enabled=True, expires__lt=timezone.now()).count()
+    return StatisticsCounter.get_value(StatisticsCounter.Name.ACTIVE_MAILSHOTS)
 
 
 @register.simple_tag
 def clients_amount():
     """
-    Количество клиентов
+    Количество клиентов. При CLIENTS_AMOUNT_ESTIMATE - оценка HyperLogLog,
+    если она собрана и Redis доступен
     """
-    return Client.objects.all().order_by("email").distinct("email").count()
+    if settings.CLIENTS_AMOUNT_ESTIMATE:
+        try:
+            estimate = get_estimate()
+        except redis.RedisError:
+            estimate = None
+        if estimate is not None:
+            return estimate
+    return StatisticsCounter.get_value(StatisticsCounter.Name.CLIENT_EMAILS)
@@ -1,3 +1,60 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from celery import Task
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from mailshots.models import Client, DeliveryEvent, Log, MailshotPeriodicTask, Message
+from mailshots.tasks import send_mailshot
+from services.general.messages.throttling import RateLimitExceeded
+from services.mailshots.benchmark import run_benchmark
+from services.mailshots.runs import MailshotRunGuard
+from services.mailshots.senders import MailshotSender
+from users.models import User
+
+
+class MailshotTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="owner@example.com")
+        message = Message.objects.create(subject="Тема", body="Текст", user=self.user)
+        self.mailshot = MailshotPeriodicTask(defined_name="Рассылка", message=message, user=self.user,
+                                             start_time=timezone.now() - timedelta(minutes=1),
+                                             expires=timezone.now() + timedelta(days=1))
+        self.mailshot.save()
+        self.mailshot.clients.set([Client.objects.create(email="client@example.com", user=self.user)])
+
+
+@mock.patch.object(MailshotRunGuard, "release")
+@mock.patch.object(MailshotRunGuard, "extend")
+@mock.patch.object(MailshotRunGuard, "acquire", return_value=None)
+class SendMailshotRetriesTestCase(MailshotTestCase):
+    def test_rate_limit_reschedules_do_not_exhaust_retries(self, *mocks):
+        """
+        Переносов из-за лимита скорости больше, чем max_retries задачи по умолчанию,
+        а запуск всё равно завершается и записывает лог
+        """
+        reschedules = Task.max_retries + 2
+        results = [RateLimitExceeded("user", retry_after=1)] * reschedules
+        results.append(dict(status=Log.Status.OK, response="1/1", delivered=1, failed=0))
+
+        with mock.patch.object(MailshotSender, "deliver", side_effect=results) as deliver:
+            send_mailshot.apply(kwargs=dict(pk=self.mailshot.pk))
+
+        self.assertEqual(deliver.call_count, reschedules + 1)
+        log = Log.objects.get(mailshot=self.mailshot)
+        self.assertEqual((log.status, log.delivered), (Log.Status.OK, 1))
+
+
+@override_settings(EMAIL_CIRCUIT_BREAKER_ENABLED=False,
+                   CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class BenchmarkTestCase(MailshotTestCase):
+    def test_benchmark_does_not_record_delivery(self):
+        """
+        Замер отправки существующей рассылки не пишет ни лог, ни события доставки
+        """
+        result = run_benchmark(self.mailshot.pk)
+
+        self.assertEqual(result["delivered"], 1)
+        self.assertEqual(DeliveryEvent.objects.count(), 0)
+        self.assertFalse(Log.objects.exists())
@@ -18,6 +18,10 @@ urlpatterns = [
     path("<int:mailshot_pk>/logs/list/", views.LogListView.as_view(), name="logs_list"),
     path("<int:mailshot_pk>/logs/<int:pk>/detail/", views.LogDetailView.as_view(), name="logs_detail"),
 
+    # отчёты по отправкам
+    path("dashboard/", views.DeliveryDashboardView.as_view(), name="dashboard"),
+    path("manager/dashboard/", views.ManagerDeliveryDashboardView.as_view(), name="manager_dashboard"),
+
     # manager
     path("manager/list/<str:status>/", views.ManagerMailshotListView.as_view(), name="manager_list"),
     path("manager/detail/<int:pk>/", views.ManagerMailshotDetailView.as_view(), name="manager_detail"),
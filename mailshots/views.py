@@ -1,20 +1,20 @@
-from datetime import datetime
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 
+from django.conf import settings
 from django.db import transaction
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.http import HttpResponseRedirect, Http404
 from django.urls import reverse
-from django.utils import timezone
-from django.views.generic import DetailView, ListView
+from django.views.generic import DetailView, ListView, TemplateView
 from django.views.generic.edit import DeleteView, UpdateView, CreateView
-from mailshots.tasks import send_mailshot
 from mailshots.forms import MessageForm, ClientsChoseForm, ClientForm, MailshotPeriodicTaskForm, MailshotDisableForm
 
-from mailshots.models import Client, MailshotPeriodicTask, Log
+from mailshots.models import Client, MailshotPeriodicTask, Log, OutboxMessage, MailshotDeliveryRollup, \
+    UserDeliveryRollup
 from services.general.view_mixins import PKSuccessViewnameMixin, WizardCreateView, WizardUpdateView, \
     SuccessViewnameMixin, ActiveUrlMixin
+from services.mailshots import rollups
 from services.users import UserBelongedListMixin, UserBelongedObjectTestMixin
 
 
@@ -53,6 +53,13 @@ class ClientActiveUrl(ActiveUrlMixin):
     active_url = "clients"
 
 
+class DashboardActiveUrl(ActiveUrlMixin):
+    """
+    Активный url для отчётов
+    """
+    active_url = "dashboard"
+
+
 class MailshotEditMixin(MailshotActiveUrl):
     """
     Миксин общей логики для mailshot wizard views
@@ -165,17 +172,7 @@ class BaseMailshotDetailView(MailshotActiveUrl, DetailView):
     template_name = "mailshots/detail.html"
 
     def get_status(self):
-        if self.object.enabled:
-            if self.object.expires < timezone.now():
-                return "завершена"
-            else:
-                return "активна"
-
-        else:
-            if self.object.is_new:
-                return "создана"
-            else:
-                return "принудительно остановлена"
+        return self.object.get_status_display()
 
     def get_context_data(self, **kwargs):
         return super().get_context_data(**kwargs) | {"status": self.get_status()}
@@ -220,12 +217,9 @@ class BaseMailshotListView(MailshotActiveUrl, ListView):
         Фильтрация по параметру статуса
         """
         status = self.kwargs.get("status")
-
-        match status:
-            case "finished": return super().get_queryset().filter(expires__lt=datetime.now(), enabled=True)
-            case "enabled": return super().get_queryset().filter(enabled=True)
-            case "disabled": return super().get_queryset().filter(enabled=False, is_new=False)
-            case _: return super().get_queryset().filter(is_new=True)
+        if status not in MailshotPeriodicTask.Status.values:
+            status = MailshotPeriodicTask.Status.CREATED
+        return super().get_queryset().filter(status=status)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         return (super().get_context_data(object_list=object_list, **kwargs) |
@@ -259,10 +253,12 @@ class EnableMailshotUpdateView(LoginRequiredMixin,
         self.object = form.save(commit=False)
         self.object.enabled = True
         self.object.is_new = False
-        self.object.save()
+        with transaction.atomic():
+            self.object.save()
+            if self.object.send_now:
+                # задачу опубликует relay_outbox, только если изменение рассылки зафиксировано
+                OutboxMessage.enqueue(settings.MAILSHOT_TASK_NAME, pk=self.object.pk)
         messages.info(self.request, "Рассылка активирована!")
-        if self.object.send_now:
-            send_mailshot.delay(pk=self.object.pk)
 
         return HttpResponseRedirect(self.get_success_url())
 
@@ -426,6 +422,71 @@ class LogDetailView(LoginRequiredMixin, UserBelongedObjectTestMixin, BaseLogDeta
     pass
 
 
+# ##################### ####################### ###################### #
+# ##################### # Отчёты по отправкам # ###################### #
+# ##################### ####################### ###################### #
+
+
+class BaseDeliveryDashboardView(DashboardActiveUrl, TemplateView):
+    """
+    Базовое представление отчёта по отправкам за последние дни.
+    Читает только итоги по часам и суткам (см. DeliveryRollup), поэтому
+    стоимость отчёта не зависит от количества логов
+    """
+    template_name = "mailshots/dashboard.html"
+    report_days = (1, 7, 30, 90)
+    default_days = 7
+    # разрез итогов за весь отчёт: "mailshot" или "user"
+    breakdown_by = "mailshot"
+
+    def get_days(self) -> int:
+        days = self.request.GET.get("days")
+        return int(days) if days in map(str, self.report_days) else self.default_days
+
+    def get_user_rollups(self):
+        """
+        Итоги пользователей, по которым строится отчёт
+        """
+        return UserDeliveryRollup.objects.all()
+
+    def get_breakdown(self, since) -> list[dict]:
+        """
+        Итоги за весь отчёт в разрезе рассылок или пользователей
+        """
+        raise NotImplementedError
+
+    def get_context_data(self, **kwargs):
+        days = self.get_days()
+        period, since = rollups.get_report_period(days)
+        user_rollups = self.get_user_rollups().filter(period=period, period_start__gte=since)
+
+        return super().get_context_data(**kwargs) | {
+            "days": days,
+            "report_days": self.report_days,
+            "period": period,
+            "since": since,
+            "totals": rollups.get_totals(user_rollups),
+            "series": rollups.sum_rollups(user_rollups, "period_start", order_by=("period_start",)),
+            "breakdown": self.get_breakdown(since),
+            "breakdown_by": self.breakdown_by,
+        }
+
+
+class DeliveryDashboardView(LoginRequiredMixin, BaseDeliveryDashboardView):
+    """
+    Отчёт по отправкам рассылок пользователя в разрезе рассылок
+    """
+    def get_user_rollups(self):
+        return super().get_user_rollups().filter(user=self.request.user)
+
+    def get_breakdown(self, since) -> list[dict]:
+        mailshot_rollups = MailshotDeliveryRollup.objects.filter(user=self.request.user,
+                                                                 period=MailshotDeliveryRollup.Period.DAY,
+                                                                 period_start__gte=since)
+        return rollups.sum_rollups(mailshot_rollups, "mailshot_id", "mailshot__defined_name",
+                                   order_by=("-total_delivered", "mailshot_id"))
+
+
 # ##################### ########################### ###################### #
 # ##################### # Представления менеджера # ###################### #
 # ##################### ########################### ###################### #
@@ -451,3 +512,17 @@ class ManagerMailshotDisableUpdateView(PermissionRequiredMixin, BaseDisableMails
     """
     permission_required = "mailshots.can_disable"
     success_viewname = "mailshots:manager_detail"
+
+
+class ManagerDeliveryDashboardView(PermissionRequiredMixin, BaseDeliveryDashboardView):
+    """
+    Отчёт по отправкам всех рассылок для менеджера в разрезе пользователей
+    """
+    permission_required = "mailshots.view_userdeliveryrollup"
+    breakdown_by = "user"
+
+    def get_breakdown(self, since) -> list[dict]:
+        user_rollups = UserDeliveryRollup.objects.filter(period=UserDeliveryRollup.Period.DAY,
+                                                         period_start__gte=since)
+        return rollups.sum_rollups(user_rollups, "user_id", "user__email",
+                                   order_by=("-total_delivered", "user_id"))
@@ -0,0 +1,34 @@
+from django.db.models import Model
+
+
+class BulkCreateBuffer:
+    """
+    Буфер объектов модели, которые записываются в базу пачками через bulk_create.
+    Подходит для частой записи большого количества однотипных строк,
+    когда отдельный INSERT на каждую строку слишком дорог.
+
+    Буфер сбрасывается автоматически при заполнении до size объектов,
+    а также при выходе из блока with
+    """
+    def __init__(self, model: type[Model], size: int = 1000):
+        self.model = model
+        self.size = size
+        self.objects: list[Model] = []
+        self.written = 0
+
+    def add(self, obj: Model):
+        self.objects.append(obj)
+        if len(self.objects) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.objects:
+            self.model.objects.bulk_create(self.objects, batch_size=self.size)
+            self.written += len(self.objects)
+            self.objects = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
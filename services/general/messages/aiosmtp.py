@@ -0,0 +1,198 @@
+"""
+Минимальный асинхронный SMTP-клиент на asyncio streams.
+
+Поддерживает EHLO/HELO, STARTTLS, SSL, AUTH PLAIN/LOGIN, MAIL/RCPT/DATA и QUIT.
+Ошибки сервера и соединения выбрасываются исключениями smtplib, поэтому
+обработка ошибок у синхронного и асинхронного пути отправки общая
+"""
+import asyncio
+import base64
+import socket
+import ssl
+from smtplib import (SMTPAuthenticationError, SMTPConnectError, SMTPDataError, SMTPHeloError,
+                     SMTPNotSupportedError, SMTPRecipientsRefused, SMTPResponseException,
+                     SMTPSenderRefused, SMTPServerDisconnected)
+
+from django.conf import settings
+
+
+CRLF = b"\r\n"
+
+
+class AsyncSMTPClient:
+    """
+    Одна SMTP-сессия. Каждая операция чтения ответа сервера ограничена timeout секундами
+    """
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 use_tls=None, use_ssl=None, timeout=None, local_hostname=None):
+        self.host = host or settings.EMAIL_HOST
+        self.port = int(port or settings.EMAIL_PORT or 25)
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_tls = bool(settings.EMAIL_USE_TLS if use_tls is None else use_tls)
+        self.use_ssl = bool(getattr(settings, "EMAIL_USE_SSL", False) if use_ssl is None else use_ssl)
+        self.timeout = timeout
+        self.local_hostname = local_hostname or socket.getfqdn()
+
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.extensions: dict[str, str] = {}
+
+    @property
+    def is_connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def read_reply(self) -> tuple[int, str]:
+        """
+        Читает (возможно многострочный) ответ сервера
+        """
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            except asyncio.TimeoutError:
+                self.abort()
+                raise SMTPServerDisconnected("Сервер не ответил вовремя")
+            except OSError as e:
+                self.abort()
+                raise SMTPServerDisconnected(f"Соединение прервано: {e!r}") from e
+
+            if not line:
+                self.abort()
+                raise SMTPServerDisconnected("Сервер закрыл соединение")
+
+            lines.append(line[4:].strip().decode(errors="replace"))
+            if line[3:4] != b"-":
+                try:
+                    return int(line[:3]), "\n".join(lines)
+                except ValueError:
+                    self.abort()
+                    raise SMTPServerDisconnected(f"Некорректный ответ сервера: {line!r}")
+
+    async def write(self, data: bytes):
+        """
+        Отправляет данные серверу; ошибки сокета выбрасываются как SMTPServerDisconnected
+        """
+        if not self.is_connected:
+            raise SMTPServerDisconnected("Соединение не установлено")
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except OSError as e:
+            self.abort()
+            raise SMTPServerDisconnected(f"Соединение прервано: {e!r}") from e
+
+    async def command(self, line: str) -> tuple[int, str]:
+        await self.write(line.encode() + CRLF)
+        return await self.read_reply()
+
+    async def connect(self):
+        context = ssl.create_default_context() if self.use_ssl else None
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=context), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise SMTPConnectError(-1, f"Не удалось подключиться к {self.host}:{self.port}: {e!r}")
+
+        code, message = await self.read_reply()
+        if code != 220:
+            self.abort()
+            raise SMTPConnectError(code, message)
+
+        await self.ehlo()
+
+        if self.use_tls:
+            if "starttls" not in self.extensions:
+                raise SMTPNotSupportedError("Сервер не поддерживает STARTTLS")
+            code, message = await self.command("STARTTLS")
+            if code != 220:
+                raise SMTPResponseException(code, message)
+            try:
+                await asyncio.wait_for(self.writer.start_tls(ssl.create_default_context()), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.abort()
+                raise SMTPServerDisconnected(f"Не удалось установить TLS: {e!r}") from e
+            await self.ehlo()
+
+        if self.username and self.password:
+            await self.login()
+
+    async def ehlo(self):
+        code, message = await self.command(f"EHLO {self.local_hostname}")
+        if code != 250:
+            code, message = await self.command(f"HELO {self.local_hostname}")
+            if code != 250:
+                raise SMTPHeloError(code, message)
+
+        self.extensions = {}
+        for line in message.splitlines()[1:]:
+            keyword, _, params = line.partition(" ")
+            self.extensions[keyword.lower()] = params
+
+    async def login(self):
+        mechanisms = self.extensions.get("auth", "").upper().split()
+
+        if "LOGIN" in mechanisms and "PLAIN" not in mechanisms:
+            code, message = await self.command("AUTH LOGIN")
+            if code == 334:
+                code, message = await self.command(base64.b64encode(self.username.encode()).decode())
+            if code == 334:
+                code, message = await self.command(base64.b64encode(self.password.encode()).decode())
+        else:
+            token = base64.b64encode(f"\0{self.username}\0{self.password}".encode()).decode()
+            code, message = await self.command(f"AUTH PLAIN {token}")
+
+        if code not in (235, 503):
+            raise SMTPAuthenticationError(code, message)
+
+    async def sendmail(self, from_addr: str, recipients: list[str], msg: bytes) -> dict:
+        """
+        Отправка письма. Как и smtplib.SMTP.sendmail, возвращает словарь отказавших
+        получателей, если письмо принято хотя бы для одного из них
+        """
+        code, message = await self.command(f"MAIL FROM:<{from_addr}>")
+        if code != 250:
+            await self.command("RSET")
+            raise SMTPSenderRefused(code, message, from_addr)
+
+        refused = {}
+        for recipient in recipients:
+            code, message = await self.command(f"RCPT TO:<{recipient}>")
+            if code not in (250, 251):
+                refused[recipient] = (code, message)
+
+        if len(refused) == len(recipients):
+            await self.command("RSET")
+            raise SMTPRecipientsRefused(refused)
+
+        code, message = await self.command("DATA")
+        if code != 354:
+            await self.command("RSET")
+            raise SMTPDataError(code, message)
+
+        data = b"\r\n".join(
+            b"." + line if line.startswith(b".") else line
+            for line in msg.replace(b"\r\n", b"\n").split(b"\n")
+        )
+        if not data.endswith(CRLF):
+            data += CRLF
+        await self.write(data + b"." + CRLF)
+
+        code, message = await self.read_reply()
+        if code != 250:
+            raise SMTPDataError(code, message)
+        return refused
+
+    async def quit(self):
+        if self.is_connected:
+            try:
+                await self.command("QUIT")
+            except SMTPServerDisconnected:
+                pass
+        self.abort()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
@@ -0,0 +1,214 @@
+"""
+Пул переиспользуемых соединений с почтовым сервером.
+
+Пул живёт в памяти процесса (на каждый процесс воркера celery свой пул),
+соединения раздаются по ключу (бэкенд, хост, порт, пользователь),
+количество одновременно открытых соединений с одним хостом ограничено
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from smtplib import SMTPException
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+
+# как часто асинхронное ожидание места проверяет ограничение соединений с хостом, с
+SLOT_POLL_INTERVAL = 0.05
+
+
+class ConnectionPoolTimeout(SMTPException):
+    """
+    Не удалось дождаться свободного соединения с хостом
+    """
+    pass
+
+
+class PooledConnection:
+    """
+    Соединение пула: почтовый бэкенд django и время его последнего использования
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.last_used = time.monotonic()
+
+    @property
+    def idle(self) -> float:
+        """
+        Сколько секунд соединение простаивало
+        """
+        return time.monotonic() - self.last_used
+
+    def is_alive(self) -> bool:
+        """
+        Проверка живости соединения командой NOOP.
+        Бэкенды без сетевого соединения (locmem, file, console) считаются живыми всегда
+        """
+        if not hasattr(self.backend, "connection"):
+            return True
+        if self.backend.connection is None:
+            return False
+
+        try:
+            return self.backend.connection.noop()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    @property
+    def is_closed(self) -> bool:
+        return getattr(self.backend, "connection", True) is None
+
+    def open(self):
+        self.backend.open()
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.backend.close()
+        except (SMTPException, OSError):
+            pass
+
+
+class EmailConnectionPool:
+    """
+    Пул почтовых соединений.
+
+    max_per_host:
+        максимальное количество одновременно выданных соединений с одним хостом
+    idle_timeout:
+        соединение, простоявшее дольше, закрывается и открывается заново
+    health_check_interval:
+        соединение, простоявшее дольше, перед выдачей проверяется командой NOOP
+    acquire_timeout:
+        сколько секунд ждать свободного соединения, прежде чем бросить ConnectionPoolTimeout
+    """
+    def __init__(self, max_per_host=None, idle_timeout=None, health_check_interval=None, acquire_timeout=None):
+        self.max_per_host = max_per_host or settings.EMAIL_POOL_MAX_PER_HOST
+        self.idle_timeout = idle_timeout or settings.EMAIL_POOL_IDLE_TIMEOUT
+        self.health_check_interval = health_check_interval or settings.EMAIL_POOL_HEALTH_CHECK_INTERVAL
+        self.acquire_timeout = acquire_timeout or settings.EMAIL_POOL_ACQUIRE_TIMEOUT
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """
+        Сбрасывает состояние пула. Нужен после fork: соединения родителя
+        не должны использоваться дочерними процессами
+        """
+        self._pid = os.getpid()
+        self._idle: dict[tuple, list[PooledConnection]] = {}
+        self._slots: dict[tuple, threading.BoundedSemaphore] = {}
+
+    @staticmethod
+    def get_key(**kwargs) -> tuple:
+        """
+        Ключ пула: соединения с разными хостами и учётными данными не смешиваются
+        """
+        return (
+            kwargs.get("backend") or settings.EMAIL_BACKEND,
+            kwargs.get("host") or settings.EMAIL_HOST,
+            kwargs.get("port") or settings.EMAIL_PORT,
+            kwargs.get("username") or settings.EMAIL_HOST_USER,
+        )
+
+    def get_slots(self, key: tuple) -> threading.BoundedSemaphore:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    async def acquire_slot_async(self, **kwargs):
+        """
+        Занимает место в ограничении соединений с хостом для соединения,
+        которое открывается не через пул (асинхронные SMTP-сессии).
+        Ожидание не блокирует цикл событий
+        """
+        key = self.get_key(**kwargs)
+        slots = self.get_slots(key)
+        deadline = time.monotonic() + self.acquire_timeout
+        while not slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise ConnectionPoolTimeout(f"Нет свободных соединений с {key[1]}")
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+    def release_slot(self, **kwargs):
+        self.get_slots(self.get_key(**kwargs)).release()
+
+    def pop_idle(self, key: tuple) -> PooledConnection | None:
+        """
+        Достаёт из пула пригодное соединение, закрывая просроченные и мёртвые
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                pooled = idle.pop()
+
+            if pooled.idle > self.idle_timeout:
+                pooled.close()
+                continue
+            if pooled.idle > self.health_check_interval and not pooled.is_alive():
+                pooled.close()
+                continue
+            return pooled
+
+    def acquire(self, **kwargs) -> PooledConnection:
+        key = self.get_key(**kwargs)
+        if not self.get_slots(key).acquire(timeout=self.acquire_timeout):
+            raise ConnectionPoolTimeout(f"Нет свободных соединений с {key[1]}")
+
+        try:
+            pooled = self.pop_idle(key)
+            if pooled is None:
+                pooled = PooledConnection(get_connection(fail_silently=False, **kwargs))
+            if pooled.is_closed:
+                pooled.open()
+        except BaseException:
+            self.get_slots(key).release()
+            raise
+
+        return pooled
+
+    def release(self, pooled: PooledConnection, **kwargs):
+        key = self.get_key(**kwargs)
+        pooled.last_used = time.monotonic()
+
+        with self._lock:
+            if self._pid == os.getpid():
+                self._idle.setdefault(key, []).append(pooled)
+        self.get_slots(key).release()
+
+    @contextmanager
+    def connection(self, **kwargs):
+        """
+        Выдаёт открытый почтовый бэкенд django, который можно передать
+        в send_mail(connection=...). После выхода из блока соединение
+        остаётся открытым и возвращается в пул
+        """
+        pooled = self.acquire(**kwargs)
+        try:
+            yield pooled.backend
+        except (SMTPException, OSError):
+            # соединение могло остаться в неопределённом состоянии
+            pooled.close()
+            raise
+        finally:
+            self.release(pooled, **kwargs)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for pooled in connections:
+                pooled.close()
+
+
+email_connection_pool = EmailConnectionPool()
@@ -0,0 +1,66 @@
+"""
+Поля подстановки в тексте сообщения рассылки: {{ name }}, {{ surname }} и т.д.
+
+Текст компилируется один раз в строку формата python, после чего
+подстановка значений одного получателя - это один вызов str.format
+без разбора шаблона, контекста и движка шаблонов django
+"""
+import re
+from typing import Iterable
+
+
+MERGE_FIELD_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+# поля клиента, доступные для подстановки, в порядке значений в кортеже клиента
+MERGE_FIELDS = ("email", "name", "surname", "patronymic")
+
+
+class MergeTemplate:
+    """
+    Скомпилированный текст с полями подстановки.
+
+    Значения передаются кортежем в порядке fields. Как и в шаблонах django,
+    неизвестные поля и пустые значения подставляются пустой строкой
+    """
+    def __init__(self, text: str | None, fields: tuple[str, ...] = MERGE_FIELDS):
+        self.text = text or ""
+        self.fields = fields
+        self.used_fields: list[str] = []
+
+        parts = []
+        position = 0
+        for match in MERGE_FIELD_RE.finditer(self.text):
+            parts.append(self.escape(self.text[position:match.start()]))
+            name = match.group(1)
+            self.used_fields.append(name)
+            if name in fields:
+                parts.append("{%d}" % fields.index(name))
+            position = match.end()
+        parts.append(self.escape(self.text[position:]))
+
+        self.format = "".join(parts).format
+
+    @staticmethod
+    def escape(text: str) -> str:
+        return text.replace("{", "{{").replace("}", "}}")
+
+    @property
+    def is_static(self) -> bool:
+        """
+        Текст без полей подстановки одинаков для всех получателей
+        """
+        return not self.used_fields
+
+    @property
+    def unknown_fields(self) -> list[str]:
+        return [name for name in self.used_fields if name not in self.fields]
+
+    def render(self, values: tuple) -> str:
+        return self.format(*[value or "" for value in values])
+
+    def render_many(self, rows: Iterable[tuple]) -> list[str]:
+        """
+        Подстановка для пачки получателей
+        """
+        format = self.format
+        return [format(*[value or "" for value in values]) for values in rows]
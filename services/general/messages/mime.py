@@ -0,0 +1,111 @@
+"""
+Заранее собранное и закешированное MIME-представление письма.
+
+Заголовки, не зависящие от получателя, и закодированное тело письма
+собираются один раз на версию содержимого и хранятся в кеше под ключом
+по хешу содержимого. При отправке к ним добавляются только заголовки
+To, Date и Message-ID
+"""
+import hashlib
+from email.header import Header
+from email.utils import formatdate, make_msgid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+
+PER_MESSAGE_HEADERS = ("To", "Date", "Message-ID")
+
+
+def get_payload_key(subject: str, body: str, from_email: str) -> str:
+    """
+    Ключ кеша по хешу содержимого письма: правка сообщения даёт новый ключ
+    """
+    content = "\0".join((subject or "", body or "", from_email or "", settings.DEFAULT_CHARSET))
+    return "mime_payload_" + hashlib.sha256(content.encode()).hexdigest()
+
+
+def build_payload(subject: str, body: str, from_email: str) -> bytes:
+    """
+    Собирает письмо средствами django и убирает из него заголовки,
+    которые различаются у каждого отправляемого экземпляра
+    """
+    msg = EmailMessage(subject, body, from_email).message()
+    for header in PER_MESSAGE_HEADERS:
+        del msg[header]
+    return msg.as_bytes(linesep="\r\n")
+
+
+def get_payload(subject: str, body: str, from_email: str) -> bytes:
+    """
+    Закешированное MIME-представление письма
+    """
+    if not settings.CACHE_ENABLED:
+        return build_payload(subject, body, from_email)
+
+    key = get_payload_key(subject, body, from_email)
+    payload = cache.get(key)
+
+    if payload is None:
+        payload = build_payload(subject, body, from_email)
+        cache.set(key, payload, settings.MAILSHOT_PAYLOAD_CACHE_LIFETIME)
+
+    return payload
+
+
+def invalidate_payload(subject: str, body: str, from_email: str):
+    if settings.CACHE_ENABLED:
+        cache.delete(get_payload_key(subject, body, from_email))
+
+
+class PreparedMIME:
+    """
+    Минимальная замена email.message.Message для почтовых бэкендов django:
+    им нужны только as_bytes, as_string и get_charset
+    """
+    def __init__(self, payload: bytes, to: list[str], encoding: str | None = None):
+        self.payload = payload
+        self.to = to
+        self.encoding = encoding or settings.DEFAULT_CHARSET
+
+    def get_charset(self):
+        return None
+
+    def get_to_header(self) -> str:
+        """
+        Заголовок To как у django: адреса с не-ASCII символами кодируются
+        по RFC 2047, длинный список получателей переносится на строки до 78 символов
+        """
+        addresses = ", ".join(sanitize_address(address, self.encoding) for address in self.to)
+        return Header(addresses, header_name="To").encode(linesep="\r\n")
+
+    def as_bytes(self, unixfrom=False, linesep="\n") -> bytes:
+        headers = (
+            f"To: {self.get_to_header()}\r\n"
+            f"Date: {formatdate(localtime=settings.EMAIL_USE_LOCALTIME)}\r\n"
+            f"Message-ID: {make_msgid(domain=DNS_NAME)}\r\n"
+        ).encode()
+        data = headers + self.payload
+
+        if linesep != "\r\n":
+            data = data.replace(b"\r\n", linesep.encode())
+        return data
+
+    def as_string(self, unixfrom=False, linesep="\n") -> str:
+        return self.as_bytes(unixfrom, linesep).decode()
+
+
+class PreparedEmailMessage(EmailMessage):
+    """
+    Письмо с заранее собранным MIME-представлением payload.
+    subject и body хранятся только для просмотра (например, в locmem outbox)
+    """
+    def __init__(self, subject, body, from_email, to, payload: bytes, **kwargs):
+        super().__init__(subject, body, from_email, to, **kwargs)
+        self.payload = payload
+
+    def message(self) -> PreparedMIME:
+        return PreparedMIME(self.payload, self.to, self.encoding)
@@ -0,0 +1,124 @@
+"""
+Классификация ошибок отправки почты и circuit breaker для SMTP-хостов.
+
+Состояние circuit breaker хранится в Redis и общее для всех воркеров:
+после failure_threshold временных ошибок за failure_window секунд хост
+считается недоступным на recovery_timeout секунд, после чего к нему
+пропускается одна пробная отправка. Успешная проба закрывает цепь,
+неудачная - снова открывает её
+"""
+import random
+from smtplib import SMTPConnectError, SMTPException, SMTPResponseException, SMTPServerDisconnected
+
+from django.conf import settings
+
+from services.general.messages.connections import ConnectionPoolTimeout
+from services.general.redis import get_redis, make_key
+
+
+class TransientDeliveryError(Exception):
+    """
+    Временная ошибка отправки, после которой отправку стоит повторить.
+    retry_after - рекомендуемая задержка перед повтором, None - на усмотрение вызывающего
+    """
+    retry_after: float | None = None
+
+
+class CircuitOpen(TransientDeliveryError):
+    """
+    Хост считается недоступным, отправка не выполнялась
+    """
+    def __init__(self, name: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Цепь {name} разомкнута, повтор через {retry_after:.0f} с")
+
+
+def is_transient(e: BaseException) -> bool:
+    """
+    Временные ошибки: обрыв и невозможность установить соединение, таймауты,
+    нехватка соединений в пуле и ответы сервера с кодами 4xx
+    """
+    if isinstance(e, (SMTPConnectError, SMTPServerDisconnected, ConnectionPoolTimeout)):
+        return True
+    if isinstance(e, SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, SMTPException):
+        return False
+    # ошибки сокета: отказ в соединении, таймауты, ошибки TLS
+    return isinstance(e, OSError)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker в Redis
+    """
+    def __init__(self, name: str, failure_threshold: int, failure_window: int,
+                 recovery_timeout: int, probe_timeout: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.recovery_timeout = recovery_timeout
+        self.probe_timeout = probe_timeout
+
+        self.state_key = make_key("circuit", name, "state")
+        self.cooldown_key = make_key("circuit", name, "cooldown")
+        self.probe_key = make_key("circuit", name, "probe")
+        self.failures_key = make_key("circuit", name, "failures")
+
+    @classmethod
+    def for_smtp_host(cls, host: str | None = None) -> "CircuitBreaker":
+        return cls(
+            f"smtp:{host or settings.EMAIL_HOST}",
+            failure_threshold=settings.EMAIL_CIRCUIT_FAILURE_THRESHOLD,
+            failure_window=settings.EMAIL_CIRCUIT_FAILURE_WINDOW,
+            recovery_timeout=settings.EMAIL_CIRCUIT_RECOVERY_TIMEOUT,
+            probe_timeout=settings.EMAIL_CIRCUIT_PROBE_TIMEOUT,
+        )
+
+    def allow(self) -> bool:
+        """
+        Можно ли обращаться к хосту. В разомкнутом состоянии после
+        окончания recovery_timeout разрешение получает только один
+        воркер - он выполняет пробную отправку
+        """
+        redis = get_redis()
+        if redis.get(self.state_key) is None:
+            return True
+        if redis.exists(self.cooldown_key):
+            return False
+        return bool(redis.set(self.probe_key, 1, nx=True, ex=self.probe_timeout))
+
+    def retry_after(self) -> float:
+        """
+        Через сколько секунд стоит снова обратиться к хосту, с разбросом,
+        чтобы ожидающие воркеры не пришли все одновременно
+        """
+        ttl = get_redis().ttl(self.cooldown_key)
+        return max(ttl, 1) + random.uniform(0, self.probe_timeout)
+
+    def record_success(self):
+        redis = get_redis()
+        if redis.get(self.state_key) is not None or redis.exists(self.failures_key):
+            redis.delete(self.state_key, self.cooldown_key, self.probe_key, self.failures_key)
+
+    def record_failure(self):
+        redis = get_redis()
+
+        if redis.get(self.state_key) is not None:
+            # неудачная проба - цепь снова размыкается
+            self.open()
+            return
+
+        failures = redis.incr(self.failures_key)
+        if failures == 1:
+            redis.expire(self.failures_key, self.failure_window)
+
+        if failures >= self.failure_threshold:
+            self.open()
+
+    def open(self):
+        with get_redis().pipeline() as pipe:
+            pipe.set(self.state_key, "open")
+            pipe.set(self.cooldown_key, 1, ex=self.recovery_timeout)
+            pipe.delete(self.probe_key, self.failures_key)
+            pipe.execute()
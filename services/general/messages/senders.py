@@ -1,8 +1,10 @@
-from typing import Any
+from typing import Any, Iterable
 
 from django.conf import settings
 from django.core.mail import send_mail
 
+from services.general.messages.connections import email_connection_pool
+from services.general.messages.throttling import OutboundRateLimiter
 from users.tasks import async_send
 
 
@@ -35,6 +37,14 @@ class MessageContentMixin:
         """
         raise NotImplementedError
 
+    def get_recipient_batches(self) -> Iterable[list]:
+        """
+        Метод получения получателей пачками. По умолчанию все
+        получатели отдаются одной пачкой; при большом количестве получателей
+        стоит переопределить метод так, чтобы пачки читались из базы по очереди
+        """
+        yield list(self.get_recipients())
+
     def get_message_content(self) -> dict:
         """
         Метод для описания получения контента сообщения:
@@ -51,14 +61,15 @@ class EmailSenderMixin(MessageContentMixin, SenderMixin):
     from_email: str = None
     extra_email_kwargs: dict | None = None
 
-    def get_send_kwargs(self):
+    def get_send_kwargs(self, recipient_list: list | None = None):
         """
-        Получает аргументы отправки письма электронной почтой
+        Получает аргументы отправки письма электронной почтой.
+        Если recipient_list не передан, получатели берутся из get_recipients
         """
         message_content = self.get_message_content()
         kwargs = dict(
             from_email=self.from_email or settings.EMAIL_HOST_USER,
-            recipient_list=self.get_recipients(),
+            recipient_list=self.get_recipients() if recipient_list is None else recipient_list,
             fail_silently=False
         ) | message_content
 
@@ -66,6 +77,24 @@ class EmailSenderMixin(MessageContentMixin, SenderMixin):
 
         return kwargs
 
+    def get_rate_limiter(self) -> OutboundRateLimiter | None:
+        """
+        Ограничитель скорости отправки, None - без ограничения
+        """
+        if settings.EMAIL_RATE_LIMIT_ENABLED:
+            return OutboundRateLimiter()
+        return None
+
+    def throttle(self, recipients: int, max_wait: float | None = None):
+        """
+        Вызывается перед отправкой каждой пачки: ждёт, пока общий для всех
+        воркеров лимит позволит отправить письма recipients получателям.
+        Если ждать пришлось бы дольше max_wait секунд, бросает RateLimitExceeded
+        """
+        limiter = self.get_rate_limiter()
+        if limiter is not None:
+            limiter.acquire(recipients, max_wait=max_wait)
+
     def asend(self):
         """
         Специализированный метод для отправки сообщения средствами
@@ -74,7 +103,19 @@ class EmailSenderMixin(MessageContentMixin, SenderMixin):
         async_send.delay(**self.get_send_kwargs())
 
     def send(self):
-        return send_mail(**self.get_send_kwargs())
+        """
+        Отправляет по письму на каждую пачку получателей через одно соединение пула.
+        Возвращает количество отправленных писем
+        """
+        kwargs = self.get_send_kwargs(recipient_list=[])
+        sent = 0
+
+        with email_connection_pool.connection() as connection:
+            for recipient_list in self.get_recipient_batches():
+                self.throttle(len(recipient_list))
+                sent += send_mail(connection=connection, **(kwargs | {"recipient_list": recipient_list}))
+
+        return sent
 
     def __call__(self):
         return self.send()
@@ -0,0 +1,251 @@
+"""
+Локальный SMTP-сервер, принимающий и отбрасывающий письма.
+
+Нужен для нагрузочного тестирования отправки без реального почтового сервера:
+умеет добавлять задержку ответов, отвечать случайными ошибками 4xx/5xx,
+обрывать соединения и ограничивать скорость приёма писем на соединение.
+По каждому принятому или отклонённому письму собирается статистика
+"""
+import asyncio
+import json
+import random
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class MessageStat:
+    """
+    Результат обработки одного письма
+    """
+    connection: int
+    recipients: int
+    refused: int
+    size: int
+    code: int
+    # время от команды MAIL до ответа на окончание DATA
+    duration: float
+    received_at: float = field(default_factory=time.time)
+
+
+class SMTPSinkStats:
+    """
+    Статистика сервера: счётчики соединений и записи по каждому письму
+    """
+    def __init__(self, keep_messages: int = 100_000):
+        self.keep_messages = keep_messages
+        self.started_at = time.monotonic()
+        self.connections = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.messages: list[MessageStat] = []
+        self.accepted = 0
+        self.rejected = 0
+        self.recipients = 0
+
+    def add(self, stat: MessageStat):
+        if stat.code == 250:
+            self.accepted += 1
+            self.recipients += stat.recipients - stat.refused
+        else:
+            self.rejected += 1
+        if len(self.messages) < self.keep_messages:
+            self.messages.append(stat)
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        durations = sorted(stat.duration for stat in self.messages)
+        summary = {
+            "elapsed": round(elapsed, 3),
+            "connections": self.connections,
+            "dropped": self.dropped,
+            "throttled": self.throttled,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "recipients": self.recipients,
+            "messages_per_second": round(self.accepted / elapsed, 2) if elapsed else 0,
+        }
+        if len(durations) >= 2:
+            quantiles = statistics.quantiles(durations, n=100)
+            summary |= {
+                "p50_ms": round(quantiles[49] * 1000, 2),
+                "p95_ms": round(quantiles[94] * 1000, 2),
+                "p99_ms": round(quantiles[98] * 1000, 2),
+            }
+        return summary
+
+
+class SMTPSink:
+    """
+    SMTP-сервер на asyncio.
+
+    latency, jitter:
+        задержка каждого ответа сервера и её случайный разброс, в секундах
+    temp_failure_rate, perm_failure_rate:
+        вероятность ответить на RCPT и на окончание DATA кодом 4xx или 5xx
+    drop_rate:
+        вероятность оборвать соединение вместо ответа на команду
+    connection_rate:
+        максимальное количество писем в секунду на одно соединение, 0 - без ограничения
+    max_messages_per_connection:
+        после стольких писем соединение закрывается ответом 421, 0 - без ограничения
+    stats_file:
+        файл, в который пишется json по каждому письму
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8025, latency: float = 0, jitter: float = 0,
+                 temp_failure_rate: float = 0, perm_failure_rate: float = 0, drop_rate: float = 0,
+                 connection_rate: float = 0, max_messages_per_connection: int = 0,
+                 stats_file=None, seed: int | None = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.temp_failure_rate = temp_failure_rate
+        self.perm_failure_rate = perm_failure_rate
+        self.drop_rate = drop_rate
+        self.connection_rate = connection_rate
+        self.max_messages_per_connection = max_messages_per_connection
+        self.stats_file = stats_file
+
+        self.random = random.Random(seed)
+        self.stats = SMTPSinkStats()
+        self.server: asyncio.AbstractServer | None = None
+
+    class Dropped(Exception):
+        pass
+
+    async def reply(self, writer: asyncio.StreamWriter, code: int, *lines: str):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            raise self.Dropped
+
+        lines = lines or ("OK",)
+        data = "".join(f"{code}-{line}\r\n" for line in lines[:-1]) + f"{code} {lines[-1]}\r\n"
+        writer.write(data.encode())
+        await writer.drain()
+
+    def pick_failure(self, temporary: int, permanent: int) -> int | None:
+        """
+        Случайный код ошибки или None, если команда должна пройти успешно
+        """
+        chance = self.random.random()
+        if chance < self.temp_failure_rate:
+            return temporary
+        if chance < self.temp_failure_rate + self.perm_failure_rate:
+            return permanent
+        return None
+
+    @staticmethod
+    async def read_data(reader: asyncio.StreamReader) -> int:
+        size = 0
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionResetError
+            if line in (b".\r\n", b".\n"):
+                return size
+            size += len(line)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats.connections += 1
+        connection = self.stats.connections
+        messages = 0
+        last_message_at = 0.0
+        mail_started = None
+        recipients = refused = 0
+        refused_code = 0
+
+        try:
+            await self.reply(writer, 220, "smtp sink ready")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                verb, _, argument = line.decode(errors="replace").strip().partition(" ")
+                verb = verb.upper()
+
+                if verb == "EHLO":
+                    await self.reply(writer, 250, "smtp-sink", "8BITMIME", "AUTH PLAIN LOGIN", "OK")
+                elif verb == "HELO":
+                    await self.reply(writer, 250, "smtp-sink")
+                elif verb == "AUTH":
+                    mechanism, _, token = argument.partition(" ")
+                    if mechanism.upper() == "LOGIN":
+                        await self.reply(writer, 334, "VXNlcm5hbWU6")
+                        await reader.readline()
+                        await self.reply(writer, 334, "UGFzc3dvcmQ6")
+                        await reader.readline()
+                    elif not token:
+                        await self.reply(writer, 334, "")
+                        await reader.readline()
+                    await self.reply(writer, 235, "Authentication successful")
+                elif verb == "MAIL":
+                    if self.max_messages_per_connection and messages >= self.max_messages_per_connection:
+                        self.stats.throttled += 1
+                        await self.reply(writer, 421, "Too many messages on this connection")
+                        return
+                    mail_started = time.monotonic()
+                    recipients = refused = 0
+                    await self.reply(writer, 250)
+                elif verb == "RCPT":
+                    recipients += 1
+                    code = self.pick_failure(450, 550)
+                    if code:
+                        refused += 1
+                        refused_code = code
+                        await self.reply(writer, code, "Recipient rejected")
+                    else:
+                        await self.reply(writer, 250)
+                elif verb == "DATA":
+                    await self.reply(writer, 354, "End data with <CR><LF>.<CR><LF>")
+                    size = await self.read_data(reader)
+
+                    if self.connection_rate:
+                        wait = last_message_at + 1 / self.connection_rate - time.monotonic()
+                        if wait > 0:
+                            self.stats.throttled += 1
+                            await asyncio.sleep(wait)
+                    last_message_at = time.monotonic()
+
+                    code = self.pick_failure(451, 554) or 250
+                    await self.reply(writer, code, "Queued" if code == 250 else "Message rejected")
+                    messages += 1
+                    self.record(MessageStat(connection, recipients, refused, size, code,
+                                            time.monotonic() - (mail_started or last_message_at)))
+                    mail_started = None
+                elif verb == "RSET":
+                    if mail_started is not None and recipients and refused == recipients:
+                        # клиент отменил письмо, которое не принял ни один получатель
+                        self.record(MessageStat(connection, recipients, refused, 0, refused_code,
+                                                time.monotonic() - mail_started))
+                    mail_started = None
+                    await self.reply(writer, 250)
+                elif verb == "NOOP":
+                    await self.reply(writer, 250)
+                elif verb == "QUIT":
+                    await self.reply(writer, 221, "Bye")
+                    return
+                else:
+                    await self.reply(writer, 502, "Command not implemented")
+        except self.Dropped:
+            self.stats.dropped += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def record(self, stat: MessageStat):
+        self.stats.add(stat)
+        if self.stats_file is not None:
+            self.stats_file.write(json.dumps(asdict(stat)) + "\n")
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        return self.server
+
+    async def serve_forever(self):
+        server = self.server or await self.start()
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,140 @@
+"""
+Ограничение скорости исходящей почты, общее для всех воркеров.
+
+Для каждого SMTP-хоста и каждого пользователя в Redis хранится
+token bucket: rate токенов в секунду, не больше capacity токенов в запасе.
+Один токен - один получатель письма
+"""
+import time
+
+from django.conf import settings
+
+from services.general.redis import get_redis, make_key
+
+
+# KEYS - ключи всех лимитов; ARGV - количество токенов и пары (rate, capacity)
+# каждого лимита. Токены списываются, только если их хватает во всех лимитах.
+# Отрицательное количество возвращает ранее списанные токены
+TOKEN_BUCKET_SCRIPT = """
+local requested = tonumber(ARGV[1])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local levels = {}
+local wait = 0
+local limiting = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+
+    if tokens < requested and (requested - tokens) / rate > wait then
+        wait = (requested - tokens) / rate
+        limiting = i
+    end
+end
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = math.min(capacity, tokens - requested)
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {tostring(wait), limiting}
+"""
+
+
+class RateLimitExceeded(Exception):
+    """
+    Токены не освободились за допустимое время ожидания.
+    retry_after - через сколько секунд имеет смысл повторить попытку
+    """
+    def __init__(self, key: str, retry_after: float):
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"Превышен лимит отправки {key}, повтор через {retry_after:.1f} с")
+
+
+class TokenBucket:
+    """
+    Token bucket в Redis: rate токенов в секунду, не больше capacity в запасе
+    """
+    def __init__(self, key: str, rate: float, capacity: int):
+        self.key = make_key("ratelimit", key)
+        self.rate = rate
+        self.capacity = capacity
+
+
+class OutboundRateLimiter:
+    """
+    Лимиты исходящей почты по SMTP-хосту и, если указан, по пользователю
+    """
+    def __init__(self, host: str | None = None, user_pk: int | None = None):
+        self.buckets = [
+            TokenBucket(f"host:{host or settings.EMAIL_HOST}",
+                        settings.EMAIL_RATE_LIMIT_HOST_RATE,
+                        settings.EMAIL_RATE_LIMIT_HOST_CAPACITY),
+        ]
+
+        if user_pk is not None:
+            self.buckets.append(
+                TokenBucket(f"user:{user_pk}",
+                            settings.EMAIL_RATE_LIMIT_USER_RATE,
+                            settings.EMAIL_RATE_LIMIT_USER_CAPACITY)
+            )
+
+    script = None
+
+    def try_acquire(self, tokens: int = 1) -> tuple[float, TokenBucket | None]:
+        """
+        Пробует списать tokens токенов сразу во всех лимитах одним Lua-скриптом,
+        поэтому проверка атомарна для всех воркеров, а токены одного лимита
+        не тратятся, если не хватает другого. Возвращает (0, None), если токены
+        списаны, иначе - сколько секунд нужно подождать и лимит, которого не хватило
+        """
+        if OutboundRateLimiter.script is None:
+            OutboundRateLimiter.script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+
+        args = [tokens]
+        for bucket in self.buckets:
+            args += [bucket.rate, bucket.capacity]
+        wait, limiting = OutboundRateLimiter.script(keys=[bucket.key for bucket in self.buckets], args=args)
+        return float(wait), self.buckets[int(limiting) - 1] if int(limiting) else None
+
+    def acquire(self, tokens: int = 1, max_wait: float | None = None):
+        """
+        Списывает tokens токенов, при необходимости дожидаясь их появления.
+        Если ожидание превысило бы max_wait секунд, бросает RateLimitExceeded.
+        Запросы больше наименьшего capacity списываются частями; если часть
+        не дождалась токенов, уже списанные части возвращаются в лимиты
+        """
+        capacity = min(bucket.capacity for bucket in self.buckets)
+        waited = 0.0
+        acquired = 0
+
+        while tokens > 0:
+            portion = min(tokens, capacity)
+            wait, bucket = self.try_acquire(portion)
+
+            if not wait:
+                tokens -= portion
+                acquired += portion
+                continue
+
+            if max_wait is not None and waited + wait > max_wait:
+                if acquired:
+                    self.try_acquire(-acquired)
+                raise RateLimitExceeded(bucket.key, wait)
+
+            time.sleep(wait)
+            waited += wait
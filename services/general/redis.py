@@ -0,0 +1,23 @@
+"""
+Общий клиент Redis для координации воркеров (ограничение скорости,
+блокировки, счётчики). Использует тот же Redis, что и кеш
+"""
+from functools import cache
+
+import redis
+from django.conf import settings
+
+
+@cache
+def get_redis() -> redis.Redis:
+    """
+    Клиент Redis на процесс. Пул соединений redis-py сам пересоздаётся после fork
+    """
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+def make_key(*parts) -> str:
+    """
+    Ключ Redis с общим для проекта префиксом
+    """
+    return ":".join((settings.REDIS_KEY_PREFIX, *map(str, parts)))
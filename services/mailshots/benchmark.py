@@ -0,0 +1,313 @@
+"""
+Замер пропускной способности отправки рассылки.
+
+Рассылка отправляется как обычно, но без записи лога и событий доставки
+и без лимита скорости (если он не включён явно); при этом замеряются время
+каждой пачки получателей, суммарное время запросов к базе и обращений
+к почтовому серверу, а также пиковое потребление памяти процессом. При асинхронной отправке
+время обращений к почтовому серверу суммируется по всем одновременным сессиям
+и может превышать общее время отправки
+"""
+import resource
+import statistics
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask
+
+from mailshots.models import Client, Message, MailshotPeriodicTask, StatisticsCounter
+from services.mailshots.crontabs import collect_orphan_crontabs, get_shared_crontab
+from services.mailshots.schedule import dispatch_offset, get_next_run_at
+from services.mailshots.senders import MailshotSender
+from users.models import User
+
+
+class QueryTimer:
+    """
+    Обёртка выполнения запросов к базе (см. connection.execute_wrapper),
+    считающая количество и суммарное время запросов во всех потоках
+    """
+    def __init__(self):
+        self.queries = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.queries += 1
+                self.elapsed += elapsed
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextmanager
+    def timing(self):
+        """
+        Считает запросы текущего соединения и соединений, открытых
+        внутри блока в других потоках (например, через sync_to_async)
+        """
+        self.install(connection=connection)
+        connection_created.connect(self.install)
+        try:
+            yield self
+        finally:
+            connection_created.disconnect(self.install)
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class BenchmarkMailshotSender(MailshotSender):
+    """
+    Отправитель рассылки, замеряющий время пачек и обращений к почтовому серверу
+    """
+    record_events = False
+
+    def __init__(self, pk, rate_limit: bool = False, **kwargs):
+        super().__init__(pk, **kwargs)
+        self.rate_limit = rate_limit
+        self.messages = 0
+        self.smtp_time = 0.0
+        self.batch_started: list[float] = []
+
+    def get_rate_limiter(self):
+        return super().get_rate_limiter() if self.rate_limit else None
+
+    def before_chunk(self, deliveries):
+        self.batch_started.append(time.perf_counter())
+        super().before_chunk(deliveries)
+
+    def send_message(self, connection, message):
+        start = time.perf_counter()
+        try:
+            return super().send_message(connection, message)
+        finally:
+            self.smtp_time += time.perf_counter() - start
+            self.messages += 1
+
+    async def send_message_async(self, client, message):
+        start = time.perf_counter()
+        try:
+            return await super().send_message_async(client, message)
+        finally:
+            self.smtp_time += time.perf_counter() - start
+            self.messages += 1
+
+    def get_batch_latencies(self, finished: float) -> list[float]:
+        """
+        Время каждой пачки: от начала её отправки до начала следующей
+        """
+        boundaries = self.batch_started + [finished]
+        return [end - start for start, end in zip(boundaries, boundaries[1:])]
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Пиковое потребление памяти процессом в мегабайтах
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux отдаёт килобайты, macos - байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def get_percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    if len(values) == 1:
+        return {"p50_ms": round(values[0] * 1000, 2), "p95_ms": round(values[0] * 1000, 2),
+                "p99_ms": round(values[0] * 1000, 2), "max_ms": round(values[0] * 1000, 2)}
+
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        "p50_ms": round(quantiles[49] * 1000, 2),
+        "p95_ms": round(quantiles[94] * 1000, 2),
+        "p99_ms": round(quantiles[98] * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2),
+    }
+
+
+@contextmanager
+def synthetic_mailshot(recipients: int):
+    """
+    Временная выключенная рассылка со своим пользователем и recipients клиентами.
+    Данные записываются в базу (асинхронный режим читает их из других потоков)
+    и удаляются после выхода из блока
+    """
+    marker = uuid.uuid4().hex[:12]
+    user = User.objects.create(email=f"benchmark-{marker}@example.invalid", is_active=False)
+    mailshot = None
+    try:
+        message = Message.objects.create(subject=f"Benchmark {marker}",
+                                         body="Benchmark message\n" * 20,
+                                         user=user)
+        mailshot = MailshotPeriodicTask(defined_name=f"benchmark-{marker}",
+                                        message=message,
+                                        user=user,
+                                        enabled=False,
+                                        start_time=timezone.now(),
+                                        expires=timezone.now() + timedelta(hours=1))
+        mailshot.save()
+
+        clients = Client.objects.bulk_create(
+            [Client(email=f"client{i}-{marker}@example.invalid", name=f"Client {i}", user=user)
+             for i in range(recipients)],
+            batch_size=1000,
+        )
+        # bulk_create не вызывает сигналов: email временных клиентов уникальны,
+        # счётчик увеличивается явно и уменьшается сигналами при их удалении
+        StatisticsCounter.add(StatisticsCounter.Name.CLIENT_EMAILS, len(clients))
+        through = MailshotPeriodicTask.clients.through
+        through.objects.bulk_create(
+            [through(mailshotperiodictask_id=mailshot.pk, client_id=client.pk) for client in clients],
+            batch_size=1000,
+        )
+        yield mailshot
+    finally:
+        if mailshot is not None and mailshot.pk is not None:
+            mailshot.delete()
+        user.delete()
+
+
+def insert_child_rows(model: type[models.Model], objs: list[models.Model], batch_size: int = 1000):
+    """
+    Вставка строк собственной таблицы наследуемой модели, строки родительской
+    таблицы которых уже записаны (bulk_create для таких моделей не поддерживается)
+    """
+    fields = model._meta.local_concrete_fields
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(model._meta.db_table),
+        ", ".join(quote(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        for i in range(0, len(objs), batch_size):
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+                for obj in objs[i:i + batch_size]
+            ])
+
+
+def utc_midnight(moment: datetime) -> datetime:
+    """
+    Начало суток (UTC), к которым относится moment
+    """
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, moment.day, tzinfo=dt_timezone.utc)
+
+
+@contextmanager
+def synthetic_schedule(schedules: list[tuple[datetime, str, datetime | None, int]],
+                       moment: datetime | None = None,
+                       batch_size: int = 1000):
+    """
+    Временные включённые рассылки без клиентов с расписаниями schedules -
+    кортежами (время начала, частота, окончание, окно отправки в минутах).
+    next_run_at вычисляется на момент moment (по умолчанию текущий); чтобы
+    запущенный beat не отправил рассылки, их отправки должны быть в будущем.
+    Строки пишутся пачками в обход save() и удаляются после выхода из блока.
+    Возвращает queryset временных рассылок
+    """
+    marker = uuid.uuid4().hex[:12]
+    moment = moment or timezone.now()
+
+    user = User.objects.create(email=f"benchmark-{marker}@example.invalid", is_active=False)
+    crontabs = {}
+    try:
+        tasks = []
+        for i, (start_time, frequency, expires, _) in enumerate(schedules):
+            if (start_time, frequency) not in crontabs:
+                crontabs[start_time, frequency] = get_shared_crontab(start_time, frequency)
+            tasks.append(PeriodicTask(name=f"benchmark-{marker}-{i}",
+                                      task=settings.MAILSHOT_TASK_NAME,
+                                      crontab=crontabs[start_time, frequency],
+                                      start_time=start_time,
+                                      expires=expires))
+        tasks = PeriodicTask.objects.bulk_create(tasks, batch_size=batch_size)
+
+        messages = Message.objects.bulk_create(
+            [Message(subject=f"Benchmark {marker}", body="Benchmark", user=user) for _ in schedules],
+            batch_size=batch_size,
+        )
+
+        now = timezone.now()
+        mailshots = []
+        for i, (task, message, schedule) in enumerate(zip(tasks, messages, schedules)):
+            start_time, frequency, expires, delivery_window = schedule
+            offset = dispatch_offset(task.pk, timedelta(minutes=delivery_window))
+            mailshots.append(MailshotPeriodicTask(
+                periodictask_ptr_id=task.pk,
+                defined_name=f"benchmark-{marker}-{i}",
+                frequency=frequency,
+                delivery_window=delivery_window,
+                is_new=False,
+                status=MailshotPeriodicTask.Status.ENABLED,
+                next_run_at=get_next_run_at(start_time, frequency, expires, moment, offset=offset),
+                message_id=message.pk,
+                user_id=user.pk,
+                created_at=now,
+            ))
+        insert_child_rows(MailshotPeriodicTask, mailshots, batch_size=batch_size)
+
+        yield MailshotPeriodicTask.objects.filter(user=user)
+    finally:
+        # удаление без сбора связанных объектов: у временных рассылок их нет
+        for queryset in (MailshotPeriodicTask.objects.filter(user=user),
+                         PeriodicTask.objects.filter(name__startswith=f"benchmark-{marker}-"),
+                         Message.objects.filter(user=user)):
+            queryset._raw_delete(queryset.db)
+        collect_orphan_crontabs(crontab.pk for crontab in crontabs.values())
+        user.delete()
+
+
+def run_benchmark(pk: int, rate_limit: bool = False, **sender_attrs) -> dict:
+    """
+    Отправляет рассылку pk и возвращает результаты замера.
+    sender_attrs переопределяют атрибуты отправителя (delivery_engine,
+    delivery_mode, recipients_batch_size и т.д.)
+    """
+    sender = BenchmarkMailshotSender(pk, rate_limit=rate_limit)
+    for name, value in sender_attrs.items():
+        setattr(sender, name, value)
+
+    with QueryTimer().timing() as queries:
+        start = time.perf_counter()
+        result = sender.deliver()
+        finished = time.perf_counter()
+
+    elapsed = finished - start
+    total = sender.delivered + sender.failed
+
+    return {
+        "mailshot": pk,
+        "delivery_engine": sender.delivery_engine,
+        "delivery_mode": sender.delivery_mode,
+        "batch_size": sender.recipients_batch_size,
+        "status": result["status"],
+        "recipients": total,
+        "delivered": sender.delivered,
+        "failed": sender.failed,
+        "messages": sender.messages,
+        "elapsed": round(elapsed, 3),
+        "messages_per_second": round(sender.messages / elapsed, 2) if elapsed else 0,
+        "recipients_per_second": round(total / elapsed, 2) if elapsed else 0,
+        "batches": len(sender.batch_started),
+        "batch_latency": get_percentiles(sender.get_batch_latencies(finished)),
+        "db_time": round(queries.elapsed, 3),
+        "db_queries": queries.queries,
+        "smtp_time": round(sender.smtp_time, 3),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
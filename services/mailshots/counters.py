@@ -0,0 +1,115 @@
+"""
+Поддержание счётчиков статистики главной страницы (см. StatisticsCounter).
+
+Сохранение и удаление клиентов и рассылок меняет счётчики на единицу
+после фиксации транзакции. Количество уникальных email меняется, только если
+клиент с таким email первый или последний: проверка использует индекс
+ограничения unique_client_for_user (email, user). Прежние email клиента и статус
+рассылки запоминаются при загрузке из базы (см. from_db моделей), поэтому
+лишних запросов при сохранении нет.
+
+Массовые операции без сигналов (bulk_create, update, удаление в обход
+delete()) и гонки одновременных изменений дают расхождения, которые
+исправляет reconcile_counters
+"""
+from django.db import transaction
+from django.db.models import signals
+from django.utils import timezone
+
+from mailshots.models import Client, MailshotPeriodicTask, StatisticsCounter
+
+
+Name = StatisticsCounter.Name
+ENABLED = MailshotPeriodicTask.Status.ENABLED
+
+
+def email_used(email: str, using: str, exclude_pk: int | None = None) -> bool:
+    """
+    Есть ли клиент с таким email (кроме клиента exclude_pk)
+    """
+    return Client.objects.using(using).filter(email=email).exclude(pk=exclude_pk).exists()
+
+
+def client_saved(sender, instance, created, using, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = None if created else getattr(instance, "_loaded_email", None)
+    if created or previous is not None and previous != instance.email:
+        if not email_used(instance.email, using, exclude_pk=instance.pk):
+            StatisticsCounter.add(Name.CLIENT_EMAILS, 1, using=using)
+        if previous is not None and not email_used(previous, using):
+            StatisticsCounter.add(Name.CLIENT_EMAILS, -1, using=using)
+    instance._loaded_email = instance.email
+
+
+def client_deleted(sender, instance, using, **kwargs):
+    if not email_used(instance.email, using):
+        StatisticsCounter.add(Name.CLIENT_EMAILS, -1, using=using)
+
+
+def mailshot_saved(sender, instance, created, using, raw=False, **kwargs):
+    if raw:
+        return
+
+    if created:
+        StatisticsCounter.add(Name.MAILSHOTS, 1, using=using)
+        previous = None
+    elif hasattr(instance, "_loaded_status"):
+        previous = instance._loaded_status
+    else:
+        # рассылка не загружена из базы целиком: прежний статус неизвестен
+        instance._loaded_status = instance.status
+        return
+
+    was_active, is_active = previous == ENABLED, instance.status == ENABLED
+    if was_active != is_active:
+        StatisticsCounter.add(Name.ACTIVE_MAILSHOTS, 1 if is_active else -1, using=using)
+    instance._loaded_status = instance.status
+
+
+def mailshot_deleted(sender, instance, using, **kwargs):
+    StatisticsCounter.add(Name.MAILSHOTS, -1, using=using)
+    if instance.status == ENABLED:
+        StatisticsCounter.add(Name.ACTIVE_MAILSHOTS, -1, using=using)
+
+
+def connect_counters():
+    signals.post_save.connect(client_saved, sender=Client, dispatch_uid="counters_client_saved")
+    signals.post_delete.connect(client_deleted, sender=Client, dispatch_uid="counters_client_deleted")
+    signals.post_save.connect(mailshot_saved, sender=MailshotPeriodicTask, dispatch_uid="counters_mailshot_saved")
+    signals.post_delete.connect(mailshot_deleted, sender=MailshotPeriodicTask,
+                                dispatch_uid="counters_mailshot_deleted")
+
+
+def count_exact() -> dict[str, int]:
+    """
+    Точные значения счётчиков; полный подсчёт по таблицам
+    """
+    return {
+        Name.MAILSHOTS: MailshotPeriodicTask.objects.count(),
+        Name.ACTIVE_MAILSHOTS: MailshotPeriodicTask.objects.filter(status=ENABLED).count(),
+        Name.CLIENT_EMAILS: Client.objects.values("email").distinct().count(),
+    }
+
+
+def reconcile() -> dict[str, int]:
+    """
+    Записывает в счётчики точные значения; возвращает расхождения
+    (точное значение минус значение счётчика) для изменившихся счётчиков.
+    Строки счётчиков блокируются до подсчёта: приращения, зафиксированные
+    во время подсчёта, применятся после сверки, а не затрутся ею
+    """
+    drift = {}
+
+    with transaction.atomic():
+        counters = StatisticsCounter.objects.select_for_update().in_bulk(list(Name.values))
+        exact = count_exact()
+        for name, value in exact.items():
+            counter = counters.get(name) or StatisticsCounter(name=name)
+            if counter.value != value or counter.pk not in counters:
+                drift[name] = value - counter.value
+                counter.value = value
+                counter.updated_at = timezone.now()
+                counter.save()
+    return drift
@@ -0,0 +1,100 @@
+"""
+Общие строки CrontabSchedule для рассылок.
+
+Рассылки с одинаковым расписанием (минута, час, день месяца, день недели)
+ссылаются на одну строку CrontabSchedule, поэтому планировщик beat загружает
+и вычисляет по строке на расписание, а не на рассылку. Общая строка
+закрепляется за расписанием уникальным ключом SharedCrontab: таблица
+CrontabSchedule принадлежит django_celery_beat и ограничения уникальности
+не имеет. Строки, на которые больше не ссылается ни одна задача,
+удаляются collect_orphan_crontabs
+"""
+from datetime import datetime, timezone as dt_timezone
+from typing import Iterable
+
+from django.db import IntegrityError, transaction
+from django_celery_beat.models import CrontabSchedule
+
+
+CRONTAB_TIMEZONE = "UTC"
+
+
+def crontab_fields(start_time: datetime, frequency: str) -> dict:
+    """
+    Поля crontab для рассылки с временем начала start_time и частотой frequency.
+    Время начала приводится к UTC - часовому поясу расписания
+    """
+    start_time = start_time.astimezone(dt_timezone.utc)
+    fields = dict(
+        minute=str(start_time.minute),
+        hour=str(start_time.hour),
+        day_of_month="*",
+        month_of_year="*",
+        day_of_week="*",
+    )
+
+    if frequency == "WEEKLY":
+        # в cron неделя начинается с воскресенья (0)
+        fields["day_of_week"] = str(start_time.isoweekday() % 7)
+    elif frequency == "MONTHLY":
+        if start_time.day <= 28:
+            fields["day_of_month"] = str(start_time.day)
+        else:
+            # в коротких месяцах отправка переносится на последний день месяца
+            # (см. schedule.add_months); лишние срабатывания в длинных месяцах
+            # отбрасываются как повтор уже отправленного слота (см. MailshotRunGuard)
+            fields["day_of_month"] = ",".join(str(day) for day in range(28, start_time.day + 1))
+
+    return fields
+
+
+def crontab_key(fields: dict) -> str:
+    """
+    Ключ расписания в записи cron: минута, час, день месяца, месяц, день недели и часовой пояс
+    """
+    return " ".join((fields["minute"], fields["hour"], fields["day_of_month"],
+                     fields["month_of_year"], fields["day_of_week"], CRONTAB_TIMEZONE))
+
+
+def get_shared_crontab(start_time: datetime, frequency: str) -> CrontabSchedule:
+    """
+    Строка CrontabSchedule для расписания рассылки; создаётся, если такой ещё нет
+    """
+    # models импортирует этот модуль
+    from mailshots.models import SharedCrontab
+
+    fields = crontab_fields(start_time, frequency)
+    key = crontab_key(fields)
+    shared = SharedCrontab.objects.select_related("crontab").filter(key=key).first()
+    if shared is not None:
+        return shared.crontab
+
+    try:
+        with transaction.atomic():
+            crontab = CrontabSchedule.objects.create(**fields, timezone=CRONTAB_TIMEZONE)
+            SharedCrontab.objects.create(key=key, crontab=crontab)
+    except IntegrityError:
+        # строку для этого расписания одновременно создало другое сохранение
+        return SharedCrontab.objects.select_related("crontab").get(key=key).crontab
+    return crontab
+
+
+def collect_orphan_crontabs(pks: Iterable[int] | None = None) -> int:
+    """
+    Удаляет строки CrontabSchedule, на которые не ссылается ни одна периодическая задача.
+    pks - проверить только эти строки, None - все.
+
+    Строки сначала блокируются, а отсутствие ссылок проверяется повторно уже
+    под блокировкой: задача, успевшая сослаться на строку между выборкой
+    и удалением, не удаляется каскадом вместе с ней
+    """
+    queryset = CrontabSchedule.objects.filter(periodictask__isnull=True)
+    if pks is not None:
+        queryset = queryset.filter(pk__in=[pk for pk in pks if pk is not None])
+
+    with transaction.atomic():
+        locked = list(queryset.select_for_update(of=("self",)).values_list("pk", flat=True))
+        if not locked:
+            return 0
+        _, deleted = CrontabSchedule.objects.filter(pk__in=locked, periodictask__isnull=True).delete()
+    return deleted.get(CrontabSchedule._meta.label, 0)
@@ -0,0 +1,121 @@
+"""
+Приблизительное количество уникальных email клиентов (HyperLogLog в Redis).
+
+HyperLogLog занимает не больше 12 КБ при любом количестве клиентов,
+стандартная ошибка оценки Redis - 0,81%. Email добавляются в оценку при
+сохранении клиентов (после фиксации транзакции); удалённые клиенты из неё
+не вычитаются, поэтому оценка периодически пересобирается с нуля по таблице
+клиентов (команда rebuild_clients_estimate и задача rebuild_clients_estimate).
+Используется тегом clients_amount, если включена настройка CLIENTS_AMOUNT_ESTIMATE
+"""
+import logging
+from uuid import uuid4
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import signals
+
+from mailshots.models import Client
+from services.general.redis import get_redis, make_key
+
+
+logger = logging.getLogger(__name__)
+
+ESTIMATE_KEY = make_key("clients", "emails", "hll")
+# имя ключа, который сейчас пересобирается: новые email пишутся и в него
+REBUILD_KEY = make_key("clients", "emails", "hll", "rebuild")
+
+# email добавляются только в существующие ключи: пока оценка не собрана
+# (или пропала из Redis), тег clients_amount показывает точный счётчик.
+# Пока идёт пересборка, email добавляются и в пересобираемый ключ,
+# иначе клиенты, записанные во время пересборки, пропали бы из оценки
+# (если пересборка успела завершиться, её ключа уже нет, и он пропускается)
+ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('PFADD', key, unpack(ARGV))
+    end
+end
+return 1
+"""
+
+
+def add_emails(emails: list[str], key: str = ESTIMATE_KEY):
+    if not emails:
+        return
+    redis_client = get_redis()
+    keys = [key]
+    if key == ESTIMATE_KEY and (building_key := redis_client.get(REBUILD_KEY)):
+        keys.append(building_key.decode())
+    redis_client.eval(ADD_SCRIPT, len(keys), *keys, *emails)
+
+
+def get_estimate(key: str = ESTIMATE_KEY) -> int | None:
+    """
+    Оценка количества уникальных email; None, если оценка ещё не собрана
+    """
+    pipeline = get_redis().pipeline(transaction=False)
+    pipeline.exists(key)
+    pipeline.pfcount(key)
+    exists, count = pipeline.execute()
+    return count if exists else None
+
+
+def rebuild(key: str = ESTIMATE_KEY, batch_size: int = 10_000) -> int:
+    """
+    Собирает оценку заново по таблице клиентов во временном ключе и заменяет
+    им ключ key. Возвращает оценку после пересборки
+    """
+    redis_client = get_redis()
+    building_key = f"{key}:{uuid4().hex}"
+    # пустой ключ создаётся до того, как о нём узнают add_emails
+    redis_client.pfadd(building_key)
+    rebuild_key = REBUILD_KEY if key == ESTIMATE_KEY else None
+    if rebuild_key:
+        redis_client.set(rebuild_key, building_key, ex=settings.CLIENTS_ESTIMATE_REBUILD_TIMEOUT)
+
+    try:
+        emails = Client.objects.order_by().values_list("email", flat=True).iterator(chunk_size=batch_size)
+        batch = []
+        for email in emails:
+            batch.append(email)
+            if len(batch) == batch_size:
+                redis_client.pfadd(building_key, *batch)
+                batch = []
+        if batch:
+            redis_client.pfadd(building_key, *batch)
+
+        pipeline = redis_client.pipeline()
+        pipeline.rename(building_key, key)
+        if rebuild_key:
+            pipeline.delete(rebuild_key)
+        pipeline.pfcount(key)
+        return pipeline.execute()[-1]
+    except Exception:
+        redis_client.delete(building_key)
+        if rebuild_key:
+            redis_client.delete(rebuild_key)
+        raise
+
+
+def client_saved(sender, instance, created, using, raw=False, **kwargs):
+    """
+    Добавляет email сохранённого клиента в оценку после фиксации транзакции.
+    Недоступность Redis не мешает сохранению клиента
+    """
+    if raw or not settings.CLIENTS_AMOUNT_ESTIMATE:
+        return
+    email = instance.email
+
+    def add():
+        try:
+            add_emails([email])
+        except redis.RedisError as e:
+            logger.warning("Client email was not added to the estimate: %r", e)
+
+    transaction.on_commit(add, using=using)
+
+
+def connect_estimates():
+    signals.post_save.connect(client_saved, sender=Client, dispatch_uid="estimates_client_saved")
@@ -0,0 +1,80 @@
+"""
+Запись периодических задач без лишних перезагрузок расписания beat.
+
+DatabaseScheduler перечитывает всё расписание, когда меняется
+PeriodicTasks.last_update, а django-celery-beat обновляет его при каждом
+сохранении и удалении задачи и строки CrontabSchedule. Здесь уведомления об изменении расписания
+откладываются до фиксации транзакции и объединяются: сколько бы задач
+ни изменилось в транзакции, last_update обновляется один раз
+"""
+from django.db import connections, transaction
+from django.db.models import signals
+from django_celery_beat.models import CrontabSchedule, PeriodicTask, PeriodicTasks
+
+
+def update_changed():
+    PeriodicTasks.update_changed()
+
+
+def schedule_changed(using: str | None = None):
+    """
+    Отмечает изменение расписания: сразу, если транзакции нет, иначе
+    один раз после фиксации транзакции. При откате транзакции
+    (или точки сохранения, в которой было изменение) уведомление не отправляется
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        update_changed()
+        return
+
+    if not any(func is update_changed for _, func, _ in connection.run_on_commit):
+        transaction.on_commit(update_changed, using=using)
+
+
+def schedule_changed_receiver(sender, instance, using=None, **kwargs):
+    """
+    Замена обработчика сигналов django-celery-beat (PeriodicTasks.changed)
+    """
+    if not instance.no_changes:
+        schedule_changed(using)
+
+
+def crontab_changed_receiver(sender, using=None, **kwargs):
+    """
+    Замена обработчика сигналов django-celery-beat (PeriodicTasks.update_changed)
+    для строк CrontabSchedule, которые создаются и удаляются вместе с общими расписаниями
+    """
+    schedule_changed(using)
+
+
+def connect_signals():
+    """
+    Заменяет немедленное обновление PeriodicTasks.last_update при сохранении
+    и удалении PeriodicTask и CrontabSchedule на отложенное и объединённое
+    в пределах транзакции
+    """
+    for signal in (signals.pre_save, signals.pre_delete):
+        signal.disconnect(PeriodicTasks.changed, sender=PeriodicTask)
+        signal.connect(schedule_changed_receiver, sender=PeriodicTask,
+                       dispatch_uid="mailshots_schedule_changed")
+
+    for signal in (signals.post_save, signals.post_delete):
+        signal.disconnect(PeriodicTasks.update_changed, sender=CrontabSchedule)
+        signal.connect(crontab_changed_receiver, sender=CrontabSchedule,
+                       dispatch_uid="mailshots_crontab_changed")
+
+
+def reserve_periodic_task_pk(using: str = "default") -> int | None:
+    """
+    Заранее получает pk новой PeriodicTask из последовательности postgresql,
+    чтобы записать строку задачи сразу с окончательными именем и аргументами.
+    На базах без последовательностей возвращает None
+    """
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s))",
+                       [PeriodicTask._meta.db_table, PeriodicTask._meta.pk.column])
+        return cursor.fetchone()[0]
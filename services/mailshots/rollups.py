@@ -0,0 +1,150 @@
+"""
+Итоги отправок рассылок по часам и суткам (см. DeliveryRollup).
+
+Запись лога отправки прибавляет её результаты к итогам рассылки и пользователя
+за час и сутки отправки в той же транзакции, поэтому итоги не расходятся
+с логами. Границы суток берутся в часовом поясе TIME_ZONE.
+Отчёты читают только итоги: количество строк зависит от длины периода
+отчёта, количества рассылок и пользователей, но не от объёма истории логов
+"""
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, QuerySet, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from mailshots.models import DeliveryRollup, Log, MailshotDeliveryRollup, UserDeliveryRollup
+from services.general.db.buffers import BulkCreateBuffer
+
+
+Period = DeliveryRollup.Period
+TRUNCATE = {Period.HOUR: TruncHour, Period.DAY: TruncDay}
+TOTALS = ("runs", "failed_runs", "delivered", "failed")
+SUMS = {f"total_{name}": Sum(name) for name in TOTALS}
+
+# отчёты не длиннее этого периода строятся по часовым итогам
+HOURLY_REPORT_MAX_DAYS = 2
+
+
+def get_period_start(moment: datetime, period: str) -> datetime:
+    start = timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+    return start.replace(hour=0) if period == Period.DAY else start
+
+
+def increment(model: type[DeliveryRollup], lookup: dict, values: dict, defaults: dict | None = None):
+    """
+    Прибавляет values к строке итогов lookup, создавая её при первой отправке за период
+    """
+    changes = {name: F(name) + value for name, value in values.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **(defaults or {}), **values)
+    except IntegrityError:
+        # строку за этот период одновременно создала другая отправка
+        model.objects.filter(**lookup).update(**changes)
+
+
+def add_log(log: Log):
+    """
+    Прибавляет результаты отправки из лога к итогам рассылки и пользователя
+    """
+    values = dict(runs=1,
+                  failed_runs=int(log.status == Log.Status.FAIL),
+                  delivered=log.delivered,
+                  failed=log.failed,
+                  )
+    for period in Period:
+        period_start = get_period_start(log.mailshot_datetime, period)
+        increment(MailshotDeliveryRollup,
+                  dict(mailshot_id=log.mailshot_id, period=period, period_start=period_start),
+                  values,
+                  defaults=dict(user_id=log.user_id))
+        increment(UserDeliveryRollup,
+                  dict(user_id=log.user_id, period=period, period_start=period_start),
+                  values)
+
+
+def aggregate_logs(period: str, group_by: list[str], since: datetime | None = None) -> QuerySet:
+    """
+    Итоги по логам за каждый период, сгруппированные по полям group_by
+    (суммы называются total_<поле итогов>)
+    """
+    logs = Log.objects.order_by()
+    if since is not None:
+        logs = logs.filter(mailshot_datetime__gte=since)
+    return logs.annotate(period_start=TRUNCATE[period]("mailshot_datetime")).values(
+        *group_by, "period_start"
+    ).annotate(
+        total_runs=Count("pk"),
+        total_failed_runs=Count("pk", filter=Q(status=Log.Status.FAIL)),
+        total_delivered=Sum("delivered"),
+        total_failed=Sum("failed"),
+    )
+
+
+def rebuild(since: datetime | None = None, batch_size: int = 1000) -> dict[str, int]:
+    """
+    Пересобирает итоги по логам начиная с суток, в которые попадает since
+    (None - за всю историю). Возвращает количество записанных строк каждой модели.
+
+    Итоги удалённых рассылок пропадают вместе с их логами, поэтому пересборка
+    убирает их и из итогов пользователей
+    """
+    if since is not None:
+        since = get_period_start(since, Period.DAY)
+
+    written = {}
+    with transaction.atomic():
+        for model, group_by in ((MailshotDeliveryRollup, ["mailshot_id", "user_id"]),
+                                (UserDeliveryRollup, ["user_id"])):
+            rollups = model.objects.all()
+            if since is not None:
+                rollups = rollups.filter(period_start__gte=since)
+            rollups.delete()
+
+            with BulkCreateBuffer(model, size=batch_size) as buffer:
+                for period in Period:
+                    for row in aggregate_logs(period, group_by, since).iterator(chunk_size=batch_size):
+                        values = {name.removeprefix("total_"): value for name, value in row.items()}
+                        buffer.add(model(period=period, **values))
+            written[model._meta.model_name] = buffer.written
+    return written
+
+
+def get_report_period(days: int, moment: datetime | None = None) -> tuple[str, datetime]:
+    """
+    Гранулярность итогов и начало отчёта за последние days суток (включая текущие)
+    """
+    period = Period.HOUR if days <= HOURLY_REPORT_MAX_DAYS else Period.DAY
+    since = get_period_start(moment or timezone.now(), Period.DAY) - timedelta(days=days - 1)
+    return period, since
+
+
+def with_success_rate(row: dict) -> dict:
+    """
+    Переименовывает суммы total_<поле> в <поле> и добавляет долю доставленных писем, %
+    """
+    for name in TOTALS:
+        row[name] = row.pop(f"total_{name}") or 0
+    total = row["delivered"] + row["failed"]
+    row["success_rate"] = round(row["delivered"] / total * 100, 1) if total else None
+    return row
+
+
+def sum_rollups(rollups: QuerySet, *group_by: str, order_by: tuple[str, ...] = ()) -> list[dict]:
+    """
+    Суммы итогов, сгруппированные по полям group_by. В order_by можно
+    указывать и суммы (total_<поле>)
+    """
+    rows = rollups.order_by().values(*group_by).annotate(**SUMS).order_by(*order_by)
+    return [with_success_rate(row) for row in rows]
+
+
+def get_totals(rollups: QuerySet) -> dict:
+    """
+    Суммы итогов за весь отчёт
+    """
+    return with_success_rate(rollups.aggregate(**SUMS))
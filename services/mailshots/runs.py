@@ -0,0 +1,92 @@
+"""
+Защита от повторных и наложившихся запусков рассылки.
+
+Каждый запуск относится к слоту расписания - номеру отправки по времени
+начала и частоте рассылки. На слот в Redis ставится ключ запуска, поэтому
+повторный запуск того же слота (например, отправка сразу после активации
+и срабатывание beat в ту же минуту) отбрасывается. Пока запуск идёт,
+рассылка держит lease-блокировку, и запуски следующих слотов
+не накладываются на затянувшуюся отправку
+"""
+from django.conf import settings
+
+from services.general.redis import get_redis, make_key
+from services.mailshots.schedule import MAX_PERIOD
+
+
+COMPARE_AND_DELETE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+COMPARE_AND_EXPIRE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class MailshotRunGuard:
+    """
+    Ключ запуска и lease-блокировка одной рассылки.
+
+    token - идентификатор владельца запуска; используется id задачи celery,
+    который сохраняется между её повторами, поэтому повтор задачи
+    не считается дубликатом собственного запуска
+    """
+    DUPLICATE = "duplicate"
+    OVERLAP = "overlap"
+
+    def __init__(self, mailshot, token: str, slot: int | None = None):
+        self.mailshot = mailshot
+        self.token = token
+        self.slot = mailshot.run_slot() if slot is None else slot
+
+        self.run_key = make_key("mailshot", mailshot.pk, "run", self.slot)
+        self.lease_key = make_key("mailshot", mailshot.pk, "lease")
+
+    def set_owned(self, key: str, ttl: int) -> bool:
+        """
+        Ставит ключ, если его нет; True, если ключ поставлен сейчас или уже принадлежит владельцу
+        """
+        redis = get_redis()
+        if redis.set(key, self.token, nx=True, ex=ttl):
+            return True
+        return redis.get(key) == self.token.encode()
+
+    def acquire_lease(self) -> bool:
+        """
+        Захватывает только lease-блокировку, без отметки слота. Используется
+        ручной отправкой, которая не должна наложиться на идущую отправку,
+        но может повторить уже отправленный слот
+        """
+        return self.set_owned(self.lease_key, settings.MAILSHOT_RUN_LEASE)
+
+    def acquire(self) -> str | None:
+        """
+        Захватывает запуск. Возвращает None, если запуск можно выполнять,
+        иначе причину отказа: DUPLICATE или OVERLAP
+        """
+        if not self.acquire_lease():
+            return self.OVERLAP
+
+        run_ttl = int(MAX_PERIOD[self.mailshot.frequency].total_seconds())
+        if not self.set_owned(self.run_key, run_ttl):
+            self.release()
+            return self.DUPLICATE
+
+        return None
+
+    def extend(self, delay: int = 0):
+        """
+        Продлевает lease; вызывается по ходу долгой отправки. delay - через сколько
+        секунд запуск продолжится (повтор задачи после задержки)
+        """
+        get_redis().eval(COMPARE_AND_EXPIRE_SCRIPT, 1, self.lease_key, self.token,
+                         settings.MAILSHOT_RUN_LEASE + int(delay))
+
+    def release(self):
+        get_redis().eval(COMPARE_AND_DELETE_SCRIPT, 1, self.lease_key, self.token)
@@ -0,0 +1,100 @@
+"""
+Арифметика расписания рассылок: моменты отправки по времени начала и частоте.
+n-я отправка рассылки происходит в start_time + n периодов
+"""
+import calendar
+from datetime import datetime, timedelta
+
+
+PERIOD_DAYS = {
+    "DAILY": 1,
+    "WEEKLY": 7,
+}
+
+# верхняя граница длины периода, используется для времени жизни ключей
+MAX_PERIOD = {
+    "DAILY": timedelta(days=1),
+    "WEEKLY": timedelta(days=7),
+    "MONTHLY": timedelta(days=31),
+}
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    """
+    Сдвиг на месяцы; день, которого нет в целевом месяце, заменяется последним днём месяца
+    """
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+
+def occurrence(start_time: datetime, frequency: str, index: int) -> datetime:
+    """
+    Момент index-й отправки (нумерация с нуля)
+    """
+    if frequency == "MONTHLY":
+        return add_months(start_time, index)
+    return start_time + timedelta(days=PERIOD_DAYS[frequency] * index)
+
+
+def occurrence_index(start_time: datetime, frequency: str, moment: datetime) -> int:
+    """
+    Номер последней отправки, наступившей не позже moment; -1, если отправок ещё не было
+    """
+    if moment < start_time:
+        return -1
+
+    if frequency == "MONTHLY":
+        index = (moment.year - start_time.year) * 12 + moment.month - start_time.month
+        if occurrence(start_time, frequency, index) > moment:
+            index -= 1
+        return index
+
+    return (moment - start_time) // timedelta(days=PERIOD_DAYS[frequency])
+
+
+def next_occurrence(start_time: datetime, frequency: str, moment: datetime) -> datetime:
+    """
+    Первая отправка строго после moment
+    """
+    return occurrence(start_time, frequency, occurrence_index(start_time, frequency, moment) + 1)
+
+
+def dispatch_offset(pk: int, window: timedelta) -> timedelta:
+    """
+    Сдвиг отправок рассылки внутри окна отправки window, целое число секунд.
+    Сдвиг вычисляется мультипликативным хешем pk, поэтому постоянен для рассылки
+    и равномерно распределяет по окну рассылки с соседними pk
+    """
+    seconds = int(window.total_seconds())
+    if seconds <= 0 or pk is None:
+        return timedelta()
+    return timedelta(seconds=(pk * 2654435761) % 2 ** 32 * seconds // 2 ** 32)
+
+
+def is_occurrence(start_time: datetime, frequency: str, moment: datetime) -> bool:
+    """
+    Является ли moment одной из отправок рассылки
+    """
+    index = occurrence_index(start_time, frequency, moment)
+    return index >= 0 and occurrence(start_time, frequency, index) == moment
+
+
+def get_next_run_at(start_time: datetime, frequency: str, expires: datetime | None,
+                    moment: datetime, pending: datetime | None = None,
+                    offset: timedelta = timedelta()) -> datetime | None:
+    """
+    Момент следующей отправки рассылки, сдвинутой на offset (см. dispatch_offset):
+    pending, если это ещё не отправленная отправка текущего расписания,
+    иначе первая отправка после moment.
+    None, если отправка приходится на время после окончания рассылки
+    """
+    if pending is not None and is_occurrence(start_time, frequency, pending - offset):
+        run_at = pending
+    else:
+        run_at = next_occurrence(start_time, frequency, moment - offset) + offset
+
+    if expires is not None and run_at > expires:
+        return None
+    return run_at
@@ -0,0 +1,147 @@
+"""
+Планировщик beat, который отправляет рассылки по полю next_run_at.
+
+DatabaseScheduler держит в памяти все включённые задачи и при каждом изменении
+расписания перечитывает их и заново проверяет каждую. Рассылок может быть
+десятки тысяч, поэтому MailshotScheduler не загружает их в расписание beat:
+раз в MAILSHOT_SCHEDULER_WINDOW секунд он выбирает по индексу next_run_at только
+рассылки, отправка которых наступает в ближайшее окно, публикует для них
+send_mailshot (отправки внутри окна - с eta) и в той же транзакции сдвигает
+next_run_at на следующую отправку. Остальные задачи beat планируются как обычно
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+from django_celery_beat.schedulers import DatabaseScheduler
+from kombu.exceptions import OperationalError
+
+from mailshots.models import MailshotPeriodicTask
+from services.mailshots.schedule import dispatch_offset, get_next_run_at, occurrence_index
+
+
+logger = logging.getLogger(__name__)
+
+
+def claim_due_mailshots(until: datetime, moment: datetime | None = None, batch_size: int | None = None,
+                        mailshots: QuerySet | None = None) -> list[tuple[int, int, datetime, datetime | None]]:
+    """
+    Выбирает рассылки, отправка которых наступает не позже until, и сдвигает
+    их next_run_at на следующую отправку. Вызывается внутри транзакции:
+    строки блокируются (SKIP LOCKED, поэтому два процесса beat не отправят
+    одну рассылку дважды), и сдвиг отменяется, если отправку не удалось опубликовать.
+
+    Пропущенные отправки (например, пока beat был остановлен) не догоняются:
+    отправляется только последняя наступившая. Отправки рассылок с окном отправки
+    сдвинуты внутри окна (см. dispatch_offset), сдвиг меньше периода рассылки
+    и не меняет слот расписания. mailshots - рассылки, из которых выбирать
+    (по умолчанию все). Возвращает кортежи
+    (pk, слот расписания, момент отправки, окончание рассылки)
+    """
+    moment = moment or timezone.now()
+    batch_size = batch_size or settings.MAILSHOT_SCHEDULER_BATCH_SIZE
+    mailshots = MailshotPeriodicTask.objects.all() if mailshots is None else mailshots
+
+    rows = list(
+        mailshots
+        .select_for_update(skip_locked=True, of=("self",))
+        .due(until)
+        .order_by("next_run_at")
+        .values_list("pk", "start_time", "frequency", "expires", "delivery_window", "next_run_at")[:batch_size]
+    )
+
+    if not rows:
+        return []
+
+    claimed = []
+    advanced = []
+    for pk, start_time, frequency, expires, delivery_window, run_at in rows:
+        offset = dispatch_offset(pk, timedelta(minutes=delivery_window))
+        run_at = max(run_at, moment)
+        slot = occurrence_index(start_time, frequency, run_at - offset)
+        claimed.append((pk, slot, run_at, expires))
+        advanced.append(MailshotPeriodicTask(
+            pk=pk, next_run_at=get_next_run_at(start_time, frequency, expires, run_at, offset=offset)
+        ))
+
+    MailshotPeriodicTask.objects.bulk_update(advanced, ["next_run_at"])
+    return claimed
+
+
+class MailshotScheduler(DatabaseScheduler):
+    """
+    DatabaseScheduler без рассылок в расписании; рассылки отправляются по next_run_at
+    """
+    def __init__(self, *args, **kwargs):
+        self.mailshot_window = settings.MAILSHOT_SCHEDULER_WINDOW
+        self._next_mailshot_dispatch = 0.0
+        super().__init__(*args, **kwargs)
+
+    def all_as_schedule(self):
+        schedule = {}
+        for model in self.Model.objects.enabled().filter(mailshotperiodictask__isnull=True):
+            try:
+                schedule[model.name] = self.Entry(model, app=self.app)
+            except ValueError:
+                pass
+        return schedule
+
+    def tick(self, *args, **kwargs):
+        interval = super().tick(*args, **kwargs)
+
+        if time.monotonic() >= self._next_mailshot_dispatch:
+            self._next_mailshot_dispatch = time.monotonic() + self.mailshot_window
+            try:
+                self.dispatch_mailshots()
+            except (DatabaseError, OperationalError) as e:
+                # сдвиг next_run_at откатился, рассылки будут отправлены в следующем окне
+                logger.exception("MailshotScheduler: mailshots were not dispatched: %r", e)
+
+        return min(interval, max(self._next_mailshot_dispatch - time.monotonic(), 0))
+
+    def get_mailshots(self) -> QuerySet:
+        """
+        Рассылки, которые отправляет планировщик
+        """
+        return MailshotPeriodicTask.objects.all()
+
+    def dispatch_mailshots(self, now: datetime | None = None) -> int:
+        """
+        Публикует send_mailshot для рассылок ближайшего окна; возвращает количество
+        """
+        now = now or timezone.now()
+        until = now + timedelta(seconds=self.mailshot_window)
+        dispatched = 0
+
+        while True:
+            # beat вызывает метод вне транзакции; savepoint не нужен и внутри
+            # внешней транзакции (моделирование), иначе он добавляет запросы на каждый тик
+            with transaction.atomic(savepoint=False):
+                claimed = claim_due_mailshots(until, now, mailshots=self.get_mailshots())
+                if not claimed:
+                    break
+                self.publish_mailshots(claimed, now)
+            dispatched += len(claimed)
+            if len(claimed) < settings.MAILSHOT_SCHEDULER_BATCH_SIZE:
+                break
+
+        if dispatched:
+            logger.info("MailshotScheduler: dispatched %s mailshots", dispatched)
+        return dispatched
+
+    def publish_mailshots(self, claimed: list[tuple[int, int, datetime, datetime | None]], now: datetime):
+        """
+        Публикует send_mailshot для выбранных рассылок через одно соединение с брокером
+        """
+        with self.app.producer_or_acquire() as producer:
+            for pk, slot, run_at, expires in claimed:
+                self.app.send_task(settings.MAILSHOT_TASK_NAME,
+                                   kwargs={"pk": pk, "slot": slot},
+                                   eta=run_at if run_at > now else None,
+                                   expires=expires,
+                                   producer=producer,
+                                   ignore_result=True)
@@ -0,0 +1,54 @@
+"""
+Выборки рассылок для ручной отправки: пропущенные и неудачно отправленные
+"""
+from datetime import datetime
+
+from django.db.models import F, Max, Q, QuerySet
+from django.utils import timezone
+
+from mailshots.models import Log, MailshotPeriodicTask
+from services.mailshots.schedule import occurrence, occurrence_index
+
+
+def get_due_mailshots(queryset: QuerySet | None = None, moment: datetime | None = None) -> list[int]:
+    """
+    pk включённых и не истёкших рассылок, последняя по расписанию
+    отправка которых ещё не записана в лог (например, пропущена из-за сбоя)
+    """
+    moment = moment or timezone.now()
+    queryset = MailshotPeriodicTask.objects.all() if queryset is None else queryset
+
+    mailshots = (
+        queryset
+        .filter(enabled=True, start_time__lte=moment)
+        .filter(Q(expires__isnull=True) | Q(expires__gt=moment))
+        .annotate(last_log_at=Max("log__mailshot_datetime"))
+        .values_list("pk", "start_time", "frequency", "last_log_at")
+    )
+
+    due = []
+    for pk, start_time, frequency, last_log_at in mailshots:
+        scheduled_at = occurrence(start_time, frequency, occurrence_index(start_time, frequency, moment))
+        if last_log_at is None or last_log_at < scheduled_at:
+            due.append(pk)
+    return due
+
+
+def get_failed_mailshots(since: datetime, queryset: QuerySet | None = None) -> list[int]:
+    """
+    pk рассылок, последняя отправка которых начиная с since завершилась неудачно
+    """
+    queryset = MailshotPeriodicTask.objects.all() if queryset is None else queryset
+
+    mailshots = (
+        queryset
+        .annotate(
+            last_fail_at=Max("log__mailshot_datetime",
+                             filter=Q(log__status=Log.Status.FAIL, log__mailshot_datetime__gte=since)),
+            last_ok_at=Max("log__mailshot_datetime", filter=Q(log__status=Log.Status.OK)),
+        )
+        .filter(last_fail_at__isnull=False)
+        .filter(Q(last_ok_at__isnull=True) | Q(last_ok_at__lt=F("last_fail_at")))
+        .values_list("pk", flat=True)
+    )
+    return list(mailshots)
@@ -1,18 +1,125 @@
-from smtplib import SMTPException
+import asyncio
+from smtplib import SMTP, SMTPException, SMTPRecipientsRefused, SMTPResponseException, SMTPServerDisconnected
+from typing import Iterator
 
-from mailshots.models import Log, MailshotPeriodicTask
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.message import sanitize_address
+from django.db import transaction
+
+from mailshots.models import Log, MailshotPeriodicTask, DeliveryEvent
+from services.general.db.buffers import BulkCreateBuffer
+from services.general.messages.aiosmtp import AsyncSMTPClient
+from services.general.messages.connections import email_connection_pool
+from services.general.messages.merge import MERGE_FIELDS, MergeTemplate
+from services.general.messages.mime import PreparedEmailMessage, get_payload
+from services.general.messages.resilience import CircuitBreaker, CircuitOpen, TransientDeliveryError, is_transient
 from services.general.messages.senders import EmailSenderMixin
+from services.general.messages.throttling import OutboundRateLimiter
+from services.mailshots import rollups
+
+
+SMTP_OK = 250
+# письмо не отправлено, а ответа сервера нет: бэкенд с fail_silently=True
+# подавил ошибку или у письма не оказалось получателей
+SMTP_NOT_SENT = 554
 
 
 class MailshotSender(EmailSenderMixin):
     """
-    Класс, инкапсулирующий в себе логику механизма рассылки
+    Класс, инкапсулирующий в себе логику механизма рассылки.
+
+    client_range:
+        диапазон (первый pk, последний pk) клиентов рассылки, которым
+        отправляется сообщение; используется частями рассылки при её
+        разбиении на пачки. None - все клиенты рассылки
+
+    resume_after, delivered, failed:
+        продолжение прерванной отправки: клиенты с pk не больше resume_after
+        уже обработаны, их результаты учтены в счётчиках delivered и failed
+
+    delivery_mode:
+        "envelope" - одно письмо на пачку получателей; адреса, отклонённые
+        сервером на RCPT TO, считаются недоставленными;
+        "per_recipient" - отдельное письмо каждому получателю с учётом
+        результата отправки по каждому адресу
+
+    delivery_engine:
+        "sync" - письма уходят по очереди через соединение из пула;
+        "async" - письма уходят через async_concurrency одновременных
+        SMTP-сессий asyncio (не больше EMAIL_POOL_MAX_PER_HOST соединений с хостом
+        вместе с пулом), ответ каждой сессии ждётся не дольше async_timeout секунд
+
+    record_events:
+        записывать ли события доставки по каждому получателю (DeliveryEvent)
     """
-    def __init__(self, pk):
-        self.mailshot = MailshotPeriodicTask.objects.get(pk=pk)
+    recipients_batch_size: int = settings.MAILSHOT_RECIPIENTS_BATCH_SIZE
+    delivery_mode: str = settings.MAILSHOT_DELIVERY_MODE
+    delivery_engine: str = settings.MAILSHOT_DELIVERY_ENGINE
+    async_concurrency: int = settings.MAILSHOT_ASYNC_CONCURRENCY
+    async_timeout: int = settings.MAILSHOT_ASYNC_TIMEOUT
+    events_buffer_size: int = settings.MAILSHOT_EVENTS_BUFFER_SIZE
+    record_events: bool = True
+
+    def __init__(self, pk, client_range: tuple[int, int] | None = None,
+                 resume_after: int | None = None, delivered: int = 0, failed: int = 0):
+        self.mailshot = MailshotPeriodicTask.objects.select_related("message", "user").get(pk=pk)
+        self.client_range = client_range
+        self.resume_after = resume_after
+        self.delivered = delivered
+        self.failed = failed
+        # получателей в пачках, прошедших лимит скорости в этом запуске: асинхронный
+        # режим учитывает результаты позже, чем письма уходят в сессии
+        self.admitted = 0
+        self.events = None
+        self.run_guard = None
+
+    def iter_client_chunks(self, *fields: str, chunk_size: int) -> Iterator[list[tuple]]:
+        """
+        Читает связи рассылки с клиентами из промежуточной таблицы пачками
+        по chunk_size, переходя к следующей пачке по последнему client_id (keyset),
+        поэтому в памяти одновременно находится не больше одной пачки.
+        Первым значением каждого кортежа всегда идёт client_id
+        """
+        through = MailshotPeriodicTask.clients.through
+        links = through.objects.filter(mailshotperiodictask_id=self.mailshot.pk).order_by("client_id")
+
+        if self.client_range is not None:
+            first_pk, last_pk = self.client_range
+            links = links.filter(client_id__gte=first_pk, client_id__lte=last_pk)
+
+        last_client_pk = self.resume_after
+        while True:
+            chunk_links = links if last_client_pk is None else links.filter(client_id__gt=last_client_pk)
+            chunk = list(chunk_links.values_list("client_id", *fields)[:chunk_size])
+            if not chunk:
+                return
+
+            yield chunk
+
+            if len(chunk) < chunk_size:
+                return
+            last_client_pk = chunk[-1][0]
+
+    def get_clients(self):
+        clients = self.mailshot.clients.all()
+
+        if self.client_range is not None:
+            first_pk, last_pk = self.client_range
+            clients = clients.filter(pk__gte=first_pk, pk__lte=last_pk)
+
+        return clients
+
+    def get_client_ranges(self, batch_size: int) -> list[tuple[int, int]]:
+        """
+        Разбивает клиентов рассылки на пачки по batch_size клиентов,
+        возвращает границы пачек по pk
+        """
+        return [(chunk[0][0], chunk[-1][0]) for chunk in self.iter_client_chunks(chunk_size=batch_size)]
 
     def get_recipients(self) -> list:
-        return self.mailshot.clients.values_list("email", flat=True)
+        return self.get_clients().values_list("email", flat=True)
 
     def get_message_content(self) -> dict:
         return {
@@ -20,17 +127,350 @@ class MailshotSender(EmailSenderMixin):
             "message": self.mailshot.message.body,
         }
 
+    def get_rate_limiter(self) -> OutboundRateLimiter | None:
+        if settings.EMAIL_RATE_LIMIT_ENABLED:
+            return OutboundRateLimiter(user_pk=self.mailshot.user_id)
+        return None
+
+    def before_chunk(self, deliveries: list[tuple[list[tuple], EmailMessage]]):
+        """
+        Вызывается перед отправкой каждой пачки: продлевает блокировку запуска
+        и ждёт лимита скорости. Пока ничего не отправлено, ожидание лимита
+        ограничено EMAIL_RATE_LIMIT_MAX_WAIT, и при его превышении задача может
+        быть перенесена целиком; после начала отправки рассылка дожидается
+        лимита, чтобы не отправлять письма повторно
+        """
+        if self.run_guard is not None:
+            self.run_guard.extend()
+
+        recipients = sum(len(clients) for clients, _ in deliveries)
+        started = self.admitted or self.delivered or self.failed
+        self.throttle(recipients, max_wait=None if started else settings.EMAIL_RATE_LIMIT_MAX_WAIT)
+        self.admitted += recipients
+
+    def build_deliveries(self, chunk: list[tuple], content: dict) -> list[tuple[list[tuple], EmailMessage]]:
+        """
+        Собирает письма для пачки клиентов. Каждое письмо идёт в паре
+        со списком (client_pk, email) клиентов, которым оно адресовано:
+        в режиме per_recipient - по письму на клиента, иначе одно письмо на пачку.
+        Сообщение с полями подстановки всегда отправляется по письму на клиента
+        """
+        from_email = self.from_email or settings.EMAIL_HOST_USER
+
+        if "templates" in content:
+            subject_template, body_template = content["templates"]
+            values = [row[1:] for row in chunk]
+            subjects = subject_template.render_many(values)
+            bodies = body_template.render_many(values)
+            return [([(row[0], row[1])], EmailMessage(subject, body, from_email, [row[1]]))
+                    for row, subject, body in zip(chunk, subjects, bodies)]
+
+        subject, body, payload = content["subject"], content["message"], content["payload"]
+
+        if self.delivery_mode == "per_recipient":
+            return [([(client_pk, email)], PreparedEmailMessage(subject, body, from_email, [email], payload))
+                    for client_pk, email in chunk]
+
+        return [(chunk, PreparedEmailMessage(subject, body, from_email, [email for _, email in chunk], payload))]
+
+    def iter_delivery_chunks(self) -> Iterator[list[tuple[list[tuple], EmailMessage]]]:
+        """
+        Письма рассылки, сгруппированные по прочитанным из базы пачкам клиентов.
+
+        Сообщение без полей подстановки собирается в MIME-представление (или берётся
+        из кеша) один раз на запуск, для каждого письма подставляются только получатели.
+        Заголовок и текст сообщения с полями подстановки компилируются один раз,
+        а значения полей читаются из базы вместе с адресами клиентов
+        """
+        content = self.get_message_content()
+        subject_template = MergeTemplate(content["subject"])
+        body_template = MergeTemplate(content["message"])
+
+        if subject_template.is_static and body_template.is_static:
+            fields = ["client__email"]
+            content["payload"] = get_payload(
+                content["subject"], content["message"], self.from_email or settings.EMAIL_HOST_USER
+            )
+        else:
+            fields = [f"client__{field}" for field in MERGE_FIELDS]
+            content["templates"] = subject_template, body_template
+
+        for chunk in self.iter_client_chunks(*fields, chunk_size=self.recipients_batch_size):
+            yield self.build_deliveries(chunk, content)
+
+    @staticmethod
+    def decode_error(error: bytes | str) -> str:
+        return error.decode(errors="replace") if isinstance(error, bytes) else str(error)
+
+    def get_error_response(self, e: SMTPException) -> tuple[int, str]:
+        """
+        Код и текст ответа сервера из исключения smtplib
+        """
+        if isinstance(e, SMTPRecipientsRefused):
+            code, error = next(iter(e.recipients.values()))
+        else:
+            code, error = e.smtp_code, e.smtp_error
+        return code, self.decode_error(error)
+
+    def get_refused(self, refused: dict, addresses: dict[str, str]) -> dict[str, tuple[int, str]]:
+        """
+        Отказавшие получатели письма, принятого сервером: адрес клиента -> код и текст ответа.
+        addresses - адреса, переданные серверу, и соответствующие им адреса клиентов
+        """
+        return {addresses.get(address, address): (code, self.decode_error(error))
+                for address, (code, error) in refused.items()}
+
+    @staticmethod
+    def sendmail(connection, message: EmailMessage) -> tuple[dict, dict[str, str]] | None:
+        """
+        Отправляет письмо через почтовый бэкенд. Возвращает словарь отказавших
+        получателей (как smtplib.SMTP.sendmail) и адреса, переданные серверу,
+        с соответствующими им адресами клиентов; None, если письмо не отправлено.
+
+        SMTP-бэкенд django отбрасывает словарь отказавших получателей,
+        поэтому письмо передаётся его открытому соединению smtplib напрямую,
+        так же, как это делает сам бэкенд. Прочие бэкенды получателям не отказывают
+        """
+        recipients = message.recipients()
+        smtp = getattr(connection, "connection", None)
+        if not isinstance(smtp, SMTP):
+            return ({}, {}) if connection.send_messages([message]) else None
+        if not recipients:
+            return None
+
+        encoding = message.encoding or settings.DEFAULT_CHARSET
+        addresses = {sanitize_address(address, encoding): address for address in recipients}
+        refused = smtp.sendmail(sanitize_address(message.from_email, encoding),
+                                list(addresses),
+                                message.message().as_bytes(linesep="\r\n"))
+        return refused, addresses
+
+    def send_message(self, connection, message: EmailMessage) -> tuple[int, str, dict]:
+        """
+        Отправляет одно письмо через уже открытое соединение.
+        Возвращает код и текст ответа сервера и отказавших получателей принятого
+        письма (см. get_refused); письмо, которое бэкенд не отправил
+        без исключения, считается недоставленным.
+        Если сервер оборвал соединение, оно открывается заново и письмо отправляется повторно
+        """
+        for attempt in range(2):
+            try:
+                sent = self.sendmail(connection, message)
+                if sent is None:
+                    return SMTP_NOT_SENT, "Message not sent", {}
+                return SMTP_OK, "OK", self.get_refused(*sent)
+            except SMTPServerDisconnected:
+                connection.close()
+                if attempt:
+                    raise
+                connection.open()
+            except (SMTPRecipientsRefused, SMTPResponseException) as e:
+                code, response = self.get_error_response(e)
+                return code, response, {}
+
+    async def send_message_async(self, client: AsyncSMTPClient, message: EmailMessage) -> tuple[int, str, dict]:
+        """
+        Асинхронный аналог send_message для сессии AsyncSMTPClient
+        """
+        payload = message.message().as_bytes(linesep="\r\n")
+
+        for attempt in range(2):
+            if not client.is_connected:
+                await client.connect()
+            try:
+                refused = await client.sendmail(message.from_email, message.recipients(), payload)
+                return SMTP_OK, "OK", self.get_refused(refused, {})
+            except SMTPServerDisconnected:
+                client.abort()
+                if attempt:
+                    raise
+            except (SMTPRecipientsRefused, SMTPResponseException) as e:
+                code, response = self.get_error_response(e)
+                return code, response, {}
+
+    def record_results(self, clients: list[tuple], code: int, response: str, refused: dict | None = None):
+        """
+        Учёт результата отправки письма: счётчики для лога
+        и события доставки в буфер по каждому получателю.
+        Получатели из refused (см. get_refused) учитываются с ответом сервера на их адрес
+        """
+        refused = refused or {}
+        for client_pk, email in clients:
+            client_code, client_response = refused.get(email, (code, response))
+            if client_code == SMTP_OK:
+                self.delivered += 1
+            else:
+                self.failed += 1
+
+            if self.record_events:
+                self.events.add(DeliveryEvent(mailshot_id=self.mailshot.pk,
+                                              client_id=client_pk,
+                                              status_code=client_code,
+                                              response=client_response[:64],
+                                              ))
+
+    def record_many(self, results: list[tuple[list[tuple], int, str, dict]]):
+        for result in results:
+            self.record_results(*result)
+
+    def send_sync(self):
+        """
+        Отправляет письма по очереди через одно открытое соединение пула.
+        Отказ сервера принять отдельное письмо не прерывает рассылку
+        """
+        with email_connection_pool.connection() as connection:
+            for deliveries in self.iter_delivery_chunks():
+                self.before_chunk(deliveries)
+                for clients, message in deliveries:
+                    self.record_results(clients, *self.send_message(connection, message))
+                self.resume_after = deliveries[-1][0][-1][0]
+
+    def send_async(self):
+        """
+        Отправляет письма через async_concurrency одновременных SMTP-сессий
+        в одном процессе. Обращения к базе выполняются вне цикла событий
+        через sync_to_async
+        """
+        asyncio.run(self._send_async())
+
+    async def _send_async(self):
+        queue = asyncio.Queue(maxsize=self.async_concurrency * 2)
+        results = []
+        # сколько писем каждой пачки ещё не отправлено, по pk последнего клиента пачки
+        pending = {}
+
+        async def session():
+            # сессия занимает соединение с хостом из общего с пулом ограничения
+            await email_connection_pool.acquire_slot_async()
+            client = AsyncSMTPClient(timeout=self.async_timeout)
+            try:
+                while (delivery := await queue.get()) is not None:
+                    chunk_key, clients, message = delivery
+                    results.append((chunk_key, clients, *await self.send_message_async(client, message)))
+            finally:
+                await client.quit()
+                email_connection_pool.release_slot()
+
+        async def put(delivery):
+            """
+            Кладёт письмо в очередь, прерывая рассылку, если одна из сессий упала
+            """
+            putter = asyncio.ensure_future(queue.put(delivery))
+            await asyncio.wait([putter, *sessions], return_when=asyncio.FIRST_COMPLETED)
+            for task in sessions:
+                if task.done():
+                    putter.cancel()
+                    task.result()
+
+        async def record():
+            drained = results[:]
+            del results[:len(drained)]
+            await sync_to_async(self.record_many)([result[1:] for result in drained])
+
+            for chunk_key, *_ in drained:
+                pending[chunk_key] -= 1
+            # точка продолжения сдвигается только по полностью отправленным пачкам
+            while pending and not pending[next(iter(pending))]:
+                self.resume_after = next(iter(pending))
+                del pending[self.resume_after]
+
+        concurrency = min(self.async_concurrency, email_connection_pool.max_per_host)
+        sessions = [asyncio.create_task(session()) for _ in range(concurrency)]
+        chunks = self.iter_delivery_chunks()
+        try:
+            while deliveries := await sync_to_async(next)(chunks, None):
+                await sync_to_async(self.before_chunk)(deliveries)
+                chunk_key = deliveries[-1][0][-1][0]
+                pending[chunk_key] = len(deliveries)
+                for clients, message in deliveries:
+                    await put((chunk_key, clients, message))
+                await record()
+
+            for _ in sessions:
+                await queue.put(None)
+            await asyncio.gather(*sessions)
+        finally:
+            for task in sessions:
+                task.cancel()
+            await record()
+
+    def get_progress(self) -> dict:
+        """
+        Состояние отправки, с которого её можно продолжить
+        """
+        return dict(resume_after=self.resume_after, delivered=self.delivered, failed=self.failed)
+
+    def get_result(self, status: str, response: str) -> dict:
+        return dict(status=status, response=response, delivered=self.delivered, failed=self.failed)
+
+    def deliver(self) -> dict:
+        """
+        Отправляет сообщение, не записывая лог.
+        Возвращает статус, ответ сервиса отправки и счётчики доставленных
+        и недоставленных писем.
+
+        Временные ошибки (обрыв соединения, таймауты, ответы 4xx) не пишутся в лог,
+        а пробрасываются как TransientDeliveryError, чтобы отправку можно было повторить
+        с места остановки (см. get_progress). Если SMTP-хост недоступен по данным
+        circuit breaker, отправка не начинается и бросается CircuitOpen
+        """
+        breaker = CircuitBreaker.for_smtp_host() if settings.EMAIL_CIRCUIT_BREAKER_ENABLED else None
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpen(breaker.name, breaker.retry_after())
+
+        try:
+            with BulkCreateBuffer(DeliveryEvent, size=self.events_buffer_size) as self.events:
+                if self.delivery_engine == "async":
+                    self.send_async()
+                else:
+                    self.send_sync()
+        except OSError as e:
+            if not is_transient(e):
+                return self.get_result(Log.Status.FAIL, "Error")
+            if breaker is not None:
+                breaker.record_failure()
+            raise TransientDeliveryError(str(e)) from e
+
+        if breaker is not None:
+            breaker.record_success()
+
+        total = self.delivered + self.failed
+        status = Log.Status.OK if self.delivered or not total else Log.Status.FAIL
+        return self.get_result(status, f"{self.delivered}/{total}")
+
+    def write_log(self, status: str, response: str, delivered: int = 0, failed: int = 0) -> Log:
+        """
+        Записывает лог отправки и прибавляет её результаты к итогам за час и сутки
+        """
+        with transaction.atomic():
+            log = Log.objects.create(mailshot=self.mailshot,
+                                     status=status,
+                                     response=response,
+                                     delivered=delivered,
+                                     failed=failed,
+                                     user=self.mailshot.user,
+                                     )
+            rollups.add_log(log)
+        return log
+
+    def deliver_and_log(self) -> dict:
+        """
+        Отправка без повторов: временная ошибка записывается в лог как неуспешная отправка.
+        CircuitOpen пробрасывается без записи лога: отправка не начиналась
+        """
+        try:
+            result = self.deliver()
+        except CircuitOpen:
+            raise
+        except TransientDeliveryError:
+            result = self.get_result(Log.Status.FAIL, "Error")
+
+        self.write_log(**result)
+        return result
+
     def send(self):
         try:
-            response = super().send()
-            status = Log.Status.OK
-        except SMTPException:
-            response = "Error"
-            status = Log.Status.FAIL
-
-        Log.objects.create(mailshot=self.mailshot,
-                           status=status,
-                           response=response,
-                           user=self.mailshot.user,
-                           )
-        return f"{status} | response: {response}"
+            result = self.deliver_and_log()
+        except CircuitOpen as e:
+            return f"skipped | response: {e}"
+        return f"{result['status']} | response: {result['response']}"
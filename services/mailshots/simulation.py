@@ -0,0 +1,190 @@
+"""
+Моделирование работы планировщика рассылок на виртуальных часах.
+
+Синтетические рассылки записываются в базу, после чего MailshotScheduler
+выполняет тики с шагом окна выборки по виртуальному времени: выбирает
+рассылки и сдвигает их next_run_at теми же запросами, что и в работе, но вместо
+публикации задач запоминает моменты отправок. По ним считаются отправки
+в минуту и количество одновременно идущих отправок (длительность отправки
+оценивается по количеству получателей и скорости отправки)
+"""
+import math
+import random
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from django.db.models import QuerySet
+
+from conf.celery import app
+from services.mailshots.benchmark import QueryTimer, get_percentiles
+from services.mailshots.scheduler import MailshotScheduler
+
+
+FREQUENCY_WEIGHTS = {"DAILY": 60, "WEEKLY": 30, "MONTHLY": 10}
+
+# пользователи выбирают круглое время в рабочие часы
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 1, 2, 4, 8, 12, 10, 8, 6, 6, 8, 6, 4, 3, 2, 2, 1, 1, 1, 1]
+MINUTE_WEIGHTS = {0: 60, 30: 20, 15: 7, 45: 7}
+# доля минут, выбранных произвольно, а не из MINUTE_WEIGHTS
+ODD_MINUTE_WEIGHT = 6
+
+
+@dataclass
+class SimulationSettings:
+    mailshots: int = 10_000
+    days: int = 30
+    tick: int = 30
+    # доля рассылок с окном отправки и размер окна, мин
+    window_share: float = 0.0
+    delivery_window: int = 15
+    # медиана количества получателей и скорость отправки одной рассылки, писем в секунду
+    recipients: int = 500
+    send_rate: float = 100.0
+    # доля рассылок, начинающихся и заканчивающихся в течение моделируемого периода
+    new_share: float = 0.1
+    expiring_share: float = 0.25
+    seed: int | None = None
+
+
+def generate_schedules(options: SimulationSettings, start: datetime,
+                       rng: random.Random) -> list[tuple[datetime, str, datetime, int]]:
+    """
+    Расписания синтетических рассылок (время начала, частота, окончание, окно отправки).
+    Большинство рассылок начались до start и идут весь период, часть начинается
+    и часть заканчивается в течение периода
+    """
+    end = start + timedelta(days=options.days)
+    frequencies = list(FREQUENCY_WEIGHTS)
+    minutes = [*MINUTE_WEIGHTS, None]
+    minute_weights = [*MINUTE_WEIGHTS.values(), ODD_MINUTE_WEIGHT]
+
+    schedules = []
+    for _ in range(options.mailshots):
+        if rng.random() < options.new_share:
+            day = start + timedelta(days=rng.randrange(options.days))
+        else:
+            day = start - timedelta(days=rng.randint(1, 60))
+        minute = rng.choices(minutes, minute_weights)[0]
+        start_time = day.replace(hour=rng.choices(range(24), HOUR_WEIGHTS)[0],
+                                 minute=rng.randrange(60) if minute is None else minute)
+
+        if rng.random() < options.expiring_share:
+            expires = start + (end - start) * rng.random()
+        else:
+            expires = start + timedelta(days=365)
+        expires = max(expires, start_time + timedelta(days=1))
+
+        window = options.delivery_window if rng.random() < options.window_share else 0
+        schedules.append((start_time, rng.choices(frequencies, FREQUENCY_WEIGHTS.values())[0], expires, window))
+    return schedules
+
+
+def generate_durations(pks: list[int], options: SimulationSettings, rng: random.Random) -> dict[int, float]:
+    """
+    Длительность отправки каждой рассылки, с: количество получателей распределено
+    логнормально с медианой options.recipients
+    """
+    mu = math.log(options.recipients)
+    return {pk: max(1, round(rng.lognormvariate(mu, 1.0))) / options.send_rate for pk in pks}
+
+
+class SimulatedMailshotScheduler(MailshotScheduler):
+    """
+    MailshotScheduler, который выбирает только рассылки mailshots
+    и запоминает отправки вместо публикации задач
+    """
+    def __init__(self, *args, mailshots: QuerySet, **kwargs):
+        self.mailshots = mailshots
+        self.fired: list[tuple[int, datetime]] = []
+        super().__init__(*args, **kwargs)
+
+    def get_mailshots(self) -> QuerySet:
+        return self.mailshots
+
+    def publish_mailshots(self, claimed, now):
+        self.fired.extend((pk, run_at) for pk, _, run_at, _ in claimed)
+
+
+@dataclass
+class TickStats:
+    cpu: list[float] = field(default_factory=list)
+    queries: list[int] = field(default_factory=list)
+
+
+def run_simulation(start: datetime, options: SimulationSettings,
+                   mailshots: QuerySet) -> tuple[list[tuple[int, datetime]], TickStats]:
+    """
+    Тики планировщика по рассылкам mailshots с шагом options.tick с start
+    в течение options.days суток. Остальные рассылки не выбираются, иначе
+    виртуальные часы сдвинули бы их next_run_at на год вперёд.
+    Возвращает отправки (pk, момент) и затраты каждого тика
+    """
+    scheduler = SimulatedMailshotScheduler(app=app, lazy=True, mailshots=mailshots)
+    scheduler.mailshot_window = options.tick
+    stats = TickStats()
+
+    moment = start
+    end = start + timedelta(days=options.days)
+    while moment < end:
+        with QueryTimer().timing() as queries:
+            cpu = time.process_time()
+            scheduler.dispatch_mailshots(moment)
+            stats.cpu.append(time.process_time() - cpu)
+        stats.queries.append(queries.queries)
+        moment += timedelta(seconds=options.tick)
+
+    return scheduler.fired, stats
+
+
+def get_peak_concurrency(fired: list[tuple[int, datetime]], durations: dict[int, float]) -> tuple[int, datetime | None]:
+    """
+    Наибольшее количество одновременно идущих отправок и момент, когда оно достигнуто
+    """
+    events = []
+    for pk, run_at in fired:
+        events.append((run_at, 1))
+        events.append((run_at + timedelta(seconds=durations[pk]), -1))
+    # окончание отправки раньше начала другой в тот же момент
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    peak, peak_at, current = 0, None, 0
+    for moment, delta in events:
+        current += delta
+        if current > peak:
+            peak, peak_at = current, moment
+    return peak, peak_at
+
+
+def build_report(fired: list[tuple[int, datetime]], stats: TickStats, durations: dict[int, float],
+                 options: SimulationSettings) -> dict:
+    per_minute = Counter(run_at.replace(second=0, microsecond=0) for _, run_at in fired)
+    minutes = options.days * 24 * 60
+    # минуты без отправок тоже входят в распределение
+    counts = sorted(per_minute.values()) + [0] * (minutes - len(per_minute))
+    peak, peak_at = get_peak_concurrency(fired, durations)
+
+    return {
+        "mailshots": options.mailshots,
+        "days": options.days,
+        "tick_seconds": options.tick,
+        "ticks": len(stats.cpu),
+        "fires": len(fired),
+        "fires_per_minute": {
+            "mean": round(len(fired) / minutes, 2),
+            "p50": statistics.quantiles(counts, n=100, method="inclusive")[49],
+            "p99": statistics.quantiles(counts, n=100, method="inclusive")[98],
+            "max": max(counts),
+            "busiest": [(minute.isoformat(), count) for minute, count in per_minute.most_common(5)],
+        },
+        "peak_concurrency": peak,
+        "peak_concurrency_at": peak_at.isoformat() if peak_at else None,
+        "tick_cpu": get_percentiles(stats.cpu) | {"total_s": round(sum(stats.cpu), 3)},
+        "tick_queries": {
+            "mean": round(statistics.fmean(stats.queries), 2),
+            "max": max(stats.queries),
+            "total": sum(stats.queries),
+        },
+    }
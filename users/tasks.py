@@ -1,7 +1,10 @@
 from celery import shared_task
 from django.core.mail import send_mail
 
+from services.general.messages.connections import email_connection_pool
+
 
 @shared_task
 def async_send(**kwargs):
-    send_mail(**kwargs)
+    with email_connection_pool.connection() as connection:
+        send_mail(connection=connection, **kwargs)